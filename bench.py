@@ -0,0 +1,477 @@
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fec_controller import parse_ladder
+from latency import LatencyTracker
+from pmtu import IP_HEADER, UDP_HEADER, tinyvpn_mtu
+
+
+# One-way netem settings, applied to both directions of the emulated link
+PROFILES = {
+    "clean": "delay 20ms",
+    "jitter": "delay 30ms 8ms distribution normal",
+    "reorder": "delay 30ms reorder 15% 50%",
+    "lossy": "delay 30ms 4ms loss random 3%",
+    # Gilbert-Elliott loss: about 7% of packets, lost in runs of four on average
+    "bursty": "delay 40ms 4ms loss gemodel 2% 25%",
+    "mobile": "delay 60ms 15ms distribution normal loss random 5% 25% reorder 10% 50%",
+}
+# The README's FEC and mode advice; timeouts default to what the generators pick per mode
+PRESETS = {
+    "gaming": {"fec": "10:6", "mode": "1"},
+    "no-fec": {"fec": "0", "mode": "1"},
+    "poor-link": {"fec": "10:6", "mode": "0"},
+    "bulk": {"fec": "20:10", "mode": "0"},
+}
+DEFAULT_TIMEOUT = {"0": 4, "1": 0, None: 4}
+
+# Kind, sequence number and send time (ns) at the start of every synthetic game datagram
+PROBE = struct.Struct("!BIQ")
+WARMUP = 0
+MEASURE = 1
+# Seconds the sender waits for the last replies; later ones count as lost
+LINGER = 1.0
+
+# Counted by the qdisc with every packet, but not part of what a path carries
+ETHERNET_HEADER = 14
+
+HELPER_PATH = os.path.abspath(__file__)
+STUB_PATH = os.path.join(os.path.dirname(HELPER_PATH), "bench_stub.py")
+
+
+class BenchSetting:
+    """TinyVPN options under test, as the configuration generators write them"""
+    __slots__ = ("name", "fec", "mode", "mtu")
+
+    def __init__(self, name: str, fec: str, mode: str, mtu: int):
+        self.name = name
+        self.fec = fec
+        self.mode = mode
+        self.mtu = mtu
+
+    def describe(self) -> str:
+        return f"{self.fec} {self.mode} --mtu {self.mtu}"
+
+
+def parse_setting(spec: str) -> BenchSetting:
+    """A preset name and/or 'fec=10:6,mode=1,timeout=0,mtu=1400' overrides (fec=0 disables FEC)"""
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    values: Dict[str, str] = {}
+    if parts and "=" not in parts[0]:
+        preset = parts.pop(0)
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown preset {preset!r}; use one of {', '.join(PRESETS)}")
+        values.update(PRESETS[preset])
+    for part in parts:
+        key, separator, value = part.partition("=")
+        if not separator or key not in ("fec", "mode", "timeout", "mtu"):
+            raise ValueError(f"Invalid setting {part!r}; use fec=, mode=, timeout= or mtu=")
+        values[key] = value
+    if not values:
+        raise ValueError("Empty setting")
+
+    fec = values.get("fec", "10:6")
+    if fec in ("0", "off"):
+        fec_option = "--disable-fec"
+    else:
+        parse_ladder([fec])
+        fec_option = f"-f{fec}"
+    mode = values.get("mode")
+    if mode not in ("0", "1", None):
+        raise ValueError(f"Mode must be 0 or 1, not {mode!r}")
+    try:
+        timeout = int(values.get("timeout", DEFAULT_TIMEOUT[mode]))
+        mtu = int(values["mtu"]) if "mtu" in values else tinyvpn_mtu(1500, 4, fec_option != "--disable-fec")
+    except ValueError:
+        raise ValueError(f"Timeout and MTU must be numbers ({spec!r})")
+    if not 100 <= mtu <= 1500:
+        raise ValueError(f"MTU {mtu} is out of range")
+    mode_option = f"--mode {mode} --timeout {timeout}" if mode is not None else f"--timeout {timeout}"
+    return BenchSetting(spec, fec_option, mode_option, mtu)
+
+
+class BenchResult:
+    """Measurements of one setting under one link profile"""
+    __slots__ = ("profile", "setting", "report", "reordered", "duplicates", "overhead", "error")
+
+    def __init__(self, profile: str, setting: BenchSetting, report: Optional[Dict[str, Optional[float]]] = None,
+                 reordered: int = 0, duplicates: int = 0, overhead: Optional[float] = None,
+                 error: Optional[str] = None):
+        self.profile = profile
+        self.setting = setting
+        # LatencyTracker window of the round trips: percentiles, jitter, loss and loss bursts
+        self.report = report
+        self.reordered = reordered
+        self.duplicates = duplicates
+        # Extra link bytes relative to sending the game traffic directly
+        self.overhead = overhead
+        self.error = error
+
+    @property
+    def delivery(self) -> Optional[float]:
+        if not self.report or not self.report["sent"]:
+            return None
+        return self.report["received"] / self.report["sent"]
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "profile": self.profile,
+            "netem": PROFILES.get(self.profile),
+            "setting": self.setting.name,
+            "options": self.setting.describe(),
+            "report": self.report,
+            "delivery": self.delivery,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "overhead": self.overhead,
+            "error": self.error,
+        }
+
+
+class BenchLink:
+    """Two network namespaces joined by a veth pair, with netem shaping both directions"""
+
+    DEVICE = "veth0"
+
+    def __init__(self, prefix: Optional[str] = None, network: str = "10.199.0"):
+        prefix = prefix or f"gtbench{os.getpid()}"
+        self.namespaces = {"server": f"{prefix}-s", "client": f"{prefix}-c"}
+        self.addresses = {"server": f"{network}.1", "client": f"{network}.2"}
+
+    def run(self, *args: str) -> str:
+        result = subprocess.run(list(args), capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(args)}: {result.stderr.strip()}")
+        return result.stdout
+
+    def create(self):
+        for namespace in self.namespaces.values():
+            self.run("ip", "netns", "add", namespace)
+            self.run("ip", "-n", namespace, "link", "set", "lo", "up")
+        self.run("ip", "-n", self.namespaces["server"], "link", "add", self.DEVICE, "type", "veth",
+                 "peer", "name", self.DEVICE, "netns", self.namespaces["client"])
+        for side, namespace in self.namespaces.items():
+            self.run("ip", "-n", namespace, "addr", "add", f"{self.addresses[side]}/24", "dev", self.DEVICE)
+            self.run("ip", "-n", namespace, "link", "set", self.DEVICE, "up")
+
+    def destroy(self):
+        for namespace in self.namespaces.values():
+            subprocess.run(["ip", "netns", "del", namespace], capture_output=True)
+
+    def __enter__(self) -> "BenchLink":
+        try:
+            self.create()
+        except Exception:
+            self.destroy()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self.destroy()
+
+    def shape(self, netem: str):
+        for namespace in self.namespaces.values():
+            self.run("tc", "-n", namespace, "qdisc", "replace", "dev", self.DEVICE, "root", "netem", *netem.split())
+
+    def offered_bytes(self) -> int:
+        """IP bytes both ends have put on the link, counting those netem dropped"""
+        total = 0.0
+        for namespace in self.namespaces.values():
+            for qdisc in json.loads(self.run("tc", "-n", namespace, "-s", "-j", "qdisc", "show", "dev", self.DEVICE)):
+                if qdisc.get("kind") != "netem":
+                    continue
+                sent, packets, drops = qdisc.get("bytes", 0), qdisc.get("packets", 0), qdisc.get("drops", 0)
+                # Dropped packets are only counted, so charge them the average size
+                total += sent + (drops * sent / packets if packets else 0) - ETHERNET_HEADER * (packets + drops)
+        return int(total)
+
+    def spawn(self, side: str, argv: List[str], **kwargs) -> subprocess.Popen:
+        return subprocess.Popen(["ip", "netns", "exec", self.namespaces[side], *argv], **kwargs)
+
+
+class BenchRunner:
+    """Measure TinyVPN settings, optionally with UDP2Raw inside the tunnel, on an emulated link
+
+    Each setting is started once with the command lines the configuration
+    generators write, in a pair of network namespaces whose link is reshaped with
+    netem for every profile. A sender behind the client then plays synthetic game
+    traffic (`rate` datagrams of `size` bytes per second) for `duration` seconds
+    against an echo responder behind the server, giving round-trip percentiles,
+    jitter, delivery rate and the link bytes spent per byte of game traffic. Cores
+    that are not installed, or all of them with `stub`, are replaced by
+    bench_stub.py, so the harness runs anywhere offline.
+    """
+
+    TUNNEL_PORT = 20002
+    # Real udp2raw can share TinyVPN's port because it forges TCP or ICMP; the stub relays over UDP
+    UDP2RAW_PORT = 20003
+    GAME_PORT = 53443
+    SUBNET = "10.22.23.0"
+    TUN_DEVICE = "gtbench"
+
+    def __init__(self, tinyvpn, udp2raw=None, raw_mode: str = "faketcp", work_dir: Optional[str] = None,
+                 stub: bool = False, rate: float = 64.0, size: int = 120, duration: float = 15.0,
+                 settle: float = 2.0, ready_timeout: float = 20.0):
+        self.tinyvpn = tinyvpn
+        self.udp2raw = udp2raw
+        self.raw_mode = raw_mode
+        self.work_dir = work_dir or default_bench_dir(tinyvpn.base_dir)
+        self.stub = stub
+        self.rate = rate
+        self.size = max(size, PROBE.size)
+        self.duration = duration
+        # Seconds between reshaping the link and measuring
+        self.settle = settle
+        self.ready_timeout = ready_timeout
+        self.password = tinyvpn.generate_random_password()
+
+    def uses_stub(self, module) -> bool:
+        return self.stub or not os.access(module.binary_path, os.X_OK)
+
+    def core_command(self, module, args: str) -> List[str]:
+        # Split the way systemd splits the unbraced $ARGS of the template units
+        binary = [sys.executable, STUB_PATH] if self.uses_stub(module) else [module.binary_path]
+        return [*binary, *args.split(), "-k", self.password]
+
+    def cores(self, link: BenchLink, setting: BenchSetting) -> List[Tuple[str, str, List[str]]]:
+        """(side, name, command) of every core a setting runs"""
+        tinyvpn = self.tinyvpn
+        cores = [
+            ("server", "tinyvpn-server", self.core_command(tinyvpn, tinyvpn.server_args(
+                self.TUN_DEVICE, self.TUNNEL_PORT, setting.fec, self.SUBNET, setting.mode, setting.mtu,
+                fifo=os.path.join(self.work_dir, "tinyvpn-server.fifo")))),
+            ("client", "tinyvpn-client", self.core_command(tinyvpn, tinyvpn.client_args(
+                self.TUN_DEVICE, link.addresses["server"], self.TUNNEL_PORT, setting.fec, self.SUBNET, setting.mode,
+                setting.mtu, fifo=os.path.join(self.work_dir, "tinyvpn-client.fifo")))),
+        ]
+        if self.udp2raw is not None:
+            cores += [
+                ("server", "udp2raw-server", self.core_command(self.udp2raw, self.udp2raw.server_args(
+                    self.UDP2RAW_PORT, self.GAME_PORT, self.raw_mode))),
+                ("client", "udp2raw-client", self.core_command(self.udp2raw, self.udp2raw.client_args(
+                    self.tunnel_address(), self.UDP2RAW_PORT, self.GAME_PORT, self.raw_mode))),
+            ]
+        return cores
+
+    def tunnel_address(self) -> str:
+        return f"{self.SUBNET.rsplit('.', 1)[0]}.1"
+
+    def game_target(self) -> str:
+        # UDP2Raw's client listens locally and carries the traffic to the server through the tunnel
+        return "127.0.0.1" if self.udp2raw is not None else self.tunnel_address()
+
+    def start(self, link: BenchLink, setting: BenchSetting, number: int) -> Tuple[List[subprocess.Popen], Optional[str]]:
+        """Start the cores of a setting; returns the processes and an error, if one died at once"""
+        processes = []
+        logs = []
+        for side, name, command in self.cores(link, setting):
+            log_path = os.path.join(self.work_dir, f"{number}-{name}.log")
+            with open(log_path, "wb") as log_file:
+                processes.append(link.spawn(side, command, stdout=log_file, stderr=subprocess.STDOUT))
+            logs.append((name, log_path))
+        time.sleep(1.0)
+        for process, (name, log_path) in zip(processes, logs):
+            if process.poll() is not None:
+                return processes, f"{name} exited with status {process.returncode}; see {log_path}"
+        return processes, None
+
+    def stop(self, processes: List[subprocess.Popen]):
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def measure(self, link: BenchLink, profile: str, setting: BenchSetting) -> BenchResult:
+        link.shape(PROFILES[profile])
+        time.sleep(self.settle)
+        echo = link.spawn("server", [sys.executable, HELPER_PATH, "echo", str(self.GAME_PORT)],
+                          stdout=subprocess.PIPE, text=True)
+        sender = link.spawn("client", [sys.executable, HELPER_PATH, "send", self.game_target(), str(self.GAME_PORT),
+                                       str(self.rate), str(self.size), str(self.duration), str(self.ready_timeout)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            line = sender.stdout.readline().strip()
+            if line != "ready":
+                error = json.loads(line).get("error") if line.startswith("{") else "the sender failed"
+                return BenchResult(profile, setting, error=error)
+            before = link.offered_bytes()
+            sender.stdin.write("go\n")
+            sender.stdin.flush()
+            line = sender.stdout.readline()
+            after = link.offered_bytes()
+            if not line.startswith("{"):
+                return BenchResult(profile, setting, error="the sender failed")
+            output = json.loads(line)
+        finally:
+            if sender.poll() is None:
+                sender.kill()
+            sender.wait()
+            echo.send_signal(signal.SIGTERM)
+            echoed = echo.communicate(timeout=5)[0]
+
+        report = output["report"]
+        echoed = json.loads(echoed)["echoed"] if echoed.strip() else report["received"]
+        # What the game traffic would take on the link without any tunnel
+        direct = (report["sent"] + echoed) * (self.size + IP_HEADER[4] + UDP_HEADER)
+        overhead = (after - before) / direct - 1 if direct else None
+        return BenchResult(profile, setting, report, output["reordered"], output["duplicates"], overhead)
+
+    def run(self, profiles: Sequence[str], settings: Sequence[BenchSetting]) -> Iterator[BenchResult]:
+        """Measure every setting under every profile, yielding results as they finish"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        with BenchLink() as link:
+            for number, setting in enumerate(settings, 1):
+                processes: List[subprocess.Popen] = []
+                try:
+                    processes, error = self.start(link, setting, number)
+                    for profile in profiles:
+                        if error is not None:
+                            yield BenchResult(profile, setting, error=error)
+                        else:
+                            yield self.measure(link, profile, setting)
+                finally:
+                    self.stop(processes)
+
+    def save(self, results: List[BenchResult], path: Optional[str] = None) -> str:
+        """Write the results and the conditions they were measured under as JSON"""
+        path = path or os.path.join(self.work_dir, "results.json")
+        data = {
+            "time": time.time(),
+            "cores": {"tinyvpn": "stub" if self.uses_stub(self.tinyvpn) else self.tinyvpn.binary_path},
+            "raw_mode": self.raw_mode if self.udp2raw is not None else None,
+            "rate": self.rate,
+            "size": self.size,
+            "duration": self.duration,
+            "results": [result.to_dict() for result in results],
+        }
+        if self.udp2raw is not None:
+            data["cores"]["udp2raw"] = "stub" if self.uses_stub(self.udp2raw) else self.udp2raw.binary_path
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+        return path
+
+
+def default_bench_dir(base_dir: str) -> str:
+    return os.path.join(base_dir, "bench", datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+
+def run_echo(port: int):
+    """Echo responder behind the server; prints how many measured datagrams it echoed when terminated"""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("0.0.0.0", port))
+    echoed = 0
+    try:
+        while True:
+            data, source = sock.recvfrom(65535)
+            try:
+                sock.sendto(data, source)
+            except OSError:
+                continue
+            if data[:1] == bytes([MEASURE]):
+                echoed += 1
+    finally:
+        print(json.dumps({"echoed": echoed}), flush=True)
+
+
+def run_sender(address: str, port: int, rate: float, size: int, duration: float, ready_timeout: float):
+    """Synthetic game traffic: warm up, say 'ready', wait for 'go', then print a JSON report"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((address, port))
+    padding = b"\0" * (size - PROBE.size)
+
+    # The tunnel may still be handshaking, so retry until a round trip gets through
+    deadline = time.monotonic() + ready_timeout
+    ready = False
+    while not ready and time.monotonic() < deadline:
+        try:
+            sock.send(PROBE.pack(WARMUP, 0, time.monotonic_ns()) + padding)
+        except OSError:
+            pass
+        if select.select([sock], [], [], 0.2)[0]:
+            try:
+                sock.recv(65535)
+                ready = True
+            except OSError:
+                pass
+    if not ready:
+        print(json.dumps({"error": f"no reply through the tunnel within {ready_timeout:.0f}s"}), flush=True)
+        return
+    while select.select([sock], [], [], 0.3)[0]:
+        try:
+            sock.recv(65535)
+        except OSError:
+            pass
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    count = max(1, int(rate * duration))
+    interval = 1 / rate
+    rtts: List[Optional[float]] = [None] * count
+    reordered = duplicates = 0
+    highest = -1
+    sent = 0
+    start = time.monotonic()
+    end = start + count * interval + LINGER
+    while True:
+        now = time.monotonic()
+        if sent < count and now >= start + sent * interval:
+            try:
+                sock.send(PROBE.pack(MEASURE, sent, time.monotonic_ns()) + padding)
+            except OSError:
+                pass
+            sent += 1
+            continue
+        if sent >= count and now >= end:
+            break
+        wake = start + sent * interval if sent < count else end
+        if not select.select([sock], [], [], max(0.0, wake - now))[0]:
+            continue
+        try:
+            data = sock.recv(65535)
+        except OSError:
+            continue
+        if len(data) < PROBE.size:
+            continue
+        kind, seq, sent_ns = PROBE.unpack_from(data)
+        if kind != MEASURE or seq >= count:
+            continue
+        if rtts[seq] is not None:
+            duplicates += 1
+            continue
+        rtts[seq] = (time.monotonic_ns() - sent_ns) / 1e6
+        if seq < highest:
+            reordered += 1
+        highest = max(highest, seq)
+
+    # One slot covering the whole run, so the report spans every datagram
+    tracker = LatencyTracker(slot_seconds=duration + LINGER + 1, slots=1)
+    tracker.record(rtts, 0.0)
+    report = tracker.window(tracker.slot_seconds, 0.0)
+    print(json.dumps({"report": report, "reordered": reordered, "duplicates": duplicates}), flush=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "echo":
+        run_echo(int(sys.argv[2]))
+    elif len(sys.argv) > 7 and sys.argv[1] == "send":
+        run_sender(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]), float(sys.argv[6]),
+                   float(sys.argv[7]))
+    else:
+        sys.exit("usage: bench.py echo PORT | send ADDRESS PORT RATE SIZE DURATION READY_TIMEOUT")
@@ -0,0 +1,239 @@
+import fcntl
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Set, Tuple
+
+from pmtu import FEC_OVERHEAD, TINYVPN_OVERHEAD, UDP2RAW_OVERHEAD, UDP_HEADER
+
+
+TUNSETIFF = 0x400454ca
+IFF_TUN = 0x0001
+IFF_NO_PI = 0x1000
+# Sequence number and kind of a stub frame; frames are padded to the real core's overhead
+FRAME = struct.Struct("!IB")
+DATA = 0
+KEEPALIVE = 1
+KEEPALIVE_INTERVAL = 1.0
+# Options that take no value on a tinyvpn or udp2raw command line
+FLAGS = {"-s", "-c", "-a", "--keep-reconnect", "--disable-obscure", "--disable-fec"}
+
+
+def log(message: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO]{message}", flush=True)
+
+
+def parse_options(argv: List[str]) -> Dict[str, str]:
+    """Options of a tinyvpn or udp2raw command line; both '-l[::]:1' and '-l [::]:1' are accepted"""
+    options = {}
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg in FLAGS:
+            options[arg] = ""
+        elif not arg.startswith("--") and len(arg) > 2:
+            options[arg[:2]] = arg[2:]
+        else:
+            options[arg] = argv[index + 1] if index + 1 < len(argv) else ""
+            index += 1
+        index += 1
+    return options
+
+
+def split_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host.strip("[]"), int(port)
+
+
+def open_socket(host: str) -> socket.socket:
+    if ":" in host:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        # '[::]' takes IPv4 peers too, as tinyvpn's does
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return sock
+
+
+class StubTunnel:
+    """Stand-in for tinyvpn: a tun device whose packets cross a UDP socket
+
+    FEC x:y is imitated by sending y/x extra copies of every packet, which costs
+    the same bandwidth as the real FEC and recovers a comparable share of random
+    loss; copies wait --timeout milliseconds, as packets waiting for an FEC group do.
+    Frames are padded to tinyvpn's per-packet overhead. Good enough to exercise the
+    benchmark harness offline, not to judge tinyvpn itself.
+    """
+
+    def __init__(self, options: Dict[str, str]):
+        self.server = "-s" in options
+        prefix = options.get("--sub-net", "10.22.23.0").rsplit(".", 1)[0]
+        self.address = f"{prefix}.1" if self.server else f"{prefix}.2"
+        self.device = options.get("--tun-dev", "tun0")
+        self.mtu = int(options.get("--mtu", 1250))
+        fec = options.get("-f")
+        if "--disable-fec" in options or not fec:
+            self.ratio = 0.0
+        else:
+            data, redundant = (int(part) for part in fec.split(":"))
+            self.ratio = redundant / data
+        self.delay = int(options.get("--timeout", 4)) / 1000 if self.ratio else 0.0
+        self.padding = b"\0" * (TINYVPN_OVERHEAD + (FEC_OVERHEAD if self.ratio else 0) - FRAME.size)
+        if self.server:
+            self.listen = split_address(options["-l"])
+            self.peer = None
+        else:
+            self.listen = None
+            host, port = split_address(options["-r"])
+            self.peer = (socket.gethostbyname(host), port)
+        self.seq = 0
+        self.credit = 0.0
+        # Copies waiting for their send time: (due, frame)
+        self.pending: Deque[Tuple[float, bytes]] = deque()
+        self.seen: Set[int] = set()
+        self.seen_order: Deque[int] = deque()
+        self.ready = False
+
+    def open_tun(self) -> int:
+        fd = os.open("/dev/net/tun", os.O_RDWR)
+        fcntl.ioctl(fd, TUNSETIFF, struct.pack("16sH", self.device.encode(), IFF_TUN | IFF_NO_PI))
+        subprocess.run(["ip", "addr", "add", f"{self.address}/24", "dev", self.device], check=True)
+        subprocess.run(["ip", "link", "set", "dev", self.device, "mtu", str(self.mtu), "up"], check=True)
+        return fd
+
+    def frame(self, kind: int, packet: bytes = b"") -> bytes:
+        self.seq = (self.seq + 1) & 0xffffffff
+        return FRAME.pack(self.seq, kind) + self.padding + packet
+
+    def duplicate(self, seq: int) -> bool:
+        if seq in self.seen:
+            return True
+        self.seen.add(seq)
+        self.seen_order.append(seq)
+        if len(self.seen_order) > 4096:
+            self.seen.discard(self.seen_order.popleft())
+        return False
+
+    def send(self, sock: socket.socket, data: bytes):
+        if self.peer is None:
+            return
+        try:
+            sock.sendto(data, self.peer)
+        except OSError:
+            pass
+
+    def run(self):
+        tun = self.open_tun()
+        sock = open_socket(self.listen[0] if self.listen else self.peer[0])
+        if self.listen:
+            sock.bind(self.listen)
+        log(f"stub tunnel {self.address} on {self.device}, mtu {self.mtu}, redundancy {self.ratio * 100:.0f}%")
+        next_keepalive = 0.0
+        while True:
+            now = time.monotonic()
+            while self.pending and self.pending[0][0] <= now:
+                self.send(sock, self.pending.popleft()[1])
+            if now >= next_keepalive:
+                self.send(sock, self.frame(KEEPALIVE))
+                next_keepalive = now + KEEPALIVE_INTERVAL
+            wake = min(next_keepalive, self.pending[0][0]) if self.pending else next_keepalive
+            readable, _, _ = select.select([tun, sock], [], [], max(0.0, wake - time.monotonic()))
+            if tun in readable:
+                packet = os.read(tun, 65535)
+                data = self.frame(DATA, packet)
+                self.send(sock, data)
+                self.credit += self.ratio
+                while self.credit >= 1:
+                    self.credit -= 1
+                    if self.delay:
+                        self.pending.append((time.monotonic() + self.delay, data))
+                    else:
+                        self.send(sock, data)
+            if sock in readable:
+                try:
+                    data, source = sock.recvfrom(65535)
+                except OSError:
+                    continue
+                if len(data) < FRAME.size:
+                    continue
+                if self.server and source != self.peer:
+                    log(f"new connection from {source[0]}:{source[1]}")
+                    self.peer = source
+                if not self.ready:
+                    self.ready = True
+                    log(f"changed state to {'server' if self.server else 'client'}_ready")
+                seq, kind = FRAME.unpack_from(data)
+                if kind != DATA or self.duplicate(seq):
+                    continue
+                try:
+                    os.write(tun, data[FRAME.size + len(self.padding):])
+                except OSError:
+                    pass
+
+
+class StubRelay:
+    """Stand-in for udp2raw: relays datagrams over plain UDP
+
+    Frames are padded to the size of the --raw-mode headers udp2raw would forge, so
+    byte counts match; the client's listen side and the server's forward side carry
+    the game's datagrams unchanged.
+    """
+
+    def __init__(self, options: Dict[str, str]):
+        self.server = "-s" in options
+        self.listen = split_address(options["-l"])
+        self.remote = split_address(options["-r"])
+        raw_mode = options.get("--raw-mode", "faketcp")
+        overhead = UDP2RAW_OVERHEAD.get(raw_mode, max(UDP2RAW_OVERHEAD.values()))
+        self.padding = b"\0" * (overhead - UDP_HEADER)
+
+    def run(self):
+        listener = open_socket(self.listen[0])
+        listener.bind(self.listen)
+        forward = open_socket(self.remote[0])
+        # Not connected: the route to the remote end may only appear once the tunnel is up
+        remote = (socket.gethostbyname(self.remote[0]), self.remote[1])
+        log(f"stub relay {self.listen[0]}:{self.listen[1]} -> {self.remote[0]}:{self.remote[1]}")
+        # The server frames what it sends back through its listener, the client what it forwards
+        framed_listener = self.server
+        peer = None
+        while True:
+            readable, _, _ = select.select([listener, forward], [], [])
+            if listener in readable:
+                data, source = listener.recvfrom(65535)
+                if peer != source:
+                    log(f"new connection from {source[0]}:{source[1]}")
+                    peer = source
+                payload = data[len(self.padding):] if framed_listener else self.padding + data
+                try:
+                    forward.sendto(payload, remote)
+                except OSError:
+                    pass
+            if forward in readable:
+                try:
+                    data, source = forward.recvfrom(65535)
+                except OSError:
+                    continue
+                if peer is None or source != remote:
+                    continue
+                payload = self.padding + data if framed_listener else data[len(self.padding):]
+                listener.sendto(payload, peer)
+
+
+def main(argv: List[str]):
+    options = parse_options(argv)
+    core = StubRelay(options) if "--raw-mode" in options else StubTunnel(options)
+    try:
+        core.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+
+class LoadedConfig(Mapping):
+    """Immutable parsed configuration file
+
+    Behaves like a read-only dict of its settings, so existing `config.get(...)` and
+    `config[...]` callers keep working, while the cached instance can be shared
+    safely between menus and probe threads. Use `dict(config)` for a mutable copy.
+    """
+    __slots__ = ("path", "mtime_ns", "_values")
+
+    def __init__(self, path: str, mtime_ns: int, values: Dict[str, Any]):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self._values = MappingProxyType(dict(values))
+
+    def __getitem__(self, key: str) -> Any:
+        return self._values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"LoadedConfig({self.path!r}, {dict(self._values)!r})"
+
+    def get_int(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        try:
+            return int(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+
+def parse_key_values(text: str) -> Dict[str, str]:
+    """Parse the KEY=VALUE .conf files written by TinyVPN and UDP2Raw"""
+    values = {}
+    for line in text.splitlines():
+        if '=' in line:
+            key, value = line.strip().split('=', 1)
+            values[key] = value
+    return values
+
+
+def parse_frp_toml(text: str) -> Dict[str, Any]:
+    """Parse an FRP TOML file into flat 'section.key' settings
+
+    Uses tomllib when available, so values keep their TOML types; arrays of tables
+    such as [[proxies]] become 'proxies[0].name'.
+    """
+    if tomllib is None:
+        return parse_simple_toml(text)
+
+    values = {}
+
+    def flatten(prefix: str, data: Dict[str, Any]):
+        for key, value in data.items():
+            name = f"{prefix}.{key}" if prefix else key
+            if isinstance(value, dict):
+                flatten(name, value)
+            elif isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+                for index, item in enumerate(value):
+                    flatten(f"{name}[{index}]", item)
+            else:
+                values[name] = value
+
+    flatten("", tomllib.loads(text))
+    return values
+
+
+def parse_simple_toml(text: str) -> Dict[str, str]:
+    """Line-based TOML reader for Pythons without tomllib (no nesting or arrays)"""
+    values = {}
+    current_section = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        # Check if this is a section header
+        if line.startswith('[') and line.endswith(']'):
+            current_section = line.strip('[]')
+            continue
+
+        if '=' in line:
+            key, value = line.split('=', 1)
+            key = key.strip()
+            value = value.strip()
+
+            # Remove quotes if present
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+
+            if current_section:
+                key = f"{current_section}.{key}"
+            values[key] = value
+    return values
+
+
+class ConfigLoader:
+    """Memoize parsed configuration files keyed by (path, mtime_ns, size)
+
+    Each load costs a single stat while the file is unchanged; the file is re-read
+    only after it was modified. The least recently used entries are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path: str, parser: Callable[[str], Dict[str, Any]] = parse_key_values,
+             defaults: Optional[Dict[str, Any]] = None) -> Optional[LoadedConfig]:
+        """Return the parsed file, or None when it does not exist
+
+        `defaults` are filled in for keys the file does not set. Parse errors
+        propagate to the caller and are not cached.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self.lock:
+                self.cache.pop(path, None)
+            return None
+
+        key = (stat.st_mtime_ns, stat.st_size, parser, tuple(sorted((defaults or {}).items())))
+        with self.lock:
+            entry = self.cache.get(path)
+            if entry is not None and entry[0] == key:
+                self.cache.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, 'r') as f:
+            values = parser(f.read())
+        for name, value in (defaults or {}).items():
+            values.setdefault(name, value)
+        config = LoadedConfig(path, stat.st_mtime_ns, values)
+
+        with self.lock:
+            self.cache[path] = (key, config)
+            self.cache.move_to_end(path)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return config
+
+    def invalidate(self, path: Optional[str] = None):
+        """Forget one file (or everything), e.g. after rewriting it within the same mtime tick"""
+        with self.lock:
+            if path is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(path, None)
@@ -0,0 +1,275 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config_loader import ConfigLoader, parse_frp_toml
+
+
+# Config file name patterns inside ~/.gamingtunnel/configs/<name>/, per backend and role
+CONFIG_FILES = {
+    "tinyvpn": {"server": "server_config_{name}.conf", "client": "client_config_{name}.conf"},
+    "udp2raw": {"server": "udp2raw_server_config_{name}.conf", "client": "udp2raw_client_config_{name}.conf"},
+}
+# FRP keeps flat files in ~/.gamingtunnel/frp_configs/
+FRP_PREFIXES = {"frps-": "server", "frpc-": "client"}
+
+
+class ConfigRecord:
+    """Index entry describing one tunnel configuration"""
+    __slots__ = ("backend", "role", "name", "path", "port", "subnet", "server_addr")
+
+    def __init__(self, backend: str, role: str, name: str, path: str, port: Optional[int] = None,
+                 subnet: Optional[str] = None, server_addr: Optional[str] = None):
+        self.backend = backend
+        self.role = role
+        self.name = name
+        self.path = path
+        self.port = port
+        self.subnet = subnet
+        self.server_addr = server_addr
+
+    def as_dict(self) -> Dict[str, object]:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "ConfigRecord":
+        return cls(**{field: data.get(field) for field in cls.__slots__})
+
+    def listing(self) -> Dict[str, str]:
+        """Entry in the format returned by the modules' get_available_configs"""
+        entry = {"name": self.name, "type": self.role}
+        if self.backend == "frp":
+            entry["path"] = self.path
+        return entry
+
+
+class ConfigRegistry:
+    """Index of every TinyVPN, UDP2Raw and FRP configuration
+
+    The index is kept in ~/.gamingtunnel/registry.json together with the mtime of
+    every configuration directory. Listing revalidates it with one stat per
+    directory and only rescans directories whose mtime changed, so listing 1,000
+    configurations is a single read instead of thousands of stats and opens. The
+    modules call `update` after writing or removing a configuration, since
+    rewriting a file in place does not change its directory's mtime.
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, base_dir: str, loader: Optional[ConfigLoader] = None):
+        self.base_dir = base_dir
+        # Parse cache shared with the modules' load_config
+        self.loader = loader or ConfigLoader()
+        self.configs_dir = os.path.join(base_dir, "configs")
+        self.frp_configs_dir = os.path.join(base_dir, "frp_configs")
+        self.index_path = os.path.join(base_dir, "registry.json")
+        # Directory path -> records found in it, and directory path -> mtime_ns when scanned
+        self.entries: Dict[str, List[ConfigRecord]] = {}
+        self.mtimes: Dict[str, int] = {}
+        # (backend, name, role) -> record, kept in step with entries for get()
+        self.by_key: Dict[Tuple[str, str, str], ConfigRecord] = {}
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _to_int(value: Optional[str]) -> Optional[int]:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _scan_config_dir(self, name: str) -> List[ConfigRecord]:
+        directory = os.path.join(self.configs_dir, name)
+        records = []
+        for backend, roles in CONFIG_FILES.items():
+            for role, pattern in roles.items():
+                path = os.path.join(directory, pattern.format(name=name))
+                try:
+                    values = self.loader.load(path)
+                except OSError:
+                    values = None
+                if values is None:
+                    continue
+                if backend == "tinyvpn":
+                    port = values.get("PORT") or values.get("SERVER_PORT")
+                else:
+                    port = values.get("TUNNEL_PORT")
+                records.append(ConfigRecord(backend, role, name, path, self._to_int(port),
+                                            values.get("SUBNET"), values.get("SERVER_ADDR")))
+        return records
+
+    def _scan_frp_dir(self) -> List[ConfigRecord]:
+        records = []
+        try:
+            filenames = sorted(os.listdir(self.frp_configs_dir))
+        except OSError:
+            return records
+        for filename in filenames:
+            prefix = filename[:5]
+            if prefix not in FRP_PREFIXES or not filename.endswith(".toml"):
+                continue
+            path = os.path.join(self.frp_configs_dir, filename)
+            try:
+                values = self.loader.load(path, parse_frp_toml) or {}
+            except (OSError, ValueError):
+                # Still list files that fail to parse so they can be fixed or removed
+                values = {}
+            records.append(ConfigRecord(
+                "frp", FRP_PREFIXES[prefix], filename[5:-len(".toml")], path,
+                self._to_int(values.get("bindPort") or values.get("serverPort")),
+                server_addr=values.get("serverAddr"),
+            ))
+        return records
+
+    def _store(self, directory: str, records: List[ConfigRecord]):
+        self._drop(directory)
+        self.entries[directory] = records
+        for record in records:
+            self.by_key[(record.backend, record.name, record.role)] = record
+
+    def _drop(self, directory: str):
+        for record in self.entries.pop(directory, []):
+            key = (record.backend, record.name, record.role)
+            if self.by_key.get(key) is record:
+                del self.by_key[key]
+
+    def _rescan(self, directory: str):
+        """Re-read one directory's configurations and remember its mtime"""
+        # Files may have been rewritten within the same mtime tick
+        for record in self.entries.get(directory, []):
+            self.loader.invalidate(record.path)
+        mtime = self._mtime(directory)
+        if mtime is None:
+            self._drop(directory)
+            self.mtimes.pop(directory, None)
+            return
+        # Take the mtime first so a change during the scan is caught next time
+        self.mtimes[directory] = mtime
+        if directory == self.frp_configs_dir:
+            self._store(directory, self._scan_frp_dir())
+        elif directory != self.configs_dir:
+            self._store(directory, self._scan_config_dir(os.path.basename(directory)))
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") != self.INDEX_VERSION:
+                return
+            mtimes = {path: int(mtime) for path, mtime in data["mtimes"].items()}
+            entries = {
+                path: [ConfigRecord.from_dict(record) for record in records]
+                for path, records in data["entries"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self.mtimes = mtimes
+        self.entries = {}
+        self.by_key = {}
+        for path, records in entries.items():
+            self._store(path, records)
+
+    def _save_index(self):
+        data = {
+            "version": self.INDEX_VERSION,
+            "mtimes": self.mtimes,
+            "entries": {path: [record.as_dict() for record in records] for path, records in self.entries.items()},
+        }
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # The index is only a cache; a read-only home directory just means rescanning
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def revalidate(self):
+        """Bring the index up to date, rescanning only directories whose mtime changed"""
+        with self.lock:
+            if not self.loaded:
+                self._load_index()
+                self.loaded = True
+            changed = False
+
+            top_mtime = self._mtime(self.configs_dir)
+            if top_mtime != self.mtimes.get(self.configs_dir):
+                # Configuration directories were added or removed
+                try:
+                    names = {item for item in os.listdir(self.configs_dir)
+                             if os.path.isdir(os.path.join(self.configs_dir, item))}
+                except OSError:
+                    names = set()
+                current = {os.path.join(self.configs_dir, name) for name in names}
+                known = {path for path in self.mtimes if os.path.dirname(path) == self.configs_dir}
+                for directory in known - current:
+                    self._drop(directory)
+                    self.mtimes.pop(directory, None)
+                for directory in current - known:
+                    self._rescan(directory)
+                if top_mtime is None:
+                    self.mtimes.pop(self.configs_dir, None)
+                else:
+                    self.mtimes[self.configs_dir] = top_mtime
+                changed = True
+
+            for directory, mtime in list(self.mtimes.items()):
+                if directory == self.configs_dir:
+                    continue
+                if self._mtime(directory) != mtime:
+                    self._rescan(directory)
+                    changed = True
+
+            if self.frp_configs_dir not in self.mtimes and os.path.isdir(self.frp_configs_dir):
+                self._rescan(self.frp_configs_dir)
+                changed = True
+
+            if changed:
+                self._save_index()
+
+    def update(self, name: Optional[str] = None, frp: bool = False):
+        """Rescan a configuration after it was created, modified or removed"""
+        with self.lock:
+            if not self.loaded:
+                self.revalidate()
+            if name is not None and not frp:
+                self._rescan(os.path.join(self.configs_dir, name))
+            if frp:
+                self._rescan(self.frp_configs_dir)
+            self._save_index()
+
+    def records(self, backend: Optional[str] = None) -> List[ConfigRecord]:
+        """All indexed configurations, optionally of one backend, ordered by name"""
+        self.revalidate()
+        with self.lock:
+            records = [record for records in self.entries.values() for record in records
+                       if backend is None or record.backend == backend]
+        return sorted(records, key=lambda record: (record.name, record.role))
+
+    def get(self, backend: str, name: str, role: Optional[str] = None) -> Optional[ConfigRecord]:
+        """One configuration, revalidating only the directory it lives in"""
+        directory = self.frp_configs_dir if backend == "frp" else os.path.join(self.configs_dir, name)
+        with self.lock:
+            if not self.loaded:
+                self.revalidate()
+            elif self._mtime(directory) != self.mtimes.get(directory):
+                self._rescan(directory)
+                self._save_index()
+            # Same preference as records(), which orders clients before servers
+            for candidate in ([role] if role is not None else ["client", "server"]):
+                record = self.by_key.get((backend, name, candidate))
+                if record is not None:
+                    return record
+        return None
+
+    def get_available_configs(self, backend: str) -> List[Dict[str, str]]:
+        return [record.listing() for record in self.records(backend)]
@@ -0,0 +1,122 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+from rich.console import Console
+from rich.live import Live
+from rich.panel import Panel
+from rich.table import Table
+
+from netdev import NetDevSnapshot, format_bits
+
+
+COLUMNS = ["State", "↓ Rate", "↑ Rate", "↓ pkt/s", "↑ pkt/s", "Drops/s", "RTT"]
+
+
+class LiveDashboard:
+    """Auto-refreshing tunnel dashboard showing instantaneous throughput
+
+    Counters are sampled on a fixed interval by a background thread and RTT is probed
+    by a second one, so neither blocks the terminal. The table is only redrawn when a
+    cell actually changes.
+    """
+
+    def __init__(self, tinyvpn, interval: float = 1.0, probe_interval: float = 2.0, console: Optional[Console] = None):
+        self.tinyvpn = tinyvpn
+        self.interval = interval
+        self.probe_interval = probe_interval
+        self.console = console or Console()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.cells: Dict[str, List[str]] = {}
+        self.rtts: Dict[str, str] = {}
+        self.version = 0
+
+    def _set_cells(self, name: str, cells: List[str]):
+        with self.lock:
+            if self.cells.get(name) != cells:
+                self.cells[name] = cells
+                self.version += 1
+
+    def _sample_counters(self, config_names: List[str]):
+        previous = None
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                snapshot = NetDevSnapshot.read()
+                links = self.tinyvpn.netlink.dump()
+            except Exception:
+                snapshot, links = None, {}
+
+            if snapshot is not None and previous is not None:
+                rates = snapshot.rates_since(previous)
+                for config_name in config_names:
+                    link = links.get(config_name)
+                    state = "[green]UP[/green]" if link is not None and link.is_up else "[red]DOWN[/red]"
+                    rate = rates.get(config_name)
+                    with self.lock:
+                        rtt = self.rtts.get(config_name, "...")
+                    if rate is None:
+                        cells = [state, "-", "-", "-", "-", "-", rtt]
+                    else:
+                        drops = f"[red]{rate.drops_ps:.1f}[/red]" if rate.drops_ps else "0"
+                        cells = [state, format_bits(rate.rx_bps), format_bits(rate.tx_bps),
+                                 f"{rate.rx_pps:.0f}", f"{rate.tx_pps:.0f}", drops, rtt]
+                    self._set_cells(config_name, cells)
+            previous = snapshot
+
+            self.stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def _probe_rtt(self, config_names: List[str]):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                results = self.tinyvpn.probe_tunnels(config_names, count=1, timeout=min(1.0, self.probe_interval))
+            except Exception:
+                results = {}
+            with self.lock:
+                for config_name in config_names:
+                    stats = results.get(config_name)
+                    if stats is not None and stats.reachable:
+                        self.rtts[config_name] = f"{stats.avg_rtt:.1f} ms"
+                    else:
+                        self.rtts[config_name] = "[red]timeout[/red]"
+            self.stop_event.wait(max(0.0, self.probe_interval - (time.monotonic() - started)))
+
+    def render(self, config_names: List[str]) -> Panel:
+        table = Table(show_header=True)
+        table.add_column("Name", style="cyan")
+        for column in COLUMNS:
+            table.add_column(column, justify="right")
+
+        with self.lock:
+            for config_name in config_names:
+                cells = self.cells.get(config_name, ["..."] * len(COLUMNS))
+                table.add_row(config_name, *cells)
+
+        return Panel(table, title=f"Live Tunnel Dashboard (every {self.interval:g}s, Ctrl+C to exit)", border_style="cyan")
+
+    def run(self, config_names: List[str]):
+        """Show the dashboard until the user presses Ctrl+C"""
+        self.stop_event.clear()
+        workers = [
+            threading.Thread(target=self._sample_counters, args=(config_names,), daemon=True),
+            threading.Thread(target=self._probe_rtt, args=(config_names,), daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        shown_version = -1
+        try:
+            with Live(self.render(config_names), console=self.console, auto_refresh=False) as live:
+                while True:
+                    with self.lock:
+                        version = self.version
+                    if version != shown_version:
+                        live.update(self.render(config_names), refresh=True)
+                        shown_version = version
+                    time.sleep(0.1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event.set()
@@ -0,0 +1,291 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from rich import print as rich_print
+
+from netdev import NetDevSnapshot
+from netlink import LinkInfo
+from monitor import MonitorClient
+from latency import LatencyTracker, percentile_key
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (metric suffix, counter field, help text) exported for every tunnel interface
+INTERFACE_COUNTERS = [
+    ("receive_bytes_total", "rx_bytes", "Bytes received on the tunnel interface"),
+    ("transmit_bytes_total", "tx_bytes", "Bytes transmitted on the tunnel interface"),
+    ("receive_packets_total", "rx_packets", "Packets received on the tunnel interface"),
+    ("transmit_packets_total", "tx_packets", "Packets transmitted on the tunnel interface"),
+    ("receive_errors_total", "rx_errs", "Receive errors on the tunnel interface"),
+    ("transmit_errors_total", "tx_errs", "Transmit errors on the tunnel interface"),
+    ("receive_drop_total", "rx_drop", "Received packets dropped on the tunnel interface"),
+    ("transmit_drop_total", "tx_drop", "Transmitted packets dropped on the tunnel interface"),
+]
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def parse_fec(fec: str) -> Tuple[Optional[int], Optional[int]]:
+    """Split a TinyVPN FEC option such as '-f10:6' into (redundant, original) packets"""
+    if fec == "--disable-fec":
+        return 0, 0
+    try:
+        redundant, data = fec[2:].split(":", 1) if fec.startswith("-f") else fec.split(":", 1)
+        return int(redundant), int(data)
+    except ValueError:
+        return None, None
+
+
+class MetricsWriter:
+    """Accumulate samples grouped by metric family in Prometheus text format"""
+
+    def __init__(self):
+        self.families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def add(self, name: str, metric_type: str, help_text: str, labels: Dict[str, str], value):
+        if value is None:
+            return
+        family = self.families.setdefault(name, (metric_type, help_text, []))
+        label_text = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+        family[2].append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    def render(self) -> str:
+        lines = []
+        for name, (metric_type, help_text, samples) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Serve tunnel, probe, systemd and process metrics over HTTP for Prometheus
+
+    Metrics are collected by a background thread into a cached text snapshot, so a
+    scrape only copies bytes and its latency does not depend on the number of
+    tunnels. `proc_root` and the ServiceStatus' `systemctl` binary can point at a
+    fake /proc tree and a stub script for local testing. Link state comes from
+    rtnetlink rather than procfs, so with any other `proc_root` it is only
+    exported when a `link_reader` is given.
+    """
+
+    def __init__(self, tinyvpn, udp2raw, frp, service_status, interval: float = 15.0,
+                 proc_root: str = "/proc", prefix: str = "gamingtunnel",
+                 link_reader: Optional[Callable[[], Dict[str, LinkInfo]]] = None):
+        self.tinyvpn = tinyvpn
+        self.udp2raw = udp2raw
+        self.frp = frp
+        self.service_status = service_status
+        self.interval = interval
+        self.proc_root = proc_root
+        self.prefix = prefix
+        if link_reader is None and proc_root == "/proc":
+            link_reader = tinyvpn.netlink.dump
+        self.link_reader = link_reader
+        self.monitor_client = MonitorClient(tinyvpn.base_dir)
+        self.snapshot = b""
+        self.snapshot_time = 0.0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # Fed from our own probes when the monitoring daemon is not running
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.latency_window = 300
+
+    def collect_configs(self) -> List[Dict[str, str]]:
+        """Return name/role/backend/unit for every configured tunnel"""
+        configs = []
+        for backend, module in (("tinyvpn", self.tinyvpn), ("udp2raw", self.udp2raw), ("frp", self.frp)):
+            for config in module.get_available_configs():
+                configs.append({
+                    "name": config['name'],
+                    "role": config['type'],
+                    "backend": backend,
+                    "unit": module.get_service_name(config['name'], config['type']),
+                })
+        return configs
+
+    def read_process_stats(self, pid: int) -> Tuple[Optional[float], Optional[int]]:
+        """Return (cpu seconds, resident bytes) of a process from <proc_root>/<pid>"""
+        try:
+            with open(os.path.join(self.proc_root, str(pid), "stat"), "r") as f:
+                # Fields after the command name, which may itself contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(os.path.join(self.proc_root, str(pid), "statm"), "r") as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None, None
+        # utime and stime are fields 14 and 15 of stat, i.e. 11 and 12 after the name
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        return cpu_seconds, resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+    def collect(self) -> str:
+        """Collect every metric once and render it as text"""
+        started = time.monotonic()
+        writer = MetricsWriter()
+        p = self.prefix
+        configs = self.collect_configs()
+        tunnels = [c for c in configs if c["backend"] == "tinyvpn"]
+
+        # Interface counters and state
+        try:
+            snapshot = NetDevSnapshot.read(self.proc_root)
+        except Exception:
+            snapshot = NetDevSnapshot.empty()
+        links = None
+        if self.link_reader is not None:
+            try:
+                links = self.link_reader()
+            except Exception:
+                links = {}
+
+        for config in tunnels:
+            labels = {"name": config["name"], "role": config["role"], "backend": config["backend"]}
+            counters = snapshot.get(config["name"])
+            writer.add(f"{p}_interface_present", "gauge", "Whether the tunnel interface exists in /proc/net/dev",
+                       labels, 1 if counters is not None else 0)
+            if links is not None:
+                link = links.get(config["name"])
+                writer.add(f"{p}_interface_up", "gauge", "Whether the tunnel interface is operationally up",
+                           labels, 1 if link is not None and link.is_up else 0)
+                if link is not None:
+                    writer.add(f"{p}_interface_mtu_bytes", "gauge", "MTU of the tunnel interface", labels, link.mtu)
+            if counters is not None:
+                for suffix, field, help_text in INTERFACE_COUNTERS:
+                    writer.add(f"{p}_interface_{suffix}", "counter", help_text, labels, getattr(counters, field))
+
+        # Configured FEC ratio; 0:0 when FEC is disabled
+        for config in tunnels:
+            labels = {"name": config["name"], "role": config["role"], "backend": config["backend"]}
+            fec = self.tinyvpn.load_config(config["name"]).get("FEC", "")
+            redundant, data = parse_fec(fec)
+            writer.add(f"{p}_fec_redundant_packets", "gauge", "Configured FEC redundant packets per group",
+                       labels, redundant)
+            writer.add(f"{p}_fec_data_packets", "gauge", "Configured FEC original packets per group",
+                       labels, data)
+
+        # Probe results, from the monitoring daemon when it is running
+        monitor_data = self.monitor_client.latest(seconds=max(self.interval, 60))
+        if monitor_data:
+            probes = {name: (sample.get("rtt"), sample.get("loss")) for name, sample in monitor_data["tunnels"].items()}
+            latency = (self.monitor_client.latency(self.latency_window) or {}).get("tunnels", {})
+        else:
+            try:
+                results = self.tinyvpn.probe_tunnels(list(dict.fromkeys(c["name"] for c in tunnels)), count=3,
+                                                     timeout=min(2.0, self.interval / 2))
+            except Exception:
+                results = {}
+            probes = {name: (stats.avg_rtt, stats.loss) for name, stats in results.items()}
+            now = time.time()
+            for name, stats in results.items():
+                self.latency.setdefault(name, LatencyTracker()).record(stats.outcomes, now)
+            for name in set(self.latency) - set(results):
+                del self.latency[name]
+            latency = {name: tracker.window(self.latency_window, now) for name, tracker in self.latency.items()}
+
+        for config in tunnels:
+            labels = {"name": config["name"], "role": config["role"], "backend": config["backend"]}
+            rtt, loss = probes.get(config["name"], (None, None))
+            writer.add(f"{p}_probe_success", "gauge", "Whether the tunnel peer answered the last probe",
+                       labels, 1 if rtt is not None else 0)
+            writer.add(f"{p}_probe_rtt_seconds", "gauge", "Average round-trip time to the tunnel peer",
+                       labels, rtt / 1000 if rtt is not None else None)
+            writer.add(f"{p}_probe_loss_ratio", "gauge", "Fraction of probes to the tunnel peer without reply",
+                       labels, loss)
+
+        # Tail latency, jitter and loss bursts over the last five minutes
+        for config in tunnels:
+            report = latency.get(config["name"])
+            if not report:
+                continue
+            labels = {"name": config["name"], "role": config["role"], "backend": config["backend"]}
+            for percent in LatencyTracker.PERCENTILES:
+                value = report.get(percentile_key(percent))
+                writer.add(f"{p}_latency_seconds", "gauge", "Tunnel RTT percentiles over the last 5 minutes",
+                           {**labels, "quantile": f"{percent / 100:g}"}, value / 1000 if value is not None else None)
+            writer.add(f"{p}_jitter_seconds", "gauge", "RFC 3550 interarrival jitter of the tunnel RTT",
+                       labels, report["jitter"] / 1000 if report.get("jitter") is not None else None)
+            writer.add(f"{p}_loss_bursts", "gauge", "Runs of consecutive lost probes over the last 5 minutes",
+                       labels, report.get("loss_bursts"))
+            writer.add(f"{p}_max_loss_burst", "gauge", "Longest run of consecutive lost probes over the last 5 minutes",
+                       labels, report.get("max_loss_burst"))
+
+        # systemd units and their processes
+        states = self.service_status.get_many([c["unit"] for c in configs]) if configs else {}
+        for config in configs:
+            labels = {"name": config["name"], "role": config["role"], "backend": config["backend"]}
+            state = states[config["unit"]]
+            writer.add(f"{p}_service_active", "gauge", "Whether the systemd unit is active",
+                       labels, 1 if state.is_active else 0)
+            writer.add(f"{p}_service_restarts_total", "counter", "Automatic restarts of the systemd unit",
+                       labels, state.n_restarts)
+            if state.main_pid:
+                cpu_seconds, rss = self.read_process_stats(state.main_pid)
+                writer.add(f"{p}_process_cpu_seconds_total", "counter", "CPU time used by the tunnel process",
+                           labels, cpu_seconds)
+                writer.add(f"{p}_process_resident_memory_bytes", "gauge", "Resident memory of the tunnel process",
+                           labels, rss)
+
+        writer.add(f"{p}_collect_duration_seconds", "gauge", "Time taken to collect this snapshot",
+                   {}, round(time.monotonic() - started, 6))
+        writer.add(f"{p}_collect_timestamp_seconds", "gauge", "Unix time this snapshot was collected",
+                   {}, round(time.time(), 3))
+        return writer.render()
+
+    def refresh(self):
+        text = self.collect().encode()
+        with self.lock:
+            self.snapshot = text
+            self.snapshot_time = time.time()
+
+    def _refresh_loop(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                rich_print(f"[red]Failed to collect metrics: {str(e)}[/red]")
+            self.stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def make_server(self, address: str, port: int) -> ThreadingHTTPServer:
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    self.wfile.write(b"Try /metrics\n")
+                    return
+                with exporter.lock:
+                    body = exporter.snapshot
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ThreadingHTTPServer((address, port), Handler)
+
+    def run(self, address: str = "0.0.0.0", port: int = 9469):
+        """Collect in the background and serve /metrics until interrupted"""
+        # Serve a complete snapshot from the very first scrape
+        self.refresh()
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+        server = self.make_server(address, port)
+        rich_print(f"[cyan bold]Serving metrics on http://{address}:{port}/metrics[/cyan bold]")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event.set()
+            server.server_close()
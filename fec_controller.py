@@ -0,0 +1,338 @@
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from rich import print as rich_print
+from rich.markup import escape
+
+from fifo_control import FEC_OPTION, option_value
+from restart import IdleRestart, Interruption
+
+
+# FEC settings from lightest to heaviest protection; "x:y" adds y redundant packets
+# to every x data packets, so redundancy runs from 10% to 200%
+DEFAULT_LADDER = ("20:2", "20:5", "10:6", "10:10", "5:10")
+
+
+def parse_ladder(rungs: Sequence[str]) -> List[Tuple[int, int]]:
+    """Validate a ladder of 'x:y' FEC settings ordered by increasing redundancy"""
+    ladder = []
+    for rung in rungs:
+        try:
+            data, redundant = (int(part) for part in rung.strip().split(":"))
+        except ValueError:
+            raise ValueError(f"Invalid FEC setting {rung!r}; use x:y")
+        if data <= 0 or redundant <= 0 or data + redundant > 255:
+            raise ValueError(f"FEC setting {rung!r} is out of range")
+        if ladder and redundant / data <= ladder[-1][1] / ladder[-1][0]:
+            raise ValueError(f"FEC ladder must add redundancy at every step ({rung!r})")
+        ladder.append((data, redundant))
+    if not ladder:
+        raise ValueError("FEC ladder is empty")
+    return ladder
+
+
+class FecDecision:
+    """One change of a tunnel's FEC setting and the measurements behind it"""
+    __slots__ = ("time", "tunnel", "role", "before", "after", "loss", "drop_rate", "burst", "probes", "outcome")
+
+    def __init__(self, time: float, tunnel: str, role: str, before: str, after: str, loss: float,
+                 drop_rate: float, burst: int, probes: int, outcome: str = ""):
+        self.time = time
+        self.tunnel = tunnel
+        self.role = role
+        self.before = before
+        self.after = after
+        self.loss = loss
+        self.drop_rate = drop_rate
+        self.burst = burst
+        self.probes = probes
+        self.outcome = outcome
+
+    def describe(self) -> str:
+        stamp = datetime.fromtimestamp(self.time).strftime("%Y-%m-%d %H:%M:%S")
+        return (f"{stamp} {self.tunnel} {self.role}: FEC {self.before} -> {self.after} "
+                f"(probe loss {self.loss * 100:.1f}% of {self.probes}, interface drops {self.drop_rate * 100:.2f}%, "
+                f"longest burst {self.burst}): {self.outcome}")
+
+
+class TunnelFec:
+    """Controller state of one tunnel"""
+    __slots__ = ("level", "up_votes", "down_votes", "changed_at", "pending", "busy", "down")
+
+    def __init__(self, level: int):
+        self.level = level
+        self.up_votes = 0
+        self.down_votes = 0
+        self.changed_at = 0.0
+        # Decision waiting for an idle moment, for tunnels that can only change by restarting
+        self.pending: Optional[FecDecision] = None
+        # A change is being applied by the worker
+        self.busy = False
+        # No probe was answered in the window: an outage, which no FEC setting fixes
+        self.down = False
+
+
+class AdaptiveFec:
+    """Move each tunnel's FEC along a ladder according to the loss the monitor measures
+
+    Runs as a MonitorDaemon listener. Loss is the larger of the probe loss over the
+    last `window` seconds (whole 5-minute slots of the monitor's LatencyTracker) and
+    the tun device's drop rate over the same time; a rung is enough while its
+    redundancy is at least `margin` times the loss and covers the longest run of lost
+    probes. Protection goes up after `up_after` samples that need it, jumping straight
+    to the first rung that is enough, and comes down one rung at a time after
+    `down_after` samples in which the lower rung would be enough with `hysteresis`
+    times the loss, and no sooner than `hold` seconds after the last change.
+
+    Changes go through the tunnel's control FIFO; tunnels started without one are
+    restarted at the next idle moment when `restart_idle` is set. Both are done by a
+    worker thread, so a slow FIFO or restart never delays the monitor's sampling.
+    Windows without a single answered probe, or with more loss than the top rung
+    covers, mean the peer is down rather than lossy and leave the setting alone.
+    Each host adjusts only what its own tunnels send, so both ends run their own
+    controller.
+    """
+
+    def __init__(self, tinyvpn, service_status, ladder: Sequence[str] = DEFAULT_LADDER, window: float = 300.0,
+                 margin: float = 3.0, hysteresis: float = 2.0, up_after: int = 2, down_after: int = 30,
+                 hold: float = 120.0, min_probes: int = 10, restart_idle: bool = True, idle_packets: int = 2,
+                 log_path: Optional[str] = None):
+        self.tinyvpn = tinyvpn
+        self.service_status = service_status
+        self.ladder = parse_ladder(ladder)
+        self.window = window
+        self.margin = margin
+        self.hysteresis = hysteresis
+        self.up_after = up_after
+        self.down_after = down_after
+        self.hold = hold
+        self.min_probes = min_probes
+        self.restart_idle = restart_idle
+        self.idle_packets = idle_packets
+        self.log_path = log_path or default_decisions_path(tinyvpn.base_dir)
+        self.tunnels: Dict[Tuple[str, str], TunnelFec] = {}
+        self.decisions: Deque[FecDecision] = deque(maxlen=200)
+        self.lock = threading.Lock()
+        # Changes waiting for the worker: (tunnel key, decision, target level, restart)
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def rung_name(self, level: int) -> str:
+        data, redundant = self.ladder[level]
+        return f"{data}:{redundant}"
+
+    def nearest_rung(self, fec: str) -> int:
+        """Ladder position of an FEC setting, or of the closest rung by redundancy"""
+        data, redundant = (int(part) for part in fec.split(":"))
+        ratio = redundant / data
+        return min(range(len(self.ladder)), key=lambda level: abs(self.ladder[level][1] / self.ladder[level][0] - ratio))
+
+    def covers(self, level: int, loss: float, burst: int, factor: float = 1.0) -> bool:
+        data, redundant = self.ladder[level]
+        return loss * self.margin * factor <= redundant / data and burst * factor <= redundant
+
+    def target(self, level: int, loss: float, burst: int) -> int:
+        """Rung the measurements call for, starting from `level`"""
+        if not self.covers(level, loss, burst):
+            for candidate in range(level + 1, len(self.ladder)):
+                if self.covers(candidate, loss, burst):
+                    return candidate
+            return len(self.ladder) - 1
+        if level > 0 and self.covers(level - 1, loss, burst, self.hysteresis):
+            return level - 1
+        return level
+
+    def measure(self, daemon, name: str, now: float) -> Optional[Dict[str, float]]:
+        """Probe loss, longest loss burst and interface drop rate of a tunnel over the window"""
+        with daemon.lock:
+            tracker = daemon.latency.get(name)
+            series = daemon.tunnels.get(name)
+            if tracker is None or series is None:
+                return None
+            report = tracker.window(self.window, now)
+            data = series.series(max(1, int(self.window / daemon.interval)))
+        if report["sent"] < self.min_probes:
+            return None
+        drops = sum(data["drops"])
+        packets = sum(data["rx_packets"]) + sum(data["tx_packets"]) + drops
+        drop_rate = drops / packets if packets else 0.0
+        return {"probe_loss": report["loss"] or 0.0, "drop_rate": drop_rate, "burst": report["max_loss_burst"],
+                "probes": report["sent"], "received": report["received"], "loss": max(report["loss"] or 0.0, drop_rate),
+                "idle": (data["rx_packets"][-1] + data["tx_packets"][-1]) <= self.idle_packets}
+
+    def log(self, decision: FecDecision):
+        self.decisions.append(decision)
+        self.write(decision.describe())
+
+    def note(self, name: str, role: str, text: str, now: float):
+        stamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+        self.write(f"{stamp} {name} {role}: {text}")
+
+    def write(self, line: str):
+        rich_print(escape(line))
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+
+    def apply_live(self, decision: FecDecision) -> bool:
+        """Send the new setting through the control FIFO; True when the tunnel took it"""
+        control = self.tinyvpn.control
+        if not control.is_available(decision.tunnel, decision.role):
+            decision.outcome = "no control FIFO"
+            return False
+        error = control.send(decision.tunnel, decision.role, [f"fec {decision.after}"])
+        if error is not None:
+            decision.outcome = f"live change failed: {error}"
+            return False
+        self.tinyvpn.save_settings(decision.tunnel, decision.role, fec=f"-f{decision.after}")
+        decision.outcome = "applied live"
+        return True
+
+    def restart_with(self, decision: FecDecision) -> Optional[bool]:
+        """Save the new setting and restart the tunnel if it is still idle
+
+        Returns True when restarted, False when the change failed, and None when
+        traffic resumed before a quiet window, so the change stays pending.
+        The setting is only saved once the tunnel is confirmed idle, and put back
+        if systemd refuses the restart.
+        """
+        restarter = IdleRestart(self.tinyvpn, self.service_status, idle_packets=self.idle_packets, quiet_for=1.0,
+                                max_wait=5.0, deadline=10.0)
+        report = Interruption(self.tinyvpn.get_service_name(decision.tunnel, decision.role))
+        # Confirm the quiet moment over a short window rather than waiting for one
+        restarter.wait_for_idle(decision.tunnel, report)
+        if not report.idle:
+            decision.outcome = report.describe()
+            return None
+        if not self.tinyvpn.save_settings(decision.tunnel, decision.role, fec=f"-f{decision.after}"):
+            decision.outcome = "could not save the configuration"
+            return False
+        if not restarter.restart_now(decision.tunnel, decision.role, report):
+            self.tinyvpn.save_settings(decision.tunnel, decision.role, fec=f"-f{decision.before}")
+            decision.outcome = f"restart failed: {report.result.error}"
+            return False
+        decision.outcome = report.describe()
+        return True
+
+    def evaluate(self, daemon, name: str, role: str, fec: str, now: float):
+        key = (name, role)
+        state = self.tunnels.get(key)
+        if state is not None and state.busy:
+            return
+        if state is None or (state.pending is None and self.rung_name(state.level) != fec):
+            # New tunnel, or its FEC was changed by hand
+            state = self.tunnels[key] = TunnelFec(self.nearest_rung(fec))
+        measured = self.measure(daemon, name, now)
+        if measured is None:
+            return
+
+        if not measured["received"] or not self.covers(len(self.ladder) - 1, measured["loss"], measured["burst"]):
+            state.up_votes = state.down_votes = 0
+            if not state.down:
+                state.down = True
+                cancelled = ", pending change cancelled" if state.pending is not None else ""
+                self.note(name, role, f"peer down (probe loss {measured['probe_loss'] * 100:.1f}% of "
+                                      f"{measured['probes']}), FEC left at {fec}{cancelled}", now)
+            state.pending = None
+            return
+        if state.down:
+            state.down = False
+            self.note(name, role, "peer back up", now)
+        target = self.target(state.level, measured["loss"], measured["burst"])
+
+        if state.pending is not None:
+            if target == state.level:
+                state.pending.outcome = "cancelled, loss is back within the current setting"
+                self.log(state.pending)
+                state.pending = None
+            elif measured["idle"]:
+                decision, state.pending = state.pending, None
+                state.busy = True
+                level = self.ladder.index(tuple(int(part) for part in decision.after.split(":")))
+                self.queue.put((key, decision, level, True))
+            return
+
+        if target > state.level:
+            state.up_votes += 1
+            state.down_votes = 0
+        elif target < state.level:
+            state.down_votes += 1
+            state.up_votes = 0
+        else:
+            state.up_votes = state.down_votes = 0
+        if not ((target > state.level and state.up_votes >= self.up_after)
+                or (target < state.level and state.down_votes >= self.down_after and now - state.changed_at >= self.hold)):
+            return
+
+        state.up_votes = state.down_votes = 0
+        decision = FecDecision(now, name, role, fec, self.rung_name(target), measured["probe_loss"],
+                               measured["drop_rate"], measured["burst"], measured["probes"])
+        state.busy = True
+        self.queue.put((key, decision, target, False))
+
+    def run(self):
+        """Worker applying changes outside the monitor's sampling thread"""
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            key, decision, target, restart = job
+            try:
+                changed = self.restart_with(decision) if restart else self.apply_live(decision)
+            except Exception as e:
+                changed = False
+                decision.outcome = f"failed: {str(e)}"
+            with self.lock:
+                state = self.tunnels.get(key)
+                if state is not None:
+                    state.busy = False
+                    if changed:
+                        state.level = target
+                        state.changed_at = decision.time
+                    elif changed is None:
+                        decision.outcome += "; still pending"
+                        state.pending = self.copy_pending(decision)
+                    elif not restart and self.restart_idle:
+                        decision.outcome += "; restarting at the next idle moment"
+                        state.pending = self.copy_pending(decision)
+                self.log(decision)
+
+    @staticmethod
+    def copy_pending(decision: FecDecision) -> FecDecision:
+        """A decision to retry later, without the outcome already logged for this attempt"""
+        return FecDecision(decision.time, decision.tunnel, decision.role, decision.before, decision.after,
+                           decision.loss, decision.drop_rate, decision.burst, decision.probes)
+
+    def record_monitor(self, daemon, timestamp: float):
+        """MonitorDaemon listener evaluating every TinyVPN tunnel after each sample"""
+        with self.lock:
+            seen = set()
+            for config in self.tinyvpn.get_available_configs():
+                name, role = config['name'], config['type']
+                seen.add((name, role))
+                fec = option_value(FEC_OPTION, self.tinyvpn.load_config(name).get('FEC'))
+                if fec is None:
+                    # FEC is off; switching it on needs a restart the operator should choose
+                    self.tunnels.pop((name, role), None)
+                    continue
+                self.evaluate(daemon, name, role, fec, timestamp)
+            for key in set(self.tunnels) - seen:
+                del self.tunnels[key]
+
+
+def default_decisions_path(base_dir: str) -> str:
+    return os.path.join(base_dir, "logs", "adaptive_fec.log")
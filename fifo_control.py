@@ -0,0 +1,155 @@
+import errno
+import os
+import re
+import stat
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# Config file settings a running tunnel can change through its FIFO
+LIVE_KEYS = ("FEC", "MTU", "MODE", "TIMEOUT")
+FEC_OPTION = re.compile(r"^-f(\d+:\d+)$")
+MODE_OPTION = re.compile(r"--mode\s+(\d)")
+TIMEOUT_OPTION = re.compile(r"--timeout\s+(\d+)")
+# tinyfecVPN echoes every command it reads, then warns when it cannot apply one
+# (its own spelling is "invaild value")
+RECEIVED_PATTERN = re.compile(rb"got data from fifo")
+REJECTED_PATTERN = re.compile(rb"(?i)inva(?:il|li)d|unknown command")
+
+
+def option_value(pattern: "re.Pattern", text: Optional[str]) -> Optional[str]:
+    match = pattern.search(text or "")
+    return match.group(1) if match else None
+
+
+def live_commands(before: Dict[str, str], after: Dict[str, str]) -> Optional[List[str]]:
+    """FIFO commands turning the FEC/MTU/MODE/TIMEOUT settings `before` into `after`
+
+    Both mappings use the config file's values ('-f10:6', '--mtu 1450' or '1450',
+    '--mode 1 --timeout 0'). Returns None when a change needs a restart, such as
+    enabling or disabling FEC.
+    """
+    commands = []
+    if before.get("FEC") != after.get("FEC"):
+        fec = option_value(FEC_OPTION, after.get("FEC"))
+        if fec is None or option_value(FEC_OPTION, before.get("FEC")) is None:
+            return None
+        commands.append(f"fec {fec}")
+
+    mtu_before = re.sub(r"\D", "", str(before.get("MTU", "")))
+    mtu_after = re.sub(r"\D", "", str(after.get("MTU", "")))
+    if mtu_after != mtu_before:
+        if not mtu_after:
+            return None
+        commands.append(f"mtu {mtu_after}")
+
+    mode_before = option_value(MODE_OPTION, before.get("MODE"))
+    mode_after = option_value(MODE_OPTION, after.get("MODE"))
+    if mode_after != mode_before:
+        if mode_after is None:
+            return None
+        commands.append(f"mode {mode_after}")
+
+    # Clients keep the timeout in its own setting as well as in MODE
+    timeout_before = option_value(TIMEOUT_OPTION, before.get("MODE")) or before.get("TIMEOUT")
+    timeout_after = option_value(TIMEOUT_OPTION, after.get("MODE")) or after.get("TIMEOUT")
+    if str(timeout_after) != str(timeout_before):
+        if timeout_after is None:
+            return None
+        commands.append(f"timeout {timeout_after}")
+    return commands
+
+
+class FifoControl:
+    """Change FEC, MTU, mode and timeout of running TinyVPN tunnels without restarting them
+
+    Every tunnel is started with `--fifo <path>`; tinyfecVPN reads one command per
+    write from it ("fec 10:6", "mtu 1200", ...) and applies it to the live session.
+    Commands are sent one at a time, each confirmed by the echo tinyfecVPN writes to
+    the tunnel's log, so the caller only persists a setting once the process took it.
+    """
+
+    def __init__(self, tinyvpn, deadline: float = 3.0, settle: float = 0.3, poll: float = 0.05):
+        self.tinyvpn = tinyvpn
+        # Seconds to wait for the echo of each command
+        self.deadline = deadline
+        # Seconds to keep watching the log for a rejection after the echo
+        self.settle = settle
+        self.poll = poll
+
+    def is_available(self, config_name: str, config_type: str) -> bool:
+        """Whether the tunnel was started with a control FIFO that something is reading"""
+        try:
+            fd = os.open(self.tinyvpn.get_fifo_path(config_name, config_type), os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            return False
+        os.close(fd)
+        return True
+
+    def read_log(self, log_file: str, offset: int) -> Tuple[bytes, int]:
+        try:
+            with open(log_file, "rb") as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    # Rotated or truncated since the command was sent
+                    offset = 0
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return b"", offset
+        return data, offset + len(data)
+
+    def wait_for_echo(self, log_file: str, offset: int, command: str) -> Tuple[Optional[str], int]:
+        """Wait for tinyfecVPN to log a command; returns (error or None, new log offset)"""
+        deadline = time.monotonic() + self.deadline
+        settled_at = None
+        buffer = b""
+        while True:
+            data, offset = self.read_log(log_file, offset)
+            buffer += data
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                if settled_at is None:
+                    if RECEIVED_PATTERN.search(line) and command.encode() in line:
+                        settled_at = time.monotonic() + self.settle
+                elif REJECTED_PATTERN.search(line):
+                    return f"'{command}' was rejected: {line.decode('utf-8', errors='replace').strip()}", offset
+            now = time.monotonic()
+            if settled_at is not None and now >= settled_at:
+                return None, offset
+            if settled_at is None and now >= deadline:
+                return f"no confirmation of '{command}' in {log_file}", offset
+            time.sleep(self.poll)
+
+    def send(self, config_name: str, config_type: str, commands: List[str]) -> Optional[str]:
+        """Send commands to a running tunnel; returns None once all took effect, else the error"""
+        path = self.tinyvpn.get_fifo_path(config_name, config_type)
+        log_file = self.tinyvpn.get_log_file(config_name, config_type)
+        try:
+            # Opening without a reader fails instead of blocking, and a missing FIFO is never created here
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except FileNotFoundError:
+            return "the tunnel was not started with a control FIFO"
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return "the tunnel is not running"
+            return str(e)
+        try:
+            if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+                return f"{path} is not a FIFO"
+            try:
+                offset = os.path.getsize(log_file)
+            except OSError:
+                return f"cannot confirm commands without the log {log_file}"
+            for command in commands:
+                try:
+                    os.write(fd, f"{command}\n".encode())
+                except OSError as e:
+                    return f"could not send '{command}': {str(e)}"
+                # tinyfecVPN handles one command per read, so the next waits for this one
+                error, offset = self.wait_for_echo(log_file, offset, command)
+                if error:
+                    return error
+            return None
+        finally:
+            os.close(fd)
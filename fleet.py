@@ -0,0 +1,401 @@
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+from config_loader import parse_frp_toml, tomllib
+from fifo_control import LIVE_KEYS, live_commands
+
+
+NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_-]+$')
+# Settings shown as *** in plans
+SECRET_KEYS = {"PASSWORD", "auth.token"}
+
+# Defaults match the answers suggested by the interactive prompts
+DEFAULTS = {
+    ("tinyvpn", "server"): {"port": 20002, "fec": "10:6", "subnet": "10.22.23.0", "mode": None, "mtu": 1450},
+    ("tinyvpn", "client"): {"server_port": 20002, "fec": "10:6", "subnet": "10.22.23.0", "mode": None, "mtu": 1450,
+                            "timeout": 4},
+    ("udp2raw", "server"): {"external_port": 53443, "password": "hysteria2", "raw_mode": "faketcp"},
+    ("udp2raw", "client"): {"external_port": 53443, "password": "hysteria2", "raw_mode": "faketcp"},
+    ("frp", "server"): {"bind_addr": "0.0.0.0", "bind_port": 7000},
+    ("frp", "client"): {"server_port": 7000, "protocol": "quic", "proxy_type": "udp", "local_ip": "127.0.0.1"},
+}
+REQUIRED = {
+    ("tinyvpn", "client"): ("server_addr", "password"),
+    ("udp2raw", "client"): ("server_addr",),
+    ("frp", "client"): ("server_addr", "token", "local_port"),
+}
+
+
+class DesiredTunnel:
+    """One tunnel as described in a fleet file"""
+    __slots__ = ("backend", "role", "name", "options")
+
+    def __init__(self, backend: str, role: str, name: str, options: Dict[str, object]):
+        self.backend = backend
+        self.role = role
+        self.name = name
+        self.options = options
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return (self.backend, self.role, self.name)
+
+
+class PlanItem:
+    """A single reconciliation step"""
+    __slots__ = ("action", "backend", "role", "name", "unit", "changes", "desired", "record")
+
+    def __init__(self, action: str, backend: str, role: str, name: str, unit: str,
+                 changes: Optional[List[str]] = None, desired: Optional[DesiredTunnel] = None, record=None):
+        self.action = action
+        self.backend = backend
+        self.role = role
+        self.name = name
+        self.unit = unit
+        self.changes = changes or []
+        self.desired = desired
+        self.record = record
+
+
+def fec_option(fec) -> str:
+    return "--disable-fec" if str(fec) == "0" else f"-f{fec}"
+
+
+def mode_option(mode, timeout) -> Tuple[str, int]:
+    """TinyVPN mode option and the timeout it implies, as chosen by the prompts"""
+    if mode is not None and str(mode) == "0":
+        return "--mode 0 --timeout 4", 4
+    if mode is not None and str(mode) == "1":
+        return "--mode 1 --timeout 0", 0
+    return f"--timeout {timeout}", timeout
+
+
+class FleetReconciler:
+    """Bring the tunnels on this host in line with a declarative fleet file
+
+    The fleet file is TOML with [[tinyvpn]], [[udp2raw]] and [[frp]] arrays; every
+    entry has a `name` and a `role` (server/client) plus the settings the interactive
+    prompts would ask for. The plan is computed by comparing each entry with the
+    registry and systemd, and only tunnels that differ are touched. Files are
+    written by a bounded thread pool, systemd is reloaded at most once, and units
+    are then (re)started in parallel.
+    """
+
+    def __init__(self, tinyvpn, udp2raw, frp, service_status, jobs: int = 8, console: Optional[Console] = None):
+        self.tinyvpn = tinyvpn
+        self.udp2raw = udp2raw
+        self.frp = frp
+        self.modules = {"tinyvpn": tinyvpn, "udp2raw": udp2raw, "frp": frp}
+        self.service_status = service_status
+        self.registry = tinyvpn.registry
+        self.units = tinyvpn.units
+        self.jobs = jobs
+        self.console = console or Console()
+        self.server_ip: Optional[str] = None
+
+    # Desired state
+
+    def load(self, path: str) -> List[DesiredTunnel]:
+        """Parse and validate a fleet file"""
+        if tomllib is None:
+            raise ValueError("Reading fleet files requires Python 3.11 or newer (tomllib)")
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+
+        tunnels: Dict[Tuple[str, str, str], DesiredTunnel] = {}
+        for backend in ("tinyvpn", "udp2raw", "frp"):
+            for index, entry in enumerate(data.get(backend, [])):
+                where = f"{backend}[{index}]"
+                name = str(entry.get("name", ""))
+                role = entry.get("role", "server")
+                if not NAME_PATTERN.match(name):
+                    raise ValueError(f"{where}: invalid name {name!r}; use only letters, numbers, '_' and '-'")
+                if role not in ("server", "client"):
+                    raise ValueError(f"{where}: role must be 'server' or 'client'")
+                options = {**DEFAULTS[(backend, role)], **{k: v for k, v in entry.items() if k not in ("name", "role")}}
+                for field in REQUIRED.get((backend, role), ()):
+                    if options.get(field) in (None, ""):
+                        raise ValueError(f"{where} ({name}): '{field}' is required for a {backend} {role}")
+                tunnel = DesiredTunnel(backend, role, name, options)
+                if tunnel.key in tunnels:
+                    raise ValueError(f"{where}: {backend} {role} '{name}' is defined twice")
+                tunnels[tunnel.key] = tunnel
+
+        # UDP2Raw wraps the TinyVPN tunnel of the same name unless told otherwise
+        for tunnel in tunnels.values():
+            if tunnel.backend == "udp2raw" and "tunnel_port" not in tunnel.options:
+                tinyvpn = tunnels.get(("tinyvpn", tunnel.role, tunnel.name))
+                if tinyvpn is not None:
+                    tunnel.options["tunnel_port"] = tinyvpn.options.get("port", tinyvpn.options.get("server_port"))
+                else:
+                    tunnel.options["tunnel_port"] = self.udp2raw.auto_detect_tinyvpn_port(tunnel.name)[0]
+        return list(tunnels.values())
+
+    def settings(self, tunnel: DesiredTunnel) -> Dict[str, str]:
+        """Config file values a tunnel should have, as written by the modules"""
+        o = tunnel.options
+        if tunnel.backend == "tinyvpn":
+            settings = {"FEC": fec_option(o["fec"]), "SUBNET": str(o["subnet"])}
+            if tunnel.role == "server":
+                settings["PORT"] = str(o["port"])
+                settings["MODE"] = mode_option(o["mode"], 4)[0]
+                settings["MTU"] = f"--mtu {o['mtu']}"
+            else:
+                mode, timeout = mode_option(o["mode"], o["timeout"])
+                settings.update({"SERVER_ADDR": str(o["server_addr"]), "SERVER_PORT": str(o["server_port"]),
+                                 "MODE": mode, "MTU": str(o["mtu"]), "TIMEOUT": str(timeout)})
+        elif tunnel.backend == "udp2raw":
+            settings = {"TUNNEL_PORT": str(o["tunnel_port"]), "EXTERNAL_PORT": str(o["external_port"]),
+                        "RAW_MODE": str(o["raw_mode"])}
+            if tunnel.role == "client":
+                settings["SERVER_ADDR"] = str(o["server_addr"])
+        else:
+            if tunnel.role == "server":
+                settings = {"bindAddr": str(o["bind_addr"]), "bindPort": str(o["bind_port"])}
+            else:
+                local_port = o["local_port"]
+                settings = {
+                    "serverAddr": str(o["server_addr"]), "serverPort": str(o["server_port"]),
+                    "transport.protocol": str(o["protocol"]),
+                    "proxies[0].name": str(o.get("proxy_name") or f"{tunnel.name}-proxy"),
+                    "proxies[0].type": str(o["proxy_type"]), "proxies[0].localIP": str(o["local_ip"]),
+                    "proxies[0].localPort": str(local_port), "proxies[0].remotePort": str(o.get("remote_port", local_port)),
+                }
+
+        # Secrets are only compared when the fleet file sets them
+        secret = o.get("token") if tunnel.backend == "frp" else o.get("password")
+        if secret is not None:
+            settings["auth.token" if tunnel.backend == "frp" else "PASSWORD"] = str(secret)
+        return settings
+
+    def current_settings(self, record) -> Dict[str, object]:
+        parser = parse_frp_toml if record.backend == "frp" else None
+        try:
+            config = self.registry.loader.load(record.path, parser) if parser else self.registry.loader.load(record.path)
+        except (OSError, ValueError):
+            config = None
+        return dict(config or {})
+
+    # Planning
+
+    def plan(self, desired: List[DesiredTunnel], prune: bool = False) -> List[PlanItem]:
+        """Compare the desired tunnels with the registry and systemd"""
+        records = {(r.backend, r.role, r.name): r for r in self.registry.records()}
+        wanted = {tunnel.key: tunnel for tunnel in desired}
+
+        units = {key: self.modules[key[0]].get_service_name(key[2], key[1]) for key in {**records, **wanted}}
+        states = self.service_status.get_many(list(units.values())) if units else {}
+
+        plan = []
+        for key, tunnel in wanted.items():
+            unit = units[key]
+            record = records.get(key)
+            if record is None:
+                plan.append(PlanItem("create", *key, unit, desired=tunnel))
+                continue
+            current = self.current_settings(record)
+            changes = []
+            for name, value in self.settings(tunnel).items():
+                before = current.get(name)
+                if before is None or str(before) != value:
+                    if name in SECRET_KEYS:
+                        changes.append(f"{name} changed")
+                    else:
+                        changes.append(f"{name}: {before if before is not None else '-'} → {value}")
+            state = states[unit]
+            if changes:
+                plan.append(PlanItem("update", *key, unit, changes, tunnel, record))
+            elif state.load_state == "not-found" or (self.units.can_install
+                                                     and not self.modules[key[0]].is_unit_installed(key[2], key[1])):
+                plan.append(PlanItem("install", *key, unit, desired=tunnel, record=record))
+            elif state.is_known and not state.is_active:
+                plan.append(PlanItem("start", *key, unit, [f"unit is {state.active_state}"], tunnel, record))
+            else:
+                plan.append(PlanItem("unchanged", *key, unit, desired=tunnel, record=record))
+
+        if prune:
+            for key, record in records.items():
+                if key not in wanted:
+                    plan.append(PlanItem("remove", *key, units[key], record=record))
+        return plan
+
+    def show_plan(self, plan: List[PlanItem]):
+        styles = {"create": "green", "update": "yellow", "install": "cyan", "start": "cyan", "remove": "red"}
+        table = Table(title="Fleet Plan", show_header=True)
+        table.add_column("Action")
+        table.add_column("Backend")
+        table.add_column("Role")
+        table.add_column("Name", style="cyan")
+        table.add_column("Changes")
+        unchanged = 0
+        for item in plan:
+            if item.action == "unchanged":
+                unchanged += 1
+                continue
+            style = styles[item.action]
+            table.add_row(f"[{style}]{item.action}[/{style}]", item.backend, item.role, item.name,
+                          "\n".join(item.changes))
+        if table.row_count:
+            self.console.print(table)
+        self.console.print(f"[bold]{table.row_count} to change, {unchanged} unchanged[/bold]")
+
+    # Applying
+
+    def systemctl(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run([self.service_status.systemctl, *args], capture_output=True, text=True)
+
+    def materialize(self, item: PlanItem) -> str:
+        """Write the files of a tunnel and install its template unit; returns the instance's unit name"""
+        tunnel = item.desired
+        o = tunnel.options
+        current = self.current_settings(item.record) if item.record is not None else {}
+        if tunnel.backend == "tinyvpn":
+            # Unchanged templates are not rewritten and do not trigger a reload
+            self.tinyvpn.install_template()
+            password = o.get("password") or current.get("PASSWORD") or self.tinyvpn.generate_random_password()
+            if tunnel.role == "server":
+                return self.tinyvpn.write_server_config(
+                    tunnel.name, o["port"], fec_option(o["fec"]), o["subnet"], mode_option(o["mode"], 4)[0],
+                    o["mtu"], password, server_ip=self.server_ip)
+            mode, timeout = mode_option(o["mode"], o["timeout"])
+            return self.tinyvpn.write_client_config(
+                tunnel.name, o["server_addr"], o["server_port"], fec_option(o["fec"]), o["subnet"], mode,
+                o["mtu"], timeout, password)[1]
+        if tunnel.backend == "udp2raw":
+            self.udp2raw.install_template()
+            if tunnel.role == "server":
+                return self.udp2raw.write_server_config(
+                    tunnel.name, o["tunnel_port"], o["external_port"], o["password"], o["raw_mode"])
+            return self.udp2raw.write_client_config(
+                tunnel.name, o["server_addr"], o["tunnel_port"], o["external_port"], o["password"], o["raw_mode"])
+        self.frp.install_template(tunnel.role)
+        if tunnel.role == "server":
+            token = o.get("token") or current.get("auth.token") or self.frp.generate_random_token()
+            self.frp.write_server_config(tunnel.name, o["bind_addr"], o["bind_port"], token)
+        else:
+            self.frp.write_client_config(
+                tunnel.name, o["server_addr"], o["server_port"], o["token"], o["protocol"],
+                o.get("proxy_name") or f"{tunnel.name}-proxy", o["proxy_type"], o["local_ip"], o["local_port"],
+                o.get("remote_port", o["local_port"]))
+        return self.frp.get_service_name(tunnel.name, tunnel.role)
+
+    def tune(self, item: PlanItem) -> bool:
+        """Push a TinyVPN update to the running tunnel; True when it needs no restart"""
+        current = {key: str(value) for key, value in self.current_settings(item.record).items()}
+        wanted = self.settings(item.desired)
+        if any(current.get(key) != value for key, value in wanted.items() if key not in LIVE_KEYS):
+            return False
+        commands = live_commands(current, wanted)
+        if not commands or not self.tinyvpn.control.is_available(item.name, item.role):
+            return False
+        return self.tinyvpn.control.send(item.name, item.role, commands) is None
+
+    def remove_files(self, item: PlanItem):
+        """Delete a pruned tunnel's config and instance files"""
+        record = item.record
+        module = self.modules[record.backend]
+        if os.path.exists(record.path):
+            os.remove(record.path)
+        self.units.remove(module.get_legacy_service_name(record.name, record.role))
+        if record.backend != "frp":
+            env_file = module.get_env_file(record.name, record.role)
+            if os.path.exists(env_file):
+                os.remove(env_file)
+            if record.backend == "tinyvpn" and os.path.exists(module.get_fifo_path(record.name, record.role)):
+                os.remove(module.get_fifo_path(record.name, record.role))
+            directory = os.path.dirname(record.path)
+            # Drop the directory once no configuration of any backend is left in it
+            if not any(name.endswith(".conf") for name in os.listdir(directory)):
+                shutil.rmtree(directory)
+            self.registry.update(record.name)
+        else:
+            self.registry.update(frp=True)
+
+    def run_parallel(self, items: List[PlanItem], step: Callable[[PlanItem], object],
+                     results: Dict[str, str]) -> List[Tuple[PlanItem, object]]:
+        """Run a step for every item on the bounded pool; failures are recorded per unit"""
+        done = []
+        if not items:
+            return done
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [(item, executor.submit(step, item)) for item in items]
+            for item, future in futures:
+                try:
+                    done.append((item, future.result()))
+                except Exception as e:
+                    results[item.unit] = f"[red]failed: {str(e)}[/red]"
+        return done
+
+    def apply(self, plan: List[PlanItem]) -> bool:
+        """Execute a plan; returns True when every step succeeded"""
+        changes = [item for item in plan if item.action != "unchanged"]
+        if not changes:
+            self.console.print("[green]Everything is up to date.[/green]")
+            return True
+
+        can_install = self.units.can_install
+        if not can_install:
+            self.console.print(f"[yellow]No permission to write {self.units.systemd_dir}; only configuration files "
+                               "will be updated. Run as root to install and start the units.[/yellow]")
+        results: Dict[str, str] = {}
+        removals = [item for item in changes if item.action == "remove"]
+        writes = [item for item in changes if item.action in ("create", "update")]
+        installs = [item for item in changes if item.action == "install"]
+
+        if any(item.backend == "tinyvpn" and item.role == "server" for item in writes):
+            # Looked up once instead of once per server's client_info.txt
+            self.server_ip = self.tinyvpn.get_server_ip()
+
+        # Stop pruned units before their files disappear
+        if removals and can_install:
+            units = [item.unit for item in removals]
+            self.systemctl("stop", *units)
+            self.systemctl("disable", "--no-reload", *units)
+
+        # TinyVPN updates that only change FEC, MTU, mode or timeout are pushed to the
+        # running tunnels before their files are written, and then need no restart
+        retunable = [item for item in writes if item.backend == "tinyvpn" and item.action == "update"]
+        tuned = {item.unit for item, live in self.run_parallel(retunable, self.tune, results) if live}
+
+        def write_step(item: PlanItem):
+            if item.action == "remove":
+                self.remove_files(item)
+                return
+            self.materialize(item)
+
+        written = self.run_parallel(removals + writes + installs, write_step, results)
+
+        if can_install:
+            new_units = [item.unit for item, _ in written if item.action in ("create", "install")]
+            if new_units:
+                self.systemctl("enable", "--no-reload", *new_units)
+            # A single reload for every unit file written or removed above, if any
+            if not self.units.reload():
+                self.console.print("[red]systemctl daemon-reload failed[/red]")
+
+            def start_step(item: PlanItem):
+                command = "restart" if item.action == "update" else "start"
+                result = self.systemctl(command, item.unit)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip() or f"systemctl {command} exited with {result.returncode}")
+
+            to_start = [item for item, _ in written if item.action != "remove" and item.unit not in tuned]
+            to_start += [item for item in changes if item.action == "start"]
+            self.run_parallel(to_start, start_step, results)
+
+        table = Table(title="Fleet Apply", show_header=True)
+        table.add_column("Unit", style="cyan")
+        table.add_column("Action")
+        table.add_column("Result")
+        for item in changes:
+            done = "[green]ok, applied live[/green]" if item.unit in tuned else "[green]ok[/green]"
+            table.add_row(item.unit, item.action, results.get(item.unit, done))
+        self.console.print(table)
+        return not results
@@ -1,6 +1,5 @@
 import os
 import subprocess
-import glob
 import re
 import random
 import string
@@ -15,11 +14,21 @@ from rich.prompt import Prompt, Confirm
 from rich.panel import Panel
 from rich.table import Table
 
+from service_status import ServiceStatus
+from config_registry import ConfigRegistry
+from config_loader import LoadedConfig, parse_frp_toml
+from systemd_units import UnitInstaller, render_unit
+from journal import JournalReader
+
 
 class FRP:
-    def __init__(self):
+    def __init__(self, service_status: Optional[ServiceStatus] = None, registry: Optional[ConfigRegistry] = None,
+                 units: Optional[UnitInstaller] = None):
         """Initialize FRP class"""
         self.console = Console()
+        self.service_status = service_status or ServiceStatus()
+        # Remembers what was already read, so viewing logs again only fetches new entries
+        self.journal = JournalReader()
         # Use user's home directory for more accessibility
         self.home_dir = os.path.expanduser("~")
         self.base_dir = os.path.join(self.home_dir, ".gamingtunnel")
@@ -28,6 +37,9 @@ class FRP:
         self.bin_dir = os.path.join(self.base_dir, "bin")
         self.configs_dir = os.path.join(self.base_dir, "frp_configs")
         self.log_dir = os.path.join(self.base_dir, "logs")
+        self.registry = registry or ConfigRegistry(self.base_dir)
+        self.config_loader = self.registry.loader
+        self.units = units or UnitInstaller(self.base_dir)
         
         # Update binary paths
         self.frps_binary = os.path.join(self.bin_dir, "frps")
@@ -50,6 +62,17 @@ class FRP:
             style = f"{color} bold"
         rich_print(f"[{style}]{text}[/{style}]")
 
+    def get_service_name(self, config_name: str, config_type: str) -> str:
+        """Get the systemd unit name for an FRP configuration"""
+        return f"frp{'s' if config_type == 'server' else 'c'}@{config_name}.service"
+
+    def get_legacy_service_name(self, config_name: str, config_type: str) -> str:
+        """Per-tunnel unit name used before the switch to frps@/frpc@ templates"""
+        return f"frp{'s' if config_type == 'server' else 'c'}-{config_name}.service"
+
+    def get_template_unit(self, config_type: str) -> str:
+        return f"frp{'s' if config_type == 'server' else 'c'}@.service"
+
     def is_installed(self) -> bool:
         """Check if FRP is installed"""
         return os.path.isfile(self.frps_binary) and os.path.isfile(self.frpc_binary)
@@ -156,29 +179,7 @@ class FRP:
             
     def get_available_configs(self) -> List[dict]:
         """Get a list of available FRP configurations"""
-        configs = []
-        
-        # Look for server configs
-        server_configs = glob.glob(f"{self.configs_dir}/frps-*.toml")
-        for config in server_configs:
-            config_name = os.path.basename(config).replace('frps-', '').replace('.toml', '')
-            configs.append({
-                'name': config_name,
-                'type': 'server',
-                'path': config
-            })
-            
-        # Look for client configs
-        client_configs = glob.glob(f"{self.configs_dir}/frpc-*.toml")
-        for config in client_configs:
-            config_name = os.path.basename(config).replace('frpc-', '').replace('.toml', '')
-            configs.append({
-                'name': config_name,
-                'type': 'client',
-                'path': config
-            })
-            
-        return configs
+        return self.registry.get_available_configs("frp")
         
     def load_config(self, config_name: str) -> Dict[str, str]:
         """Load a configuration file and parse its settings"""
@@ -199,47 +200,20 @@ class FRP:
             self.colorize("red", f"Configuration '{config_name}' not found", bold=True)
             return None
             
-        # Parse the TOML file (simple version, not handling nested sections)
+        # Parse the TOML file; the parse is cached until the file changes
+        try:
+            config = self.config_loader.load(config_path, parse_frp_toml)
+        except Exception as e:
+            self.colorize("red", f"Failed to load configuration: {str(e)}", bold=True)
+            return None
+        
         config_data = {
             "NAME": config_name,
             "TYPE": config_type,
             "PATH": config_path
         }
-        
-        try:
-            with open(config_path, 'r') as f:
-                current_section = ""
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#'):
-                        continue
-                        
-                    # Check if this is a section header
-                    if line.startswith('[') and line.endswith(']'):
-                        current_section = line[1:-1]  # Remove brackets
-                        continue
-                        
-                    # Parse key-value pairs
-                    if '=' in line:
-                        key, value = line.split('=', 1)
-                        key = key.strip()
-                        value = value.strip()
-                        
-                        # Remove quotes if present
-                        if value.startswith('"') and value.endswith('"'):
-                            value = value[1:-1]
-                            
-                        # Add section prefix if in a section
-                        if current_section:
-                            key = f"{current_section}.{key}"
-                            
-                        config_data[key] = value
-                        
-            return config_data
-            
-        except Exception as e:
-            self.colorize("red", f"Failed to load configuration: {str(e)}", bold=True)
-            return None
+        config_data.update(config or {})
+        return LoadedConfig(config_path, config.mtime_ns if config else 0, config_data)
             
     def generate_random_token(self, length=12):
         """Generate a random token for FRP authentication"""
@@ -282,40 +256,9 @@ class FRP:
             
         # Create the configuration
         try:
-            with open(config_path, 'w') as f:
-                f.write(f"# FRP Server Configuration for {config_name}\n\n")
-                f.write(f"bindAddr = \"{bind_addr}\"\n")
-                f.write(f"bindPort = {bind_port}\n")
-                f.write(f"kcpBindPort = {bind_port}\n\n")
-                
-                f.write("transport.maxPoolCount = 5\n")
-                f.write("transport.tcpMux = true\n")
-                f.write("transport.tcpMuxKeepaliveInterval = 30\n")
-                f.write("transport.tcpKeepalive = 7200\n\n")
-                
-                f.write("auth.method = \"token\"\n")
-                f.write(f"auth.token = \"{auth_token}\"\n")
-                
+            self.write_server_config(config_name, bind_addr, bind_port, auth_token)
             self.colorize("green", f"Server configuration '{config_name}' created successfully", bold=True)
             
-            # Create system service
-            service_file = f"/etc/systemd/system/frps-{config_name}.service"
-            
-            with open(service_file, 'w') as f:
-                f.write("[Unit]\n")
-                f.write("Description=FRP Server Service\n")
-                f.write("After=network.target\n\n")
-                
-                f.write("[Service]\n")
-                f.write("Type=simple\n")
-                f.write(f"ExecStart={self.frps_binary} -c {config_path}\n")
-                f.write("Restart=always\n")
-                f.write("RestartSec=5\n")
-                f.write("LimitNOFILE=1048576\n\n")
-                
-                f.write("[Install]\n")
-                f.write("WantedBy=multi-user.target\n")
-                
             # Install the service
             self.install_service(config_name, "server")
             
@@ -387,45 +330,10 @@ class FRP:
         
         # Create the configuration
         try:
-            with open(config_path, 'w') as f:
-                f.write(f"# FRP Client Configuration for {config_name}\n\n")
-                f.write(f"serverAddr = \"{server_addr}\"\n")
-                f.write(f"serverPort = {server_port}\n\n")
-                
-                f.write("auth.method = \"token\"\n")
-                f.write(f"auth.token = \"{auth_token}\"\n\n")
-                
-                f.write(f"transport.protocol = \"{transport_protocol}\"\n")
-                f.write("transport.tcpMux = true\n")
-                f.write("transport.tcpMuxKeepaliveInterval = 30\n\n")
-                
-                f.write("[[proxies]]\n")
-                f.write(f"name = \"{proxy_name}\"\n")
-                f.write(f"type = \"{proxy_type}\"\n")
-                f.write(f"localIP = \"{local_ip}\"\n")
-                f.write(f"localPort = {local_port}\n")
-                f.write(f"remotePort = {remote_port}\n")
-                
+            self.write_client_config(config_name, server_addr, server_port, auth_token, transport_protocol,
+                                     proxy_name, proxy_type, local_ip, local_port, remote_port)
             self.colorize("green", f"Client configuration '{config_name}' created successfully", bold=True)
             
-            # Create system service
-            service_file = f"/etc/systemd/system/frpc-{config_name}.service"
-            
-            with open(service_file, 'w') as f:
-                f.write("[Unit]\n")
-                f.write("Description=FRP Client Service\n")
-                f.write("After=network.target\n\n")
-                
-                f.write("[Service]\n")
-                f.write("Type=simple\n")
-                f.write(f"ExecStart={self.frpc_binary} -c {config_path}\n")
-                f.write("Restart=always\n")
-                f.write("RestartSec=5\n")
-                f.write("LimitNOFILE=1048576\n\n")
-                
-                f.write("[Install]\n")
-                f.write("WantedBy=multi-user.target\n")
-                
             # Install the service
             self.install_service(config_name, "client")
             
@@ -435,50 +343,117 @@ class FRP:
             self.colorize("red", f"Failed to create client configuration: {str(e)}", bold=True)
             return False
     
+    def write_server_config(self, config_name: str, bind_addr: str, bind_port: int, auth_token: str) -> str:
+        """Write a server TOML file without prompting; returns its path"""
+        config_path = f"{self.configs_dir}/frps-{config_name}.toml"
+        with open(config_path, 'w') as f:
+            f.write(f"# FRP Server Configuration for {config_name}\n\n")
+            f.write(f"bindAddr = \"{bind_addr}\"\n")
+            f.write(f"bindPort = {bind_port}\n")
+            f.write(f"kcpBindPort = {bind_port}\n\n")
+            
+            f.write("transport.maxPoolCount = 5\n")
+            f.write("transport.tcpMux = true\n")
+            f.write("transport.tcpMuxKeepaliveInterval = 30\n")
+            f.write("transport.tcpKeepalive = 7200\n\n")
+            
+            f.write("auth.method = \"token\"\n")
+            f.write(f"auth.token = \"{auth_token}\"\n")
+        self.registry.update(frp=True)
+        return config_path
+    
+    def write_client_config(self, config_name: str, server_addr: str, server_port: int, auth_token: str,
+                            transport_protocol: str, proxy_name: str, proxy_type: str, local_ip: str,
+                            local_port: int, remote_port: int) -> str:
+        """Write a client TOML file with a single proxy without prompting; returns its path"""
+        config_path = f"{self.configs_dir}/frpc-{config_name}.toml"
+        with open(config_path, 'w') as f:
+            f.write(f"# FRP Client Configuration for {config_name}\n\n")
+            f.write(f"serverAddr = \"{server_addr}\"\n")
+            f.write(f"serverPort = {server_port}\n\n")
+            
+            f.write("auth.method = \"token\"\n")
+            f.write(f"auth.token = \"{auth_token}\"\n\n")
+            
+            f.write(f"transport.protocol = \"{transport_protocol}\"\n")
+            f.write("transport.tcpMux = true\n")
+            f.write("transport.tcpMuxKeepaliveInterval = 30\n\n")
+            
+            f.write("[[proxies]]\n")
+            f.write(f"name = \"{proxy_name}\"\n")
+            f.write(f"type = \"{proxy_type}\"\n")
+            f.write(f"localIP = \"{local_ip}\"\n")
+            f.write(f"localPort = {local_port}\n")
+            f.write(f"remotePort = {remote_port}\n")
+        self.registry.update(frp=True)
+        return config_path
+    
+    def render_unit(self, config_type: str) -> str:
+        """Text of the frps@/frpc@ template; instance <name> runs frp?-<name>.toml
+        
+        The TOML file is each instance's only per-tunnel file, so changing a tunnel
+        never touches the unit set.
+        """
+        binary = self.frps_binary if config_type == "server" else self.frpc_binary
+        prefix = "frps" if config_type == "server" else "frpc"
+        return render_unit([
+            ("Unit", {"Description": f"FRP {'Server' if config_type == 'server' else 'Client'} Service for %i",
+                      "After": "network.target"}),
+            ("Service", {"Type": "simple", "ExecStart": f"{binary} -c {self.configs_dir}/{prefix}-%i.toml",
+                         "Restart": "always", "RestartSec": 5, "LimitNOFILE": 1048576}),
+            ("Install", {"WantedBy": "multi-user.target"}),
+        ])
+    
+    def install_template(self, config_type: str) -> bool:
+        """Install a role's template unit; True if it changed and a daemon-reload is pending"""
+        return self.units.install(self.get_template_unit(config_type), self.render_unit(config_type))
+    
+    def get_command(self, config_name: str, config_type: str) -> Optional[List[str]]:
+        """Command line of an instance as the template runs it, or None without a configuration file"""
+        prefix = "frps" if config_type == "server" else "frpc"
+        config_path = f"{self.configs_dir}/{prefix}-{config_name}.toml"
+        if not os.path.exists(config_path):
+            return None
+        binary = self.frps_binary if config_type == "server" else self.frpc_binary
+        return [binary, "-c", config_path]
+
+    def is_unit_installed(self, config_name: str, config_type: str) -> bool:
+        return self.units.is_installed(self.get_template_unit(config_type))
+    
+    def prepare_migration(self) -> List[tuple]:
+        """Install templates for configurations still using a per-tunnel unit
+        
+        Returns (legacy unit, instance) pairs for UnitInstaller.replace_units; the
+        instances run the same TOML files, so nothing else needs rewriting.
+        """
+        replacements = []
+        for record in self.registry.records("frp"):
+            legacy = self.get_legacy_service_name(record.name, record.role)
+            if self.units.is_installed(legacy):
+                self.install_template(record.role)
+                replacements.append((legacy, self.get_service_name(record.name, record.role)))
+        return replacements
+    
     def install_service(self, config_name: str, config_type: str) -> bool:
         """Install and start the FRP service"""
         try:
-            # Determine the binary and config file paths
-            binary = self.frps_binary if config_type == "server" else self.frpc_binary
-            config_file = f"{self.configs_dir}/frp{'s' if config_type == 'server' else 'c'}-{config_name}.toml"
-            service_suffix = "s" if config_type == "server" else "c"
-            
-            # Create the service file in the user's home directory
-            service_dir = os.path.join(self.base_dir, "services")
-            os.makedirs(service_dir, exist_ok=True)
-            
-            service_file = os.path.join(service_dir, f"frp{service_suffix}-{config_name}.service")
-            
-            # Write the service file
-            with open(service_file, 'w') as f:
-                f.write(f"""[Unit]
-Description=FRP {'Server' if config_type == 'server' else 'Client'} Service for {config_name}
-After=network.target
-
-[Service]
-Type=simple
-ExecStart={binary} -c {config_file}
-Restart=always
-RestartSec=5
-LimitNOFILE=1048576
-
-[Install]
-WantedBy=multi-user.target
-""")
+            service_name = self.get_service_name(config_name, config_type)
+            # Copy the template to ~/.gamingtunnel/services and, as root, to systemd
+            self.install_template(config_type)
+            service_file = os.path.join(self.units.service_dir, self.get_template_unit(config_type))
             
-            self.colorize("green", f"Created service file: {service_file}", bold=True)
+            self.colorize("green", f"Service template: {service_file}", bold=True)
             
-            # Try to install the service file using systemd if running as root
+            # Try to install the service file using systemd if running as root;
+            # systemd is only reloaded when the template changed
             try:
-                systemd_dir = "/etc/systemd/system"
-                if os.access(systemd_dir, os.W_OK):
-                    systemd_service_file = f"/etc/systemd/system/frp{service_suffix}-{config_name}.service"
-                    shutil.copy2(service_file, systemd_service_file)
+                if self.units.can_install:
+                    if not self.units.reload():
+                        raise RuntimeError("systemctl daemon-reload failed")
                     
                     # Enable and start the service
-                    subprocess.run(["systemctl", "daemon-reload"], check=True)
-                    subprocess.run(["systemctl", "enable", f"frp{service_suffix}-{config_name}.service"], check=True)
-                    subprocess.run(["systemctl", "start", f"frp{service_suffix}-{config_name}.service"], check=True)
+                    subprocess.run(["systemctl", "enable", service_name], check=True)
+                    subprocess.run(["systemctl", "start", service_name], check=True)
                     
                     self.colorize("green", f"FRP {config_type} service installed and started", bold=True)
                 else:
@@ -486,15 +461,15 @@ WantedBy=multi-user.target
                     print(f"To install the service, run these commands as root:")
                     print(f"  sudo cp {service_file} /etc/systemd/system/")
                     print(f"  sudo systemctl daemon-reload")
-                    print(f"  sudo systemctl enable frp{service_suffix}-{config_name}.service")
-                    print(f"  sudo systemctl start frp{service_suffix}-{config_name}.service")
+                    print(f"  sudo systemctl enable {service_name}")
+                    print(f"  sudo systemctl start {service_name}")
             except Exception as e:
                 self.colorize("yellow", f"Could not install system service: {str(e)}", bold=True)
                 print(f"To install the service, run these commands as root:")
                 print(f"  sudo cp {service_file} /etc/systemd/system/")
                 print(f"  sudo systemctl daemon-reload")
-                print(f"  sudo systemctl enable frp{service_suffix}-{config_name}.service")
-                print(f"  sudo systemctl start frp{service_suffix}-{config_name}.service")
+                print(f"  sudo systemctl enable {service_name}")
+                print(f"  sudo systemctl start {service_name}")
             
             return True
         except Exception as e:
@@ -538,19 +513,32 @@ WantedBy=multi-user.target
             self.colorize("yellow", "No FRP configurations found", bold=True)
             return
             
+        # Query all units at once so the selection list can show their state
+        states = self.service_status.get_many(
+            [self.get_service_name(config['name'], config['type']) for config in configs]
+        )
+        
         # Create a selection menu
         self.colorize("cyan", "Available FRP configurations:", bold=True)
         for i, config in enumerate(configs, 1):
             config_type = "Server" if config['type'] == 'server' else "Client"
-            print(f"{i}. {config['name']} ({config_type})")
+            state = states[self.get_service_name(config['name'], config['type'])]
+            print(f"{i}. {config['name']} ({config_type}) - {state.describe()}")
             
         # Get user selection
         selection = Prompt.ask("Select a configuration (or 'all' to check all)", default="all")
         
         if selection.lower() == 'all':
-            # Check all configurations
-            for config in configs:
-                self.check_specific_service(config['name'], config['type'])
+            # Summarize every configuration from the batched query
+            table = Table(show_header=True)
+            table.add_column("Service", style="cyan")
+            table.add_column("State", style="yellow")
+            table.add_column("PID", style="green")
+            table.add_column("Restarts", style="magenta")
+            for service_name, state in states.items():
+                state_text = f"[green]{state.describe()}[/green]" if state.is_active else f"[red]{state.describe()}[/red]"
+                table.add_row(service_name, state_text, str(state.main_pid or "-"), str(state.n_restarts))
+            self.console.print(table)
         else:
             try:
                 index = int(selection) - 1
@@ -566,7 +554,7 @@ WantedBy=multi-user.target
     
     def check_specific_service(self, config_name: str, config_type: str):
         """Check the status of a specific service"""
-        service_name = f"frp{'s' if config_type == 'server' else 'c'}-{config_name}.service"
+        service_name = self.get_service_name(config_name, config_type)
         
         self.colorize("cyan", f"Checking status of {service_name}...", bold=True)
         
@@ -604,21 +592,17 @@ WantedBy=multi-user.target
             index = int(Prompt.ask("Select a configuration")) - 1
             if 0 <= index < len(configs):
                 selected_config = configs[index]
-                service_name = f"frp{'s' if selected_config['type'] == 'server' else 'c'}-{selected_config['name']}"
+                service_name = self.get_service_name(selected_config['name'], selected_config['type'])
                 
                 # Use journalctl to view logs
                 self.colorize("cyan", f"Viewing logs for {service_name}...", bold=True)
                 
                 try:
-                    # Use popen to allow paging through results
-                    process = subprocess.Popen(
-                        ["journalctl", "-u", f"{service_name}.service", "--no-pager", "-n", "100"],
-                        stdout=subprocess.PIPE
-                    )
-                    
-                    for line in process.stdout:
-                        print(line.decode('utf-8'), end='')
-                        
+                    entries = self.journal.recent([service_name], 100)
+                    if not entries:
+                        self.colorize("yellow", f"No journal entries for {service_name}", bold=True)
+                    for entry in entries:
+                        print(entry.format())
                 except Exception as e:
                     self.colorize("red", f"Error viewing logs: {str(e)}", bold=True)
             else:
@@ -653,7 +637,7 @@ WantedBy=multi-user.target
                 # Restart all services
                 self.colorize("yellow", "Restarting all FRP services...", bold=True)
                 for config in configs:
-                    service_name = f"frp{'s' if config['type'] == 'server' else 'c'}-{config['name']}.service"
+                    service_name = self.get_service_name(config['name'], config['type'])
                     try:
                         subprocess.run(["systemctl", "restart", service_name], check=True)
                         self.colorize("green", f"Service {service_name} restarted successfully", bold=True)
@@ -661,7 +645,7 @@ WantedBy=multi-user.target
                         self.colorize("red", f"Failed to restart {service_name}: {str(e)}", bold=True)
             elif 1 <= selection <= len(configs):
                 selected_config = configs[selection - 1]
-                service_name = f"frp{'s' if selected_config['type'] == 'server' else 'c'}-{selected_config['name']}.service"
+                service_name = self.get_service_name(selected_config['name'], selected_config['type'])
                 
                 try:
                     self.colorize("yellow", f"Restarting {service_name}...", bold=True)
@@ -712,7 +696,8 @@ WantedBy=multi-user.target
     
     def _remove_specific_service(self, config_name: str, config_type: str) -> bool:
         """Remove a specific FRP service and configuration"""
-        service_name = f"frp{'s' if config_type == 'server' else 'c'}-{config_name}.service"
+        service_name = self.get_service_name(config_name, config_type)
+        legacy_name = self.get_legacy_service_name(config_name, config_type)
         config_file = f"{self.configs_dir}/frp{'s' if config_type == 'server' else 'c'}-{config_name}.toml"
         
         # Stop the service
@@ -729,27 +714,26 @@ WantedBy=multi-user.target
         except subprocess.CalledProcessError:
             self.colorize("yellow", f"Failed to disable service {service_name}", bold=True)
             
-        # Remove the service file
-        service_file = f"/etc/systemd/system/{service_name}"
-        if os.path.exists(service_file):
-            try:
-                os.remove(service_file)
-                self.colorize("green", f"Service file {service_file} removed", bold=True)
-            except Exception as e:
-                self.colorize("red", f"Failed to remove service file: {str(e)}", bold=True)
+        # Remove the unit file of a tunnel that was never migrated to the template
+        try:
+            if self.units.is_installed(legacy_name):
+                subprocess.run(["systemctl", "disable", "--now", legacy_name], capture_output=True)
+                self.units.remove(legacy_name)
+                self.colorize("green", f"Service file {os.path.join(self.units.systemd_dir, legacy_name)} removed", bold=True)
+        except Exception as e:
+            self.colorize("red", f"Failed to remove service file: {str(e)}", bold=True)
                 
         # Remove the configuration file
         if os.path.exists(config_file):
             try:
                 os.remove(config_file)
                 self.colorize("green", f"Configuration file {config_file} removed", bold=True)
+                self.registry.update(frp=True)
             except Exception as e:
                 self.colorize("red", f"Failed to remove configuration file: {str(e)}", bold=True)
                 
-        # Reload systemd daemon
-        try:
-            subprocess.run(["systemctl", "daemon-reload"], check=True)
-        except subprocess.CalledProcessError:
+        # Reload systemd daemon, if a legacy unit file was removed
+        if not self.units.reload():
             self.colorize("yellow", "Failed to reload systemd daemon", bold=True)
             
         self.colorize("green", f"FRP {config_type} '{config_name}' removed successfully", bold=True)
@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+
+class ProbeResult:
+    """Outcome of a single health probe"""
+    __slots__ = ("key", "online", "elapsed", "timed_out", "error", "value")
+
+    def __init__(self, key: Hashable, online: bool = False, elapsed: float = 0.0,
+                 timed_out: bool = False, error: Optional[str] = None, value: Any = None):
+        self.key = key
+        self.online = online
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+        self.error = error
+        self.value = value
+
+
+class HealthProber:
+    """Run connection checks for many tunnels concurrently with a per-probe deadline
+
+    Every probe is a callable that receives its timeout in seconds and returns a truthy
+    value when the tunnel is healthy. Results are yielded as soon as they arrive, so the
+    total time of a refresh tracks the slowest probe instead of the sum of all of them.
+    """
+
+    def __init__(self, max_workers: int = 32, timeout: float = 2.0, grace: float = 1.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # Extra time a probe gets past its own timeout before it is reported as timed out
+        self.grace = grace
+
+    def probe_all(self, probes: Dict[Hashable, Callable[[float], Any]]) -> Iterator[ProbeResult]:
+        """Run all probes and yield a ProbeResult for each as it completes or times out"""
+        if not probes:
+            return
+
+        started: Dict[Hashable, float] = {}
+
+        def run(key, probe):
+            started[key] = time.monotonic()
+            return probe(self.timeout)
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(probes)))
+        try:
+            futures = {executor.submit(run, key, probe): key for key, probe in probes.items()}
+            pending = set(futures)
+            deadline_budget = self.timeout + self.grace
+
+            while pending:
+                # Wake up at the earliest deadline of the probes that are already running
+                now = time.monotonic()
+                running = [started[futures[f]] + deadline_budget for f in pending if futures[f] in started]
+                wait_for = max(0.0, min(running) - now) if running else deadline_budget
+                done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    key = futures[future]
+                    elapsed = time.monotonic() - started.get(key, now)
+                    try:
+                        value = future.result()
+                        yield ProbeResult(key, online=bool(value), elapsed=elapsed, value=value)
+                    except Exception as e:
+                        yield ProbeResult(key, elapsed=elapsed, error=str(e))
+
+                # Give up on probes that have overrun their own deadline
+                now = time.monotonic()
+                for future in list(pending):
+                    key = futures[future]
+                    if key in started and now - started[key] >= deadline_budget:
+                        pending.discard(future)
+                        future.cancel()
+                        yield ProbeResult(key, elapsed=now - started[key], timed_out=True)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
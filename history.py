@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# Rollup table -> (bucket width in seconds, retention in seconds)
+ROLLUPS = {
+    "rollup_1m": (60, 14 * 86400),
+    "rollup_1h": (3600, 180 * 86400),
+    "rollup_1d": (86400, 5 * 365 * 86400),
+}
+RAW_RETENTION = 2 * 86400
+DELTA_FIELDS = ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets", "drops")
+
+
+class HistoryStore:
+    """Persistent per-tunnel traffic history in SQLite (WAL mode)
+
+    Each recorded snapshot is turned into per-tunnel deltas against the last
+    counters seen, which are stored in the database too, so a kernel counter reset
+    after a service restart (or a restart of this process) never loses or
+    double-counts traffic. Deltas are kept raw for two days and summed into 1-minute,
+    1-hour and 1-day rollups as they are written, so range queries read a few
+    hundred rows at most.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        self.last_prune = 0.0
+
+    def create_tables(self):
+        columns = ", ".join(f"{field} INTEGER NOT NULL DEFAULT 0" for field in DELTA_FIELDS)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS last_counters ("
+                "name TEXT PRIMARY KEY, rx_bytes INTEGER, tx_bytes INTEGER, rx_packets INTEGER, "
+                "tx_packets INTEGER, drops INTEGER, ts REAL)"
+            )
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS samples (name TEXT NOT NULL, ts REAL NOT NULL, {columns})")
+            self.db.execute("CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts)")
+            for table in ROLLUPS:
+                self.db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} (name TEXT NOT NULL, bucket INTEGER NOT NULL, {columns}, "
+                    "PRIMARY KEY (bucket, name)) WITHOUT ROWID"
+                )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def record(self, counters: Dict[str, object], timestamp: Optional[float] = None):
+        """Record one set of interface counters, keyed by tunnel name
+
+        `counters` maps names to InterfaceCounters (or None when the interface is
+        missing, which is skipped).
+        """
+        timestamp = timestamp or time.time()
+        with self.lock, self.db:
+            previous = {
+                row[0]: row[1:] for row in self.db.execute(
+                    "SELECT name, rx_bytes, tx_bytes, rx_packets, tx_packets, drops FROM last_counters")
+            }
+            for name, current in counters.items():
+                if current is None:
+                    continue
+                values = (current.rx_bytes, current.tx_bytes, current.rx_packets, current.tx_packets,
+                          current.rx_drop + current.tx_drop)
+                before = previous.get(name)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO last_counters VALUES (?, ?, ?, ?, ?, ?, ?)", (name, *values, timestamp))
+                if before is None:
+                    # First sighting: nothing to compare against yet
+                    continue
+                # Counters restart from zero when the tunnel is recreated
+                deltas = [now - then if now >= then else now for now, then in zip(values, before)]
+                if not any(deltas):
+                    continue
+                self.db.execute("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)", (name, timestamp, *deltas))
+                for table, (width, _) in ROLLUPS.items():
+                    self.db.execute(
+                        f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (bucket, name) DO UPDATE SET "
+                        + ", ".join(f"{field} = {field} + excluded.{field}" for field in DELTA_FIELDS),
+                        (name, int(timestamp // width * width), *deltas),
+                    )
+
+        if timestamp - self.last_prune > 3600:
+            self.prune(timestamp)
+
+    def record_snapshot(self, snapshot, names: List[str], timestamp: Optional[float] = None):
+        """Record the given tunnels from a NetDevSnapshot"""
+        self.record({name: snapshot.get(name) for name in names}, timestamp)
+
+    def record_monitor(self, daemon, timestamp: float):
+        """MonitorDaemon listener recording the counters of its latest sample"""
+        with daemon.lock:
+            counters = {name: series.last_counters for name, series in daemon.tunnels.items()}
+        self.record(counters, timestamp)
+
+    def prune(self, now: Optional[float] = None):
+        """Drop samples and rollup buckets past their retention"""
+        now = now or time.time()
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM samples WHERE ts < ?", (now - RAW_RETENTION,))
+            for table, (_, retention) in ROLLUPS.items():
+                self.db.execute(f"DELETE FROM {table} WHERE bucket < ?", (now - retention,))
+            self.db.execute("DELETE FROM last_counters WHERE ts < ?", (now - RAW_RETENTION,))
+        self.last_prune = now
+
+    def pick_rollup(self, seconds: float) -> Tuple[str, int]:
+        """Coarsest-enough rollup for a window: keeps queries to a few hundred buckets per tunnel"""
+        if seconds <= 6 * 3600:
+            table = "rollup_1m"
+        elif seconds <= 14 * 86400:
+            table = "rollup_1h"
+        else:
+            table = "rollup_1d"
+        return table, ROLLUPS[table][0]
+
+    def top_talkers(self, seconds: float, limit: int = 10, now: Optional[float] = None) -> List[Dict[str, int]]:
+        """Tunnels ordered by total traffic over the last `seconds`"""
+        now = now or time.time()
+        table, width = self.pick_rollup(seconds)
+        since = int((now - seconds) // width * width)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT name, SUM(rx_bytes), SUM(tx_bytes), SUM(rx_packets), SUM(tx_packets), SUM(drops) "
+                f"FROM {table} WHERE bucket >= ? GROUP BY name "
+                "ORDER BY SUM(rx_bytes) + SUM(tx_bytes) DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [dict(zip(("name",) + DELTA_FIELDS, row)) for row in rows]
+
+    def usage(self, name: str, seconds: float, now: Optional[float] = None) -> List[Dict[str, int]]:
+        """Per-bucket traffic of one tunnel over the last `seconds`"""
+        now = now or time.time()
+        table, width = self.pick_rollup(seconds)
+        since = int((now - seconds) // width * width)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT bucket, {', '.join(DELTA_FIELDS)} FROM {table} WHERE name = ? AND bucket >= ? ORDER BY bucket",
+                (name, since),
+            ).fetchall()
+        return [dict(zip(("bucket",) + DELTA_FIELDS, row)) for row in rows]
+
+
+def default_history_path(base_dir: str) -> str:
+    return os.path.join(base_dir, "history.db")
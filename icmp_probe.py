@@ -0,0 +1,231 @@
+import os
+import select
+import socket
+import struct
+import time
+from collections import deque
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+ICMP_HEADER = struct.Struct("!BBHHH")
+# Payload: 4-byte run token, 8-byte monotonic send time in nanoseconds
+PAYLOAD = struct.Struct("!IQ")
+
+
+def icmp_checksum(data: bytes) -> int:
+    """RFC 1071 Internet checksum"""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class PingStats:
+    """RTT, loss and jitter for one probed target"""
+    __slots__ = ("key", "address", "sent", "received", "rtts", "outcomes")
+
+    def __init__(self, key: Hashable, address: str):
+        self.key = key
+        self.address = address
+        self.sent = 0
+        self.received = 0
+        # Round-trip times in milliseconds, in the order the requests were sent
+        self.rtts: List[float] = []
+        # One entry per request in send order: its RTT, or None when it was lost
+        self.outcomes: List[Optional[float]] = []
+
+    @property
+    def reachable(self) -> bool:
+        return self.received > 0
+
+    @property
+    def loss(self) -> float:
+        """Fraction of requests without a reply (0.0 - 1.0)"""
+        return 1.0 - self.received / self.sent if self.sent else 0.0
+
+    @property
+    def min_rtt(self) -> Optional[float]:
+        return min(self.rtts) if self.rtts else None
+
+    @property
+    def avg_rtt(self) -> Optional[float]:
+        return sum(self.rtts) / len(self.rtts) if self.rtts else None
+
+    @property
+    def max_rtt(self) -> Optional[float]:
+        return max(self.rtts) if self.rtts else None
+
+    @property
+    def jitter(self) -> Optional[float]:
+        """Mean absolute difference between consecutive RTTs in milliseconds"""
+        if len(self.rtts) < 2:
+            return None
+        diffs = [abs(b - a) for a, b in zip(self.rtts, self.rtts[1:])]
+        return sum(diffs) / len(diffs)
+
+    def summary(self) -> str:
+        if not self.reachable:
+            return f"{self.sent} sent, 0 received, 100% loss"
+        text = (f"{self.sent} sent, {self.received} received, {self.loss * 100:.0f}% loss, "
+                f"rtt min/avg/max = {self.min_rtt:.2f}/{self.avg_rtt:.2f}/{self.max_rtt:.2f} ms")
+        if self.jitter is not None:
+            text += f", jitter {self.jitter:.2f} ms"
+        return text
+
+
+class IcmpProber:
+    """In-process ICMP echo prober for many targets at once
+
+    Uses unprivileged ICMP datagram sockets, or raw sockets when running as root. One
+    socket is opened per bound device (plus one unbound) and all of them are serviced
+    from a single epoll loop, so hundreds of tunnels can be probed without fork/exec.
+    """
+
+    def __init__(self, count: int = 1, interval: float = 0.2, timeout: float = 2.0,
+                 rate: Optional[float] = None, raw: Optional[bool] = None):
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        # Upper bound on echo requests per second across all targets (None = unlimited)
+        self.rate = rate
+        self.raw = os.geteuid() == 0 if raw is None else raw
+        self.ident = os.getpid() & 0xffff
+
+    def _open_socket(self, device: Optional[str]) -> Tuple[socket.socket, bool]:
+        kinds = [socket.SOCK_RAW, socket.SOCK_DGRAM] if self.raw else [socket.SOCK_DGRAM, socket.SOCK_RAW]
+        error = None
+        for kind in kinds:
+            try:
+                sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+                break
+            except PermissionError as e:
+                error = e
+        else:
+            raise error
+
+        sock.setblocking(False)
+        if device:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, device.encode() + b"\0")
+            except OSError:
+                # Binding needs CAP_NET_RAW; the tunnel route still selects the device
+                pass
+        return sock, kind == socket.SOCK_RAW
+
+    def _build_request(self, seq: int, token: int) -> bytes:
+        payload = PAYLOAD.pack(token, time.monotonic_ns())
+        header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, self.ident, seq)
+        checksum = icmp_checksum(header + payload)
+        return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, self.ident, seq) + payload
+
+    def _parse_reply(self, data: bytes, is_raw: bool, token: int) -> Optional[Tuple[int, int]]:
+        """Return (seq, send_ns) for one of our echo replies, or None"""
+        if is_raw:
+            # Raw sockets deliver the IP header too, and every ICMP packet on the host
+            data = data[(data[0] & 0x0f) * 4:]
+        if len(data) < ICMP_HEADER.size + PAYLOAD.size:
+            return None
+        icmp_type, _, _, ident, seq = ICMP_HEADER.unpack_from(data)
+        if icmp_type != ICMP_ECHO_REPLY or (is_raw and ident != self.ident):
+            return None
+        reply_token, send_ns = PAYLOAD.unpack_from(data, ICMP_HEADER.size)
+        if reply_token != token:
+            return None
+        return seq, send_ns
+
+    def probe(self, targets: List[Tuple[Hashable, str, Optional[str]]]) -> Dict[Hashable, PingStats]:
+        """Probe (key, address, device) targets and return PingStats per key"""
+        results = {key: PingStats(key, address) for key, address, _ in targets}
+        if not targets:
+            return results
+
+        token = int.from_bytes(os.urandom(4), "big")
+        sockets: Dict[Optional[str], Tuple[socket.socket, bool]] = {}
+        epoll = select.epoll()
+        by_fd = {}
+        try:
+            for _, _, device in targets:
+                if device not in sockets:
+                    sock, is_raw = self._open_socket(device)
+                    sockets[device] = (sock, is_raw)
+                    by_fd[sock.fileno()] = (sock, is_raw)
+                    epoll.register(sock.fileno(), select.EPOLLIN)
+
+            # Sequence numbers are unique per packet within this run
+            schedule = deque()
+            for round_no in range(self.count):
+                for key, address, device in targets:
+                    schedule.append((round_no * self.interval, key, address, device))
+            in_flight: Dict[int, Hashable] = {}
+            replies: Dict[int, float] = {}
+            order: Dict[Hashable, List[int]] = {key: [] for key in results}
+
+            gap = 1.0 / self.rate if self.rate else 0.0
+            start = time.monotonic()
+            next_send = start
+            seq = 0
+            deadline = None
+
+            while schedule or (in_flight and time.monotonic() < deadline):
+                now = time.monotonic()
+                # Send every request that is due, respecting the rate limit
+                while schedule and now >= max(next_send, start + schedule[0][0]):
+                    _, key, address, device = schedule.popleft()
+                    seq = (seq + 1) & 0xffff
+                    sock, _ = sockets[device]
+                    try:
+                        sock.sendto(self._build_request(seq, token), (address, 0))
+                        in_flight[seq] = key
+                        order[key].append(seq)
+                    except OSError:
+                        pass
+                    results[key].sent += 1
+                    next_send = now + gap
+                    now = time.monotonic()
+                if not schedule and deadline is None:
+                    deadline = time.monotonic() + self.timeout
+
+                if schedule:
+                    wake = max(next_send, start + schedule[0][0]) - time.monotonic()
+                else:
+                    wake = deadline - time.monotonic()
+
+                for fd, _ in epoll.poll(max(0.0, wake)):
+                    sock, is_raw = by_fd[fd]
+                    while True:
+                        try:
+                            data = sock.recv(2048)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError:
+                            break
+                        received_ns = time.monotonic_ns()
+                        parsed = self._parse_reply(data, is_raw, token)
+                        if parsed is None:
+                            continue
+                        reply_seq, send_ns = parsed
+                        key = in_flight.pop(reply_seq, None)
+                        if key is None:
+                            continue
+                        results[key].received += 1
+                        replies[reply_seq] = (received_ns - send_ns) / 1e6
+
+            # Keep RTTs in send order so jitter reflects consecutive packets
+            for key, seqs in order.items():
+                results[key].outcomes = [replies.get(s) for s in seqs]
+                results[key].rtts = [rtt for rtt in results[key].outcomes if rtt is not None]
+        finally:
+            epoll.close()
+            for sock, _ in sockets.values():
+                sock.close()
+
+        return results
+
+    def ping(self, address: str, device: Optional[str] = None) -> PingStats:
+        """Probe a single address"""
+        return self.probe([(address, address, device)])[address]
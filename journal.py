@@ -0,0 +1,266 @@
+import heapq
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from systemd import journal as systemd_journal
+except ImportError:  # python-systemd is optional; journalctl is used instead
+    systemd_journal = None
+
+# syslog priority of "err"; lower values are more severe
+JOURNAL_ERR = 3
+
+
+class JournalEntry:
+    """One journal record of a tunnel unit"""
+    __slots__ = ("unit", "timestamp", "cursor", "message", "priority", "pid")
+
+    def __init__(self, unit: str, timestamp: float, cursor: str, message: str, priority: int = 6, pid: int = 0):
+        self.unit = unit
+        # Seconds since the epoch, with the journal's microsecond precision
+        self.timestamp = timestamp
+        self.cursor = cursor
+        self.message = message
+        self.priority = priority
+        self.pid = pid
+
+    def format(self, show_unit: bool = False) -> str:
+        """Line in the style of `journalctl -o short-iso`"""
+        text = datetime.fromtimestamp(self.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        if show_unit:
+            text += f" {self.unit}"
+        if self.pid:
+            text += f"[{self.pid}]"
+        return f"{text}: {self.message}"
+
+
+def decode_field(value) -> str:
+    """journalctl -o json prints non-UTF-8 fields as arrays of byte values"""
+    if isinstance(value, list):
+        return bytes(value).decode("utf-8", errors="replace")
+    return "" if value is None else str(value)
+
+
+def entry_unit(fields: Dict[str, object], units: Iterable[str]) -> Optional[str]:
+    """Which of the requested units a record belongs to
+
+    `journalctl -u` also returns systemd's own messages about a unit ("Started ..."),
+    which carry the unit in UNIT= while _SYSTEMD_UNIT is init.scope.
+    """
+    for key in ("_SYSTEMD_UNIT", "UNIT", "OBJECT_SYSTEMD_UNIT"):
+        unit = fields.get(key)
+        if unit in units:
+            return unit
+    return None
+
+
+def to_int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def batch_position(units: List[str], found: List[Tuple[JournalEntry, int]],
+                   started: Optional[int] = None) -> Dict[str, Tuple[str, int]]:
+    """Position every unit of one journal read has reached: the newest record the read returned
+
+    When it returned nothing, units read for the first time start from the time of the
+    read (an empty cursor), so a unit that never logged is not asked for history again.
+    """
+    if found:
+        entry, realtime = max(found, key=lambda pair: pair[1])
+        return {unit: (entry.cursor, realtime) for unit in units}
+    if started is not None:
+        return {unit: ("", started) for unit in units}
+    return {}
+
+
+class JournalReader:
+    """Incremental reader of the journal of many tunnel units
+
+    Keeps the cursor of the newest entry seen per unit and the last `history`
+    entries in memory, so viewing the same logs again, or polling from the
+    monitor, only asks the journal for what was written since. All units are
+    read in one pass: one `journalctl -o json` run, or python-systemd's reader
+    when it is installed.
+    """
+
+    def __init__(self, history: int = 1000, journalctl: str = "journalctl", state_path: Optional[str] = None,
+                 native: Optional[bool] = None):
+        self.history = history
+        self.journalctl = journalctl
+        # Optional file persisting cursors across runs (cursors only, not entries)
+        self.state_path = state_path
+        self.native = systemd_journal is not None if native is None else native
+        # unit -> (cursor, realtime in microseconds) of the newest entry seen
+        self.cursors: Dict[str, Tuple[str, int]] = {}
+        self.entries: Dict[str, Deque[JournalEntry]] = {}
+        self.lock = threading.Lock()
+        self.load_state()
+
+    def load_state(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, "r") as f:
+                self.cursors = {unit: (value[0], int(value[1])) for unit, value in json.load(f).items()}
+        except (OSError, ValueError, TypeError, IndexError, AttributeError):
+            self.cursors = {}
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self.cursors, f)
+            os.replace(temp_path, self.state_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def parse(self, fields: Dict[str, object], units: Iterable[str]) -> Optional[Tuple[JournalEntry, int]]:
+        unit = entry_unit(fields, units)
+        if unit is None:
+            return None
+        realtime = to_int(decode_field(fields.get("__REALTIME_TIMESTAMP")))
+        entry = JournalEntry(unit, realtime / 1e6, decode_field(fields.get("__CURSOR")),
+                             decode_field(fields.get("MESSAGE")), to_int(decode_field(fields.get("PRIORITY")), 6),
+                             to_int(decode_field(fields.get("_PID"))))
+        return entry, realtime
+
+    def run_journalctl(self, units: List[str], args: List[str]) -> List[Tuple[JournalEntry, int]]:
+        command = [self.journalctl, "-o", "json", "--no-pager", *args]
+        for unit in units:
+            command += ["-u", unit]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True)
+        except OSError:
+            return []
+        records = []
+        for line in result.stdout.splitlines():
+            try:
+                parsed = self.parse(json.loads(line), units)
+            except ValueError:
+                continue
+            if parsed is not None:
+                records.append(parsed)
+        return records
+
+    def read_journalctl(self, units: List[str]) -> Tuple[List[Tuple[JournalEntry, int]], Dict[str, Tuple[str, int]]]:
+        """New records of every unit from at most two journalctl runs, and the position each unit was read to"""
+        known = [unit for unit in units if unit in self.cursors]
+        unknown = [unit for unit in units if unit not in self.cursors]
+        records = []
+        positions: Dict[str, Tuple[str, int]] = {}
+        if known:
+            cursors = {self.cursors[unit][0] for unit in known}
+            cursor = cursors.pop() if len(cursors) == 1 else ""
+            if cursor:
+                found = self.run_journalctl(known, ["--after-cursor", cursor])
+            else:
+                # journalctl takes a single cursor, so units at different positions are read
+                # from the oldest once; the read then moves all of them to the same position
+                since = min(self.cursors[unit][1] for unit in known)
+                found = self.run_journalctl(known, ["--since", f"@{since // 1000000}.{since % 1000000:06d}"])
+            records += found
+            positions.update(batch_position(known, found))
+        if unknown:
+            started = int(time.time() * 1e6)
+            found = self.run_journalctl(unknown, ["-n", str(self.history * len(unknown))])
+            records += found
+            positions.update(batch_position(unknown, found, started))
+        return records, positions
+
+    def read_native(self, units: List[str]) -> Tuple[List[Tuple[JournalEntry, int]], Dict[str, Tuple[str, int]]]:
+        """New records of every unit via python-systemd, seeking each unit to its cursor"""
+        reader = systemd_journal.Reader()
+        records = []
+        positions: Dict[str, Tuple[str, int]] = {}
+        started = int(time.time() * 1e6)
+        try:
+            for unit in units:
+                reader.flush_matches()
+                reader.add_match(_SYSTEMD_UNIT=unit)
+                reader.add_disjunction()
+                reader.add_match(UNIT=unit)
+                position = self.cursors.get(unit)
+                found = []
+                if position is not None:
+                    if position[0]:
+                        reader.seek_cursor(position[0])
+                    else:
+                        reader.seek_realtime(datetime.fromtimestamp(position[1] / 1e6))
+                    for fields in reader:
+                        found.append(fields)
+                else:
+                    reader.seek_tail()
+                    for _ in range(self.history):
+                        fields = reader.get_previous()
+                        if not fields:
+                            break
+                        found.append(fields)
+                    found.reverse()
+                for fields in found:
+                    # python-systemd converts fields to Python types; bring them back to journalctl's shape
+                    raw = {key: value for key, value in fields.items() if not isinstance(value, datetime)}
+                    raw["__REALTIME_TIMESTAMP"] = int(fields["__REALTIME_TIMESTAMP"].timestamp() * 1e6)
+                    parsed = self.parse(raw, [unit])
+                    if parsed is not None:
+                        records.append(parsed)
+                if position is None and not found:
+                    positions[unit] = ("", started)
+        finally:
+            reader.close()
+        return records, positions
+
+    def fetch(self, units: List[str]) -> Dict[str, List[JournalEntry]]:
+        """Entries written since the previous fetch, per unit and in time order"""
+        with self.lock:
+            records, positions = self.read_native(units) if self.native else self.read_journalctl(units)
+            new: Dict[str, List[Tuple[JournalEntry, int]]] = {unit: [] for unit in units}
+            for entry, realtime in records:
+                position = self.cursors.get(entry.unit)
+                if position is not None:
+                    if realtime < position[1] or entry.cursor == position[0]:
+                        continue
+                    # Entries sharing the cursor's microsecond may already be cached
+                    if realtime == position[1] and any(seen.cursor == entry.cursor
+                                                       for seen in self.entries.get(entry.unit, ())):
+                        continue
+                new[entry.unit].append((entry, realtime))
+            for unit, pairs in new.items():
+                if not pairs:
+                    continue
+                pairs.sort(key=lambda pair: pair[1])
+                if unit not in self.cursors:
+                    del pairs[:-self.history]
+                self.entries.setdefault(unit, deque(maxlen=self.history)).extend(entry for entry, _ in pairs)
+                self.cursors[unit] = (pairs[-1][0].cursor, pairs[-1][1])
+            # Quiet units move along with the rest of their read, so they never hold it back
+            for unit, position in positions.items():
+                current = self.cursors.get(unit)
+                if current is None or position[1] >= current[1]:
+                    self.cursors[unit] = position
+            self.save_state()
+            return {unit: [entry for entry, _ in pairs] for unit, pairs in new.items()}
+
+    def recent(self, units: List[str], count: int = 100) -> List[JournalEntry]:
+        """The last `count` entries of the units merged into one time-ordered stream"""
+        self.fetch(units)
+        with self.lock:
+            merged = heapq.merge(*(list(self.entries.get(unit, ())) for unit in units),
+                                 key=lambda entry: entry.timestamp)
+            return list(deque(merged, maxlen=count))
+
+    def follow_new(self, units: List[str]) -> List[JournalEntry]:
+        """Entries written since the last call, merged into one time-ordered stream"""
+        new = self.fetch(units)
+        return list(heapq.merge(*new.values(), key=lambda entry: entry.timestamp))
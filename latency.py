@@ -0,0 +1,216 @@
+import math
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with fixed memory (HDR-style)
+
+    Values are recorded in microseconds. Each power-of-two range is split into
+    `2 ** (sub_bucket_bits - 1)` linear sub-buckets, so every reported value is within
+    about 1.6% of the recorded one (with the default 7 bits) across the whole range
+    from 1 us to `max_value_ms`. With the defaults a histogram is ~5 KB.
+    """
+    __slots__ = ("sub_bucket_bits", "sub_bucket_count", "half_count", "max_value", "counts",
+                 "total", "min_value", "max_seen", "sum")
+
+    def __init__(self, max_value_ms: float = 60000.0, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.max_value = int(max_value_ms * 1000)
+        self.counts = array("I", [0]) * (self.bucket_index(self.max_value) + 1)
+        self.total = 0
+        self.min_value = None
+        self.max_seen = 0
+        self.sum = 0
+
+    def bucket_index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + ((value >> shift) - self.half_count)
+
+    def bucket_value(self, index: int) -> int:
+        """Midpoint of the value range covered by a bucket"""
+        if index < self.sub_bucket_count:
+            return index
+        shift, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        shift += 1
+        low = (offset + self.half_count) << shift
+        return low + ((1 << shift) - 1) // 2
+
+    def record(self, value_ms: float, count: int = 1):
+        value = min(max(0, int(round(value_ms * 1000))), self.max_value)
+        self.counts[self.bucket_index(value)] += count
+        self.total += count
+        self.sum += value * count
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_seen = max(self.max_seen, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add the counts of a histogram with the same layout"""
+        if not other.total:
+            return
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+        self.max_seen = max(self.max_seen, other.max_seen)
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.total = 0
+        self.sum = 0
+        self.min_value = None
+        self.max_seen = 0
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Value in milliseconds at or below which `percent` of the samples fall"""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # Never report beyond the observed extremes
+                value = min(max(self.bucket_value(index), self.min_value), self.max_seen)
+                return value / 1000
+        return self.max_seen / 1000
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.total / 1000 if self.total else None
+
+    def to_dict(self) -> Dict[str, object]:
+        """Sparse, JSON-serialisable form: {bucket index: count}"""
+        return {
+            "sub_bucket_bits": self.sub_bucket_bits,
+            "max_value_ms": self.max_value / 1000,
+            "min": self.min_value,
+            "max": self.max_seen,
+            "sum": self.sum,
+            "counts": {str(i): c for i, c in enumerate(self.counts) if c},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "LatencyHistogram":
+        histogram = cls(data["max_value_ms"], data["sub_bucket_bits"])
+        for index, count in data["counts"].items():
+            histogram.counts[int(index)] = count
+            histogram.total += count
+        histogram.min_value = data["min"]
+        histogram.max_seen = data["max"]
+        histogram.sum = data["sum"]
+        return histogram
+
+
+class WindowSlot:
+    """Probe outcomes of one time slot of a LatencyTracker"""
+    __slots__ = ("start", "histogram", "sent", "lost", "bursts", "max_burst")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.histogram = LatencyHistogram()
+        self.sent = 0
+        self.lost = 0
+        self.bursts = 0
+        self.max_burst = 0
+
+
+class LatencyTracker:
+    """Sliding-window latency, jitter and loss-burst statistics for one tunnel
+
+    Probe outcomes are grouped into fixed slots (`slot_seconds` each, `slots` kept),
+    and windows are answered by merging the newest slots, so memory stays fixed no
+    matter how many probes are recorded. Jitter is the RFC 3550 interarrival estimate
+    J += (|D| - J) / 16, using the change in RTT between consecutive replies.
+    """
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, slot_seconds: float = 300.0, slots: int = 12):
+        self.slot_seconds = slot_seconds
+        self.slots: List[WindowSlot] = []
+        self.max_slots = slots
+        self.jitter = 0.0
+        self.last_rtt: Optional[float] = None
+        self.burst = 0
+
+    def _slot(self, timestamp: float) -> WindowSlot:
+        start = timestamp - timestamp % self.slot_seconds
+        if not self.slots or self.slots[-1].start != start:
+            self.slots.append(WindowSlot(start))
+            del self.slots[:-self.max_slots]
+        return self.slots[-1]
+
+    def record(self, outcomes: Iterable[Optional[float]], timestamp: float):
+        """Record probe outcomes in send order: an RTT in milliseconds, or None when lost"""
+        slot = self._slot(timestamp)
+        for rtt in outcomes:
+            slot.sent += 1
+            if rtt is None:
+                slot.lost += 1
+                self.burst += 1
+                if self.burst == 1:
+                    slot.bursts += 1
+                slot.max_burst = max(slot.max_burst, self.burst)
+                continue
+            self.burst = 0
+            slot.histogram.record(rtt)
+            if self.last_rtt is not None:
+                self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+            self.last_rtt = rtt
+
+    def window(self, seconds: float, now: float) -> Dict[str, Optional[float]]:
+        """Percentiles, jitter and loss bursts over the newest `seconds`"""
+        histogram = LatencyHistogram()
+        sent = lost = bursts = max_burst = 0
+        for slot in self.slots:
+            if slot.start + self.slot_seconds <= now - seconds:
+                continue
+            histogram.merge(slot.histogram)
+            sent += slot.sent
+            lost += slot.lost
+            bursts += slot.bursts
+            max_burst = max(max_burst, slot.max_burst)
+
+        report = {
+            "seconds": seconds,
+            "sent": sent,
+            "received": histogram.total,
+            "loss": lost / sent if sent else None,
+            "loss_bursts": bursts,
+            "max_loss_burst": max_burst,
+            "min": histogram.min_value / 1000 if histogram.total else None,
+            "mean": histogram.mean,
+            "max": histogram.max_seen / 1000 if histogram.total else None,
+            "jitter": self.jitter if self.last_rtt is not None else None,
+        }
+        for percent in self.PERCENTILES:
+            report[percentile_key(percent)] = histogram.percentile(percent)
+        return report
+
+
+def percentile_key(percent: float) -> str:
+    """Report key of a percentile, e.g. 99.9 -> 'p99.9'"""
+    return f"p{percent:g}"
+
+
+def format_latency_report(report: Dict[str, Optional[float]]) -> List[str]:
+    """Human-readable lines for a LatencyTracker window"""
+    if not report.get("received"):
+        return [f"No replies ({report.get('sent', 0)} probes sent)"]
+    percentiles = " / ".join(
+        f"{report[percentile_key(p)]:.2f}" for p in LatencyTracker.PERCENTILES)
+    labels = "/".join(percentile_key(p) for p in LatencyTracker.PERCENTILES)
+    lines = [f"Latency {labels}: {percentiles} ms (min {report['min']:.2f}, max {report['max']:.2f})"]
+    if report["jitter"] is not None:
+        lines.append(f"Jitter (RFC 3550): {report['jitter']:.2f} ms")
+    lines.append(f"Packet Loss: {report['loss'] * 100:.1f}% of {report['sent']} probes, "
+                 f"{report['loss_bursts']} bursts (longest {report['max_loss_burst']})")
+    return lines
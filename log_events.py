@@ -0,0 +1,305 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from logtail import line_time
+
+
+# Event type -> pattern searched for in a log line, in priority order; lines matching none are
+# only events when logged at ERROR or FATAL level.
+# A "count" group is stored as the event's value.
+EVENT_PATTERNS = [
+    ("fec", re.compile(rb"(?i)fec\b.*?\brecover\w*\D{0,8}(?P<count>\d+)|(?P<count2>\d+)\s+(?:packets?\s+)?recovered")),
+    ("mtu", re.compile(rb"(?i)\bmtu\b.*?(?:too (?:large|big|small)|exceed|warn|fragment)|"
+                       rb"(?:too (?:large|big)|exceed\w*).*?\bmtu\b")),
+    ("handshake", re.compile(rb"(?i)handshake|changed state to (?:server|client)_ready")),
+    ("reconnect", re.compile(rb"(?i)reconnect|connection (?:lost|timed? ?out|closed)|"
+                             rb"changed state to (?:client_idle|server_idle)")),
+    ("new_connection", re.compile(rb"(?i)new connection")),
+]
+LEVEL_PATTERN = re.compile(rb"^\[?[\d\- :T]{19}\]?\s*\[(?P<level>[A-Z]+)\]")
+# ip:port, [ip]:port or [ipv6]:port
+PEER_PATTERN = re.compile(rb"\[?(\d{1,3}(?:\.\d{1,3}){3})\]?:(\d{1,5})\b|\[([0-9a-fA-F:]*:[0-9a-fA-F:]*)\]:(\d{1,5})\b")
+ERROR_LEVELS = {b"ERROR", b"FATAL"}
+EVENT_TYPES = [name for name, _ in EVENT_PATTERNS] + ["error"]
+
+# Raw events are kept for two weeks; hourly counts per type for a year
+EVENT_RETENTION = 14 * 86400
+COUNT_RETENTION = 365 * 86400
+HOUR = 3600
+
+
+class LogEvent:
+    """One typed event extracted from a tunnel log line"""
+    __slots__ = ("tunnel", "source", "ts", "type", "value", "peer", "message")
+
+    def __init__(self, tunnel: str, source: str, ts: float, type: str, value: Optional[int] = None,
+                 peer: Optional[str] = None, message: str = ""):
+        self.tunnel = tunnel
+        self.source = source
+        self.ts = ts
+        self.type = type
+        self.value = value
+        self.peer = peer
+        self.message = message
+
+
+def classify(line: bytes) -> Optional[Tuple[str, Optional[int], Optional[str]]]:
+    """(event type, value, peer) of a log line, or None when it is not an event"""
+    for event_type, pattern in EVENT_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            count = match.groupdict().get("count") or match.groupdict().get("count2")
+            break
+    else:
+        level = LEVEL_PATTERN.match(line)
+        if not (level and level.group("level") in ERROR_LEVELS):
+            return None
+        event_type, count = "error", None
+    peer = PEER_PATTERN.search(line)
+    if peer:
+        if peer.group(1):
+            peer = f"{peer.group(1).decode()}:{peer.group(2).decode()}"
+        else:
+            peer = f"[{peer.group(3).decode()}]:{peer.group(4).decode()}"
+    return event_type, int(count) if count else None, peer
+
+
+class LogEventParser:
+    """Turn a stream of log lines into LogEvents
+
+    Lines without a timestamp take the time of the last line that had one.
+    """
+
+    def __init__(self, tunnel: str, source: str, last_ts: Optional[float] = None):
+        self.tunnel = tunnel
+        self.source = source
+        self.last_ts = last_ts
+
+    def feed(self, line: bytes) -> Optional[LogEvent]:
+        timestamp = line_time(line)
+        if timestamp is not None:
+            self.last_ts = timestamp.timestamp()
+        result = classify(line)
+        if result is None or self.last_ts is None:
+            return None
+        event_type, value, peer = result
+        message = line.decode("utf-8", errors="replace").strip()[:240]
+        return LogEvent(self.tunnel, self.source, self.last_ts, event_type, value, peer, message)
+
+
+class LogEventIndex:
+    """Typed events from the tunnel logs in SQLite, indexed by tunnel, type and time
+
+    Each log file is read forward from the byte offset reached last time, so an
+    indexing pass costs only the lines written since; offsets follow a file across
+    rotation to <path>.1. Events are kept two weeks, with hourly counts per tunnel
+    and type kept for a year, so "reconnects on X in the last 24 h" is an index
+    range lookup rather than a scan of the logs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        self.last_prune = 0.0
+
+    def create_tables(self):
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS events (tunnel TEXT NOT NULL, type TEXT NOT NULL, ts REAL NOT NULL, "
+                "source TEXT NOT NULL, value INTEGER, peer TEXT, message TEXT)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS events_lookup ON events (tunnel, type, ts)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS events_ts ON events (ts)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS event_counts (tunnel TEXT NOT NULL, type TEXT NOT NULL, "
+                "bucket INTEGER NOT NULL, count INTEGER NOT NULL DEFAULT 0, value INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (tunnel, type, bucket)) WITHOUT ROWID"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS log_offsets (path TEXT PRIMARY KEY, inode INTEGER, offset INTEGER, "
+                "last_ts REAL)"
+            )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def index_file(self, path: str, tunnel: str, source: str, batch: int = 5000) -> int:
+        """Index the lines appended to one log since the last pass; returns the number of events added
+
+        Each batch is committed together with the offset it reaches, in a transaction
+        that first checks the stored offset is still the one this pass continues from.
+        Another process indexing the same log, or a crash between batches, therefore
+        never stores a line twice: a pass that finds the offset moved stops and leaves
+        the rest to whoever moved it.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT inode, offset, last_ts FROM log_offsets WHERE path = ?", (path,)).fetchone()
+        try:
+            current_inode = os.stat(path).st_ino
+        except OSError:
+            return 0
+
+        # (file, inode, start offset); finish the rotated file first when the log moved on since the last pass
+        passes = []
+        if row is not None and row[0] != current_inode and os.path.exists(f"{path}.1"):
+            if os.stat(f"{path}.1").st_ino == row[0]:
+                passes.append((f"{path}.1", row[0], row[1]))
+            passes.append((path, current_inode, 0))
+        elif row is not None and row[0] == current_inode and os.path.getsize(path) >= row[1]:
+            passes.append((path, current_inode, row[1]))
+        else:
+            # New or truncated file
+            passes.append((path, current_inode, 0))
+
+        parser = LogEventParser(tunnel, source, row[2] if row else None)
+        claimed = (row[0], row[1]) if row else None
+        added = 0
+        try:
+            for file_path, inode, start in passes:
+                with open(file_path, "rb") as f:
+                    f.seek(start)
+                    offset = start
+                    pending: List[LogEvent] = []
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            # Incomplete last line; picked up on the next pass
+                            break
+                        offset += len(line)
+                        event = parser.feed(line.rstrip(b"\n"))
+                        if event is not None:
+                            pending.append(event)
+                        if len(pending) >= batch:
+                            if not self.commit(path, claimed, (inode, offset), parser.last_ts, pending):
+                                return added
+                            added += len(pending)
+                            claimed = (inode, offset)
+                            pending = []
+                    if not self.commit(path, claimed, (inode, offset), parser.last_ts, pending):
+                        return added
+                    added += len(pending)
+                    claimed = (inode, offset)
+        except sqlite3.OperationalError:
+            # Another indexer held the database past the timeout; it is indexing the same lines
+            pass
+        return added
+
+    def commit(self, path: str, claimed: Optional[Tuple[int, int]], reached: Tuple[int, int],
+               last_ts: Optional[float], events: List[LogEvent]) -> bool:
+        """Store a batch and the (inode, offset) it reaches if `claimed` is still the stored position"""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT inode, offset FROM log_offsets WHERE path = ?", (path,)).fetchone()
+                if row != claimed:
+                    self.db.rollback()
+                    return False
+                self.store(events)
+                self.db.execute("INSERT OR REPLACE INTO log_offsets VALUES (?, ?, ?, ?)", (path, *reached, last_ts))
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+        return True
+
+    def store(self, events: List[LogEvent]):
+        """Insert events and their hourly counts within the caller's transaction"""
+        if not events:
+            return
+        self.db.executemany(
+            "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(e.tunnel, e.type, e.ts, e.source, e.value, e.peer, e.message) for e in events],
+        )
+        self.db.executemany(
+            "INSERT INTO event_counts (tunnel, type, bucket, count, value) VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT (tunnel, type, bucket) DO UPDATE SET count = count + 1, value = value + excluded.value",
+            [(e.tunnel, e.type, int(e.ts // HOUR * HOUR), e.value or 0) for e in events],
+        )
+
+    def index_tunnels(self, tinyvpn, udp2raw) -> int:
+        """Index the logs of every TinyVPN and UDP2Raw configuration"""
+        added = 0
+        for source, module in (("tinyvpn", tinyvpn), ("udp2raw", udp2raw)):
+            for config in module.get_available_configs():
+                added += self.index_file(module.get_log_file(config['name'], config['type']), config['name'], source)
+        if time.time() - self.last_prune > HOUR:
+            self.prune()
+        return added
+
+    def record_monitor(self, daemon, timestamp: float):
+        """MonitorDaemon listener indexing what the tunnels logged since the last sample"""
+        self.index_tunnels(daemon.tinyvpn, daemon.udp2raw)
+
+    def prune(self, now: Optional[float] = None):
+        now = now or time.time()
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM events WHERE ts < ?", (now - EVENT_RETENTION,))
+            self.db.execute("DELETE FROM event_counts WHERE bucket < ?", (now - COUNT_RETENTION,))
+        self.last_prune = now
+
+    def count(self, tunnel: str, event_type: str, seconds: float, now: Optional[float] = None) -> Dict[str, int]:
+        """Number of events (and sum of their values) of one type on a tunnel over the last `seconds`"""
+        now = now or time.time()
+        since = now - seconds
+        with self.lock:
+            if seconds <= EVENT_RETENTION:
+                row = self.db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(value), 0) FROM events WHERE tunnel = ? AND type = ? AND ts >= ?",
+                    (tunnel, event_type, since),
+                ).fetchone()
+            else:
+                row = self.db.execute(
+                    "SELECT COALESCE(SUM(count), 0), COALESCE(SUM(value), 0) FROM event_counts "
+                    "WHERE tunnel = ? AND type = ? AND bucket >= ?",
+                    (tunnel, event_type, int(since // HOUR * HOUR)),
+                ).fetchone()
+        return {"count": row[0], "value": row[1]}
+
+    def summary(self, seconds: float, now: Optional[float] = None) -> Dict[str, Dict[str, int]]:
+        """Event counts per tunnel and type over the last `seconds`, from the hourly counts"""
+        now = now or time.time()
+        since = int((now - seconds) // HOUR * HOUR)
+        result: Dict[str, Dict[str, int]] = {}
+        with self.lock:
+            for tunnel, event_type, count in self.db.execute(
+                    "SELECT tunnel, type, SUM(count) FROM event_counts WHERE bucket >= ? GROUP BY tunnel, type",
+                    (since,)):
+                result.setdefault(tunnel, {})[event_type] = count
+        return result
+
+    def events(self, tunnel: str, event_type: Optional[str] = None, seconds: float = 86400, limit: int = 50,
+               now: Optional[float] = None) -> List[LogEvent]:
+        """Most recent events of a tunnel, newest last"""
+        now = now or time.time()
+        query = "SELECT tunnel, source, ts, type, value, peer, message FROM events WHERE tunnel = ? AND ts >= ?"
+        params: list = [tunnel, now - seconds]
+        if event_type:
+            query += " AND type = ?"
+            params.append(event_type)
+        query += " ORDER BY ts DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [LogEvent(*row) for row in reversed(rows)]
+
+    def last_peer(self, tunnel: str) -> Optional[str]:
+        """Address (without port) of the peer a tunnel last logged"""
+        with self.lock:
+            row = self.db.execute("SELECT peer FROM events WHERE tunnel = ? AND peer IS NOT NULL "
+                                  "ORDER BY ts DESC LIMIT 1", (tunnel,)).fetchone()
+        if row is None:
+            return None
+        return row[0].rsplit(":", 1)[0].strip("[]")
+
+
+def default_events_path(base_dir: str) -> str:
+    return os.path.join(base_dir, "events.db")
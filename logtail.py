@@ -0,0 +1,249 @@
+import ctypes
+import os
+import re
+import select
+import struct
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List, Optional
+
+
+# tinyvpn and udp2raw prefix every line with "[YYYY-MM-DD HH:MM:SS]"
+TIMESTAMP_PATTERN = re.compile(rb"^\[?(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})")
+RELATIVE_PATTERN = re.compile(r"^(\d+)([smhd])$")
+RELATIVE_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def parse_time(text: str, now: Optional[datetime] = None) -> datetime:
+    """Parse '2024-05-01 18:00:00', '2024-05-01', '18:00' (today) or a relative '10m', '2h', '1d'"""
+    now = now or datetime.now()
+    text = text.strip()
+    match = RELATIVE_PATTERN.match(text)
+    if match:
+        return now - timedelta(**{RELATIVE_UNITS[match.group(2)]: int(match.group(1))})
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            parsed = datetime.strptime(text, fmt)
+            return now.replace(hour=parsed.hour, minute=parsed.minute, second=parsed.second, microsecond=0)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized time {text!r}")
+
+
+def line_time(line: bytes) -> Optional[datetime]:
+    match = TIMESTAMP_PATTERN.match(line)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1).decode().replace("T", " "), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+class LineFilter:
+    """Regex and time window applied to log lines as they are read
+
+    Lines without a timestamp (continuations, stack traces) take the time of the
+    closest timestamped line before them.
+    """
+
+    def __init__(self, pattern: Optional[str] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, ignore_case: bool = False):
+        self.regex = re.compile(pattern.encode(), re.IGNORECASE if ignore_case else 0) if pattern else None
+        self.since = since
+        self.until = until
+
+    @property
+    def timed(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def in_window(self, timestamp: Optional[datetime]) -> bool:
+        if timestamp is None:
+            return not self.timed
+        if self.since is not None and timestamp < self.since:
+            return False
+        return self.until is None or timestamp <= self.until
+
+    def matches(self, line: bytes) -> bool:
+        return self.regex is None or self.regex.search(line) is not None
+
+
+def reverse_lines(f, block_size: int = 8192) -> Iterator[bytes]:
+    """Yield the lines of a binary file from last to first, reading fixed-size blocks backwards"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b""
+    first = True
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        block = f.read(size) + remainder
+        lines = block.split(b"\n")
+        # The first piece may continue in the previous block
+        remainder = lines.pop(0)
+        if first:
+            first = False
+            if lines and lines[-1] == b"":
+                lines.pop()
+        for line in reversed(lines):
+            yield line
+    if remainder or not first:
+        yield remainder
+
+
+def tail(path: str, count: int = 50, line_filter: Optional[LineFilter] = None, block_size: int = 8192) -> List[str]:
+    """Last `count` lines of a file passing the filter, oldest first
+
+    Memory stays proportional to `count` whatever the file size. With a `since`
+    bound the scan stops at the first line older than it, since logs are appended
+    in time order.
+    """
+    line_filter = line_filter or LineFilter()
+    found: List[bytes] = []
+    # Untimed lines seen so far whose time depends on the next timestamp further up
+    pending: deque = deque(maxlen=count)
+    with open(path, "rb") as f:
+        for line in reverse_lines(f, block_size):
+            if len(found) >= count:
+                break
+            timestamp = line_time(line) if line_filter.timed else None
+            if line_filter.timed and timestamp is None:
+                if line_filter.matches(line):
+                    pending.append(line)
+                continue
+            keep = line_filter.in_window(timestamp)
+            if keep:
+                found.extend(pending)
+            pending.clear()
+            if keep and line_filter.matches(line):
+                found.append(line)
+            if line_filter.since is not None and timestamp is not None and timestamp < line_filter.since:
+                break
+        else:
+            # Lines before the first timestamp of the file only pass without a time bound
+            if line_filter.in_window(None):
+                found.extend(pending)
+    return [line.decode("utf-8", errors="replace") for line in reversed(found[:count])]
+
+
+class Inotify:
+    """Minimal inotify binding via libc; raises OSError when unavailable"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def wait(self, timeout: float) -> bool:
+        """Block until events arrive (True) or the timeout passes (False), draining them"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def follow(path: str, line_filter: Optional[LineFilter] = None, from_end: bool = True,
+           stop: Optional[Callable[[], bool]] = None, poll: float = 1.0) -> Iterator[str]:
+    """Yield lines appended to a file as they are written, like `tail -F`
+
+    Sleeps on inotify events for the file and its directory, so an idle log costs
+    nothing; without inotify it polls every `poll` seconds. Follows the file across
+    rotation (a new inode at the same path) and truncation.
+    """
+    line_filter = line_filter or LineFilter()
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        notifier: Optional[Inotify] = Inotify()
+        notifier.add_watch(directory, IN_CREATE | IN_MOVED_TO)
+    except (OSError, AttributeError):
+        notifier = None
+
+    f = None
+    inode = None
+    partial = b""
+    current_time: Optional[datetime] = None
+    try:
+        while stop is None or not stop():
+            if f is None:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    f = None
+                if f is not None:
+                    inode = os.fstat(f.fileno()).st_ino
+                    if from_end:
+                        f.seek(0, os.SEEK_END)
+                    from_end = False
+                    partial = b""
+                    if notifier is not None:
+                        notifier.add_watch(path, IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF)
+
+            if f is not None:
+                data = f.read()
+                if data:
+                    lines = (partial + data).split(b"\n")
+                    partial = lines.pop()
+                    for line in lines:
+                        if line_filter.timed:
+                            current_time = line_time(line) or current_time
+                            if not line_filter.in_window(current_time):
+                                continue
+                        if line_filter.matches(line):
+                            yield line.decode("utf-8", errors="replace")
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = None
+                if stat is None or stat.st_ino != inode:
+                    # Rotated away: the rest of the old file was read above, continue with the new one
+                    f.close()
+                    f = None
+                    continue
+                if stat.st_size < f.tell():
+                    # Truncated in place
+                    f.seek(0)
+                    partial = b""
+                    continue
+
+            if notifier is not None:
+                notifier.wait(poll)
+            else:
+                time.sleep(poll)
+    finally:
+        if f is not None:
+            f.close()
+        if notifier is not None:
+            notifier.close()
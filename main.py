@@ -3,8 +3,8 @@ import os
 import platform
 import requests
 import json
+import re
 import socket
-import subprocess
 import sys
 from typing import Optional, List, Dict
 from datetime import datetime
@@ -14,20 +14,46 @@ from rich.progress import track, Progress, SpinnerColumn, TextColumn
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
-from rich.prompt import Prompt, IntPrompt
+from rich.prompt import Prompt, IntPrompt, Confirm
 from rich.box import ROUNDED
+from rich.live import Live
 from rich import print as rich_print
+from rich.markup import escape
 
 from tinyvpn import TinyVPN
 from udp2raw import UDP2Raw
 from frp import FRP
+from service_status import ServiceStatus
+from config_registry import ConfigRegistry
+from health_probe import HealthProber
+from netdev import NetDevSnapshot
+from dashboard import LiveDashboard
+from monitor import MonitorDaemon, MonitorClient
+from exporter import MetricsExporter
+from history import HistoryStore, default_history_path
+from fleet import FleetReconciler
+from supervisor import Supervisor, SupervisorClient
+from logtail import LineFilter, follow, parse_time, tail
+from log_events import EVENT_TYPES, LogEventIndex, default_events_path
+from fec_controller import AdaptiveFec, DEFAULT_LADDER
+from pmtu import udp2raw_payload
+from bench import BenchRunner, PRESETS, PROFILES, parse_setting
+from restart import IdleRestart, RestartOrchestrator
+from systemd_units import UnitInstaller
 
 
 class GamingTunnel:
     def __init__(self):
-        self.tinyvpn = TinyVPN()
-        self.udp2raw = UDP2Raw()
-        self.frp = FRP()
+        # One status collector shared by all modules so a screen costs one systemctl call
+        self.service_status = ServiceStatus()
+        # One configuration index shared by all modules so a listing costs one read
+        self.registry = ConfigRegistry(os.path.join(os.path.expanduser("~"), ".gamingtunnel"))
+        # One unit installer shared by all modules so an operation costs at most one daemon-reload
+        self.units = UnitInstaller(self.registry.base_dir)
+        self.tinyvpn = TinyVPN(service_status=self.service_status, registry=self.registry, units=self.units)
+        self.udp2raw = UDP2Raw(service_status=self.service_status, registry=self.registry, units=self.units)
+        self.frp = FRP(service_status=self.service_status, registry=self.registry, units=self.units)
+        self.health_prober = HealthProber()
         self.console = Console()
         
         # Use a more accessible base directory
@@ -38,6 +64,9 @@ class GamingTunnel:
         # Ensure directories exist
         os.makedirs(self.dest_dir, exist_ok=True)
         os.makedirs(self.config_dir, exist_ok=True)
+        self.monitor_client = MonitorClient(self.dest_dir)
+        # Without systemd, unit states come from `supervise` while it is running
+        self.service_status.supervisor = SupervisorClient(self.dest_dir)
         
         # Update paths
         self.tinyvpn_file = os.path.join(self.dest_dir, "tinyvpn")
@@ -97,6 +126,53 @@ class GamingTunnel:
             style = f"{color} bold"
         rich_print(f"[{style}]{text}[/{style}]")
 
+    def pending_migration(self) -> List[str]:
+        """Units migrate_units would replace or restart"""
+        pending = [self.tinyvpn.get_service_name(record.name, record.role)
+                   for record, _ in self.tinyvpn.instances_without_fifo()]
+        for backend, module in (("tinyvpn", self.tinyvpn), ("udp2raw", self.udp2raw), ("frp", self.frp)):
+            for record in self.registry.records(backend):
+                legacy = module.get_legacy_service_name(record.name, record.role)
+                if self.units.is_installed(legacy):
+                    pending.append(legacy)
+        return pending
+
+    def migrate_units(self, assume_yes: bool = False) -> bool:
+        """Move tunnels still using per-tunnel unit files onto the template units
+
+        Running tunnels are stopped and started again, so this asks first unless
+        `assume_yes`. Returns False if the migration was declined.
+        """
+        if not self.units.can_install:
+            return True
+        pending = self.pending_migration()
+        if not pending:
+            return True
+        if not assume_yes:
+            self.colorize("yellow", f"Services from an older version need migrating: {', '.join(pending)}", bold=True)
+            if not Confirm.ask("Migrate them now? Running tunnels restart briefly"):
+                self.colorize("yellow", "Skipped; run 'python main.py migrate' when the tunnels can restart")
+                return False
+        # Instances from before the control FIFO; running ones restart to open it
+        refreshed = self.tinyvpn.add_missing_fifo()
+        if refreshed:
+            states = self.service_status.get_many(refreshed)
+            failed = self.units.restart_units([unit for unit, state in states.items() if state.is_active])
+            self.colorize("green", f"Added the control FIFO to {len(refreshed)} tunnels", bold=True)
+            for unit in failed:
+                self.colorize("yellow", f"Failed to restart {unit} with its control FIFO", bold=True)
+        replacements = self.tinyvpn.prepare_migration() + self.udp2raw.prepare_migration() + self.frp.prepare_migration()
+        if not replacements:
+            return True
+        # Only instances of units that were running are started again
+        states = self.service_status.get_many([legacy for legacy, _ in replacements])
+        running = {unit for unit, state in states.items() if state.is_active}
+        failed = self.units.replace_units(replacements, running)
+        self.colorize("green", f"Migrated {len(replacements)} services to template units", bold=True)
+        for unit in failed:
+            self.colorize("yellow", f"Failed to start {unit} after migration", bold=True)
+        return True
+
     def save_server_info_to_file(self, info: Dict[str, str]):
         """Save server information to a local file"""
         try:
@@ -416,27 +492,15 @@ class GamingTunnel:
             input("\nPress Enter to return to main menu...")
             return
         
-        # Get TinyVPN configurations
-        try:
-            tinyvpn_configs = self.tinyvpn.get_available_configs()
-        except Exception as e:
-            self.colorize("red", f"Error reading TinyVPN configurations: {str(e)}", bold=True)
-            tinyvpn_configs = []
-        
-        # Get UDP2Raw configurations
+        # Read every configuration from the registry in one pass
         try:
-            udp2raw_configs = self.udp2raw.get_available_configs()
+            records = self.registry.records()
         except Exception as e:
-            self.colorize("red", f"Error reading UDP2RAW configurations: {str(e)}", bold=True)
-            udp2raw_configs = []
-
-        # Get FRP configurations
-        frp_configs = []
-        if self.frp_installed:
-            try:
-                frp_configs = self.frp.get_available_configs()
-            except Exception as e:
-                self.colorize("red", f"Error reading FRP configurations: {str(e)}", bold=True)
+            self.colorize("red", f"Error reading configurations: {str(e)}", bold=True)
+            records = []
+        tinyvpn_configs = [record.listing() for record in records if record.backend == "tinyvpn"]
+        udp2raw_configs = [record.listing() for record in records if record.backend == "udp2raw"]
+        frp_configs = [record.listing() for record in records if record.backend == "frp"] if self.frp_installed else []
         
         if not tinyvpn_configs and not udp2raw_configs and not frp_configs:
             self.colorize("yellow", "No configurations found", bold=True)
@@ -455,14 +519,31 @@ class GamingTunnel:
         while True:
             self.console.clear()
             
-            # Display configurations
-            table = Table(show_header=True)
-            table.add_column("Name", style="cyan")
-            table.add_column("Type", style="green")
-            table.add_column("Status", style="yellow")
-            table.add_column("Connection", style="magenta")
-            table.add_column("↓ Download", style="blue")
-            table.add_column("↑ Upload", style="red")
+            # Query the state of every unit in the table with a single systemctl call
+            service_states = self.service_status.get_many(
+                [self.tinyvpn.get_service_name(config['name'], config['type']) for config in tinyvpn_configs] +
+                [self.udp2raw.get_service_name(config['name'], config['type']) for config in udp2raw_configs] +
+                [self.frp.get_service_name(config['name'], config['type']) for config in frp_configs]
+            )
+            
+            # Read /proc/net/dev once for the whole refresh
+            try:
+                snapshot = NetDevSnapshot.read()
+            except Exception:
+                snapshot = NetDevSnapshot.empty()
+            
+            # Dump all links and addresses once via rtnetlink
+            try:
+                links = self.tinyvpn.netlink.dump()
+            except Exception:
+                links = None
+            
+            # Use the monitoring daemon's latest samples when it is running
+            monitor_data = self.monitor_client.latest()
+            monitored = monitor_data["tunnels"] if monitor_data else {}
+            
+            rows = []
+            probes = {}
             
             # Add TinyVPN configs to the table
             for config in tinyvpn_configs:
@@ -470,30 +551,23 @@ class GamingTunnel:
                 config_type = "TinyVPN Server" if config['type'] == 'server' else "TinyVPN Client"
                 
                 # Check if service is active
-                try:
-                    service_suffix = "server" if config['type'] == 'server' else "client"
-                    result = subprocess.run(
-                        ["systemctl", "is-active", f"tinyvpn-{config_name}-{service_suffix}.service"],
-                        capture_output=True,
-                        text=True
-                    )
-                    status = "[green]Active[/green]" if result.stdout.strip() == "active" else "[red]Inactive[/red]"
-                except:
-                    status = "[gray]Unknown[/gray]"
+                status = self.format_service_state(service_states[self.tinyvpn.get_service_name(config_name, config['type'])])
                 
-                # Check connection status
-                connection_status = "[green]Online[/green]" if self.tinyvpn.check_connection(config_name) else "[red]Offline[/red]"
-                
-                # Get network statistics
-                network_stats = self.tinyvpn.get_network_stats(config_name)
-                download = network_stats["download_human"]
-                upload = network_stats["upload_human"]
+                if config_name in monitored:
+                    # The daemon already probed this tunnel during its last sample
+                    network_stats = self.tinyvpn.get_network_stats(config_name, snapshot)
+                    sample = monitored[config_name]
+                    online = sample.get("rtt") is not None or network_stats["download"] > 0 or network_stats["upload"] > 0
+                    connection_status = "[green]Online[/green]" if online else "[red]Offline[/red]"
+                    if sample.get("rtt") is not None:
+                        connection_status += f" ({sample['rtt']:.0f} ms)"
+                    rows.append([config_name, config_type, status, connection_status,
+                                 network_stats["download_human"], network_stats["upload_human"]])
+                    continue
                 
-                # If there's traffic, mark as connected regardless of ping result
-                if network_stats["download"] > 0 or network_stats["upload"] > 0:
-                    connection_status = "[green]Online[/green]"
-                    
-                table.add_row(config_name, config_type, status, connection_status, download, upload)
+                # Connection status is filled in by the probing engine below
+                probes[len(rows)] = lambda timeout, name=config_name: self.tinyvpn.check_connection(name, timeout, snapshot, links)
+                rows.append([config_name, config_type, status, "[yellow]Checking...[/yellow]", "...", "..."])
             
             # Add UDP2Raw configs to the table
             for config in udp2raw_configs:
@@ -501,23 +575,10 @@ class GamingTunnel:
                 config_type = "UDP2Raw Server" if config['type'] == 'server' else "UDP2Raw Client"
                 
                 # Check if service is active
-                try:
-                    service_suffix = "server" if config['type'] == 'server' else "client"
-                    result = subprocess.run(
-                        ["systemctl", "is-active", f"udp2raw-{config_name}-{service_suffix}.service"],
-                        capture_output=True,
-                        text=True
-                    )
-                    status = "[green]Active[/green]" if result.stdout.strip() == "active" else "[red]Inactive[/red]"
-                except:
-                    status = "[gray]Unknown[/gray]"
+                status = self.format_service_state(service_states[self.udp2raw.get_service_name(config_name, config['type'])])
                 
                 # UDP2Raw doesn't have built-in connection checking or stats like TinyVPN
-                connection_status = "[gray]N/A[/gray]"
-                download = "N/A"
-                upload = "N/A"
-                
-                table.add_row(config_name, config_type, status, connection_status, download, upload)
+                rows.append([config_name, config_type, status, "[gray]N/A[/gray]", "N/A", "N/A"])
 
             # Add FRP configs to the table
             for config in frp_configs:
@@ -525,25 +586,31 @@ class GamingTunnel:
                 config_type = "FRP Server" if config['type'] == 'server' else "FRP Client"
                 
                 # Check if service is active
-                try:
-                    service_suffix = "s" if config['type'] == 'server' else "c"
-                    result = subprocess.run(
-                        ["systemctl", "is-active", f"frp{service_suffix}-{config_name}.service"],
-                        capture_output=True,
-                        text=True
-                    )
-                    status = "[green]Active[/green]" if result.stdout.strip() == "active" else "[red]Inactive[/red]"
-                except:
-                    status = "[gray]Unknown[/gray]"
+                status = self.format_service_state(service_states[self.frp.get_service_name(config_name, config['type'])])
                 
                 # FRP doesn't have built-in connection checking or stats
-                connection_status = "[gray]N/A[/gray]"
-                download = "N/A"
-                upload = "N/A"
-                
-                table.add_row(config_name, config_type, status, connection_status, download, upload)
+                rows.append([config_name, config_type, status, "[gray]N/A[/gray]", "N/A", "N/A"])
             
-            self.console.print(Panel(table, title="Available Configurations", border_style="cyan"))
+            # Probe all TinyVPN tunnels concurrently and update rows as results arrive
+            with Live(self.build_config_table(rows), console=self.console, refresh_per_second=10) as live:
+                for result in self.health_prober.probe_all(probes):
+                    row = rows[result.key]
+                    if result.timed_out:
+                        connection_status = "[red]Timeout[/red]"
+                    else:
+                        connection_status = "[green]Online[/green]" if result.online else "[red]Offline[/red]"
+                    
+                    # Get network statistics
+                    network_stats = self.tinyvpn.get_network_stats(row[0], snapshot)
+                    row[4] = network_stats["download_human"]
+                    row[5] = network_stats["upload_human"]
+                    
+                    # If there's traffic, mark as connected regardless of ping result
+                    if network_stats["download"] > 0 or network_stats["upload"] > 0:
+                        connection_status = "[green]Online[/green]"
+                    
+                    row[3] = connection_status
+                    live.update(self.build_config_table(rows))
             
             # Display actions menu
             action_menu = Table(show_header=True, box=None)
@@ -555,12 +622,13 @@ class GamingTunnel:
             action_menu.add_row("3", "Refresh connection status")
             action_menu.add_row("4", "View detailed network statistics")
             action_menu.add_row("5", "Run connection diagnostics")
+            action_menu.add_row("6", "Live dashboard (per-second rates)")
             action_menu.add_row("0", "Return to main menu")
             
             self.console.print(Panel(action_menu, title="Configuration Actions", border_style="cyan"))
             
             # Get user choice
-            choice = Prompt.ask("Select an action", choices=["0", "1", "2", "3", "4", "5"], default="0")
+            choice = Prompt.ask("Select an action", choices=["0", "1", "2", "3", "4", "5", "6"], default="0")
             
             if choice == "0":
                 return
@@ -720,7 +788,7 @@ class GamingTunnel:
                 if 1 <= config_idx <= len(tinyvpn_configs):
                     config_name = tinyvpn_configs[config_idx - 1]['name']
                     self.console.clear()
-                    self.tinyvpn.show_network_usage(config_name)
+                    self.tinyvpn.show_network_usage(config_name, snapshot, links)
                 else:
                     self.colorize("red", "Invalid selection", bold=True)
                 
@@ -746,13 +814,15 @@ class GamingTunnel:
                     
                     # Run detailed diagnostics
                     self.colorize("cyan", f"Running connection diagnostics for '{config_name}'...", bold=True)
-                    debug_info = self.tinyvpn.debug_connection_status(config_name)
+                    debug_info = self.tinyvpn.debug_connection_status(config_name, snapshot, links)
                     
                     # Display diagnostics in a readable format
                     print(f"\nConfiguration Type: {debug_info['config_type']}")
                     print(f"Interface exists: {'✅' if debug_info['interface_exists'] else '❌'}")
                     if debug_info['interface_exists']:
-                        print(f"Interface is UP: {'✅' if debug_info['interface_up'] else '❌'}")
+                        print(f"Interface is UP: {'✅' if debug_info['interface_up'] else '❌'} (state {debug_info['operstate']}, MTU {debug_info['mtu']})")
+                        if debug_info['addresses']:
+                            print(f"Addresses: {', '.join(debug_info['addresses'])}")
                         print(f"Has traffic: {'✅' if debug_info['has_traffic'] else '❌'}")
                         print(f"Received bytes: {debug_info['rx_bytes']}")
                         print(f"Transmitted bytes: {debug_info['tx_bytes']}")
@@ -774,7 +844,7 @@ class GamingTunnel:
                     print(f"1. Try direct ping: ping {debug_info['ip_to_ping']}")
                     print(f"2. Check interface: ip link show {config_name}")
                     print(f"3. Check routing: ip route | grep {config_name}")
-                    print(f"4. Check service: sudo systemctl status tinyvpn-{config_name}-{debug_info['config_type']}.service")
+                    print(f"4. Check service: sudo systemctl status {self.tinyvpn.get_service_name(config_name, debug_info['config_type'])}")
                     
                     # Connection status determination
                     if debug_info['interface_exists'] and debug_info['interface_up']:
@@ -791,6 +861,40 @@ class GamingTunnel:
                     self.colorize("red", "Invalid selection", bold=True)
                 
                 input("\nPress Enter to continue...")
+            
+            elif choice == "6":
+                # Live dashboard with instantaneous throughput
+                if not tinyvpn_configs:
+                    self.colorize("yellow", "No TinyVPN configurations available for the dashboard.", bold=True)
+                    input("\nPress Enter to continue...")
+                    continue
+                
+                self.console.clear()
+                config_names = list(dict.fromkeys(config['name'] for config in tinyvpn_configs))
+                LiveDashboard(self.tinyvpn, console=self.console).run(config_names)
+
+    def build_config_table(self, rows: List[List[str]]) -> Panel:
+        """Build the configuration overview table from pre-rendered rows"""
+        table = Table(show_header=True)
+        table.add_column("Name", style="cyan")
+        table.add_column("Type", style="green")
+        table.add_column("Status", style="yellow")
+        table.add_column("Connection", style="magenta")
+        table.add_column("↓ Download", style="blue")
+        table.add_column("↑ Upload", style="red")
+        
+        for row in rows:
+            table.add_row(*row)
+        
+        return Panel(table, title="Available Configurations", border_style="cyan")
+
+    def format_service_state(self, state) -> str:
+        """Render a unit state as a colored status cell"""
+        if not state.is_known:
+            return "[gray]Unknown[/gray]"
+        if state.is_active:
+            return "[green]Active[/green]" if not state.n_restarts else f"[green]Active[/green] ({state.n_restarts} restarts)"
+        return "[red]Inactive[/red]"
 
     def service_menu(self, show_status=False):
         """Show service management menu"""
@@ -861,81 +965,36 @@ class GamingTunnel:
         elif choice == "0":
             return
 
-    def restart_configs(self):
-        """Restart all configurations"""
+    def restart_configs(self, concurrency: int = 8, deadline: float = 30.0) -> bool:
+        """Restart all configurations in parallel and wait until each is ready"""
         if not self.cores_installed and not self.frp_installed:
             self.colorize("red", "Core components not installed. Please install them first.", bold=True)
-            return
-        
-        self.colorize("yellow", "Restarting all configurations...", bold=True)
-        
-        # Get TinyVPN configurations
-        tinyvpn_configs = self.tinyvpn.get_available_configs()
-        
-        # Get UDP2Raw configurations
-        udp2raw_configs = self.udp2raw.get_available_configs()
-
-        # Get FRP configurations
-        frp_configs = self.frp.get_available_configs()
+            return False
         
-        if not tinyvpn_configs and not udp2raw_configs and not frp_configs:
+        orchestrator = RestartOrchestrator(self.tinyvpn, self.udp2raw, self.frp, self.service_status,
+                                           concurrency=concurrency, deadline=deadline, console=self.console)
+        chains = orchestrator.collect()
+        if not chains:
             self.colorize("yellow", "No configurations found to restart", bold=True)
-            return
+            return True
         
-        # Restart each service
+        self.colorize("yellow", "Restarting all configurations...", bold=True)
+        started = time.monotonic()
         with Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
-            transient=False,
+            transient=True,
         ) as progress:
             restart_task = progress.add_task(description="Restarting services...", total=None)
-            
-            # Restart TinyVPN services
-            for config in tinyvpn_configs:
-                service_suffix = "server" if config['type'] == "server" else "client"
-                progress.update(restart_task, description=f"Restarting tinyvpn-{config['name']}-{service_suffix} service...")
-                try:
-                    subprocess.run(
-                        ["systemctl", "restart", f"tinyvpn-{config['name']}-{service_suffix}.service"],
-                        capture_output=True,
-                        text=True
-                    )
-                except:
-                    pass
-                time.sleep(0.5)
-            
-            # Restart UDP2Raw services
-            for config in udp2raw_configs:
-                service_suffix = "server" if config['type'] == "server" else "client"
-                progress.update(restart_task, description=f"Restarting udp2raw-{config['name']}-{service_suffix} service...")
-                try:
-                    subprocess.run(
-                        ["systemctl", "restart", f"udp2raw-{config['name']}-{service_suffix}.service"],
-                        capture_output=True,
-                        text=True
-                    )
-                except:
-                    pass
-                time.sleep(0.5)
-
-            # Restart FRP services
-            for config in frp_configs:
-                service_suffix = "s" if config['type'] == "server" else "c"
-                progress.update(restart_task, description=f"Restarting frp{service_suffix}-{config['name']} service...")
-                try:
-                    subprocess.run(
-                        ["systemctl", "restart", f"frp{service_suffix}-{config['name']}.service"],
-                        capture_output=True,
-                        text=True
-                    )
-                except:
-                    pass
-                time.sleep(0.5)
-            
-            progress.update(restart_task, description="All services restarted")
-            time.sleep(1)
+            results = orchestrator.restart(chains, progress, restart_task)
         
-        self.colorize("green", "All configurations restarted successfully", bold=True)
+        orchestrator.show_results(results)
+        ready = sum(1 for result in results if result.ready)
+        if ready == len(results):
+            self.colorize("green", f"All {len(results)} services ready in {time.monotonic() - started:.1f}s", bold=True)
+            return True
+        self.colorize("yellow", f"{ready} of {len(results)} services ready after restart", bold=True)
+        return False
 
     def network_stats(self):
         """Display network statistics for TinyVPN configurations"""
@@ -960,6 +1019,15 @@ class GamingTunnel:
             input("\nPress Enter to continue...")
             return
         
+        self.colorize("cyan", "1. Current usage of a configuration", bold=True)
+        self.colorize("cyan", "2. Traffic history", bold=True)
+        view = Prompt.ask("Select a view", choices=["1", "2"], default="1")
+        if view == "2":
+            self.console.clear()
+            self.show_traffic_history(tinyvpn_configs)
+            input("\nPress Enter to continue...")
+            return
+        
         # Display configurations
         self.colorize("cyan", "Available TinyVPN configurations:", bold=True)
         
@@ -982,6 +1050,59 @@ class GamingTunnel:
         
         input("\nPress Enter to continue...")
 
+    def show_traffic_history(self, tinyvpn_configs: List[dict]):
+        """Show top talkers and daily traffic from the persistent history store"""
+        store = HistoryStore(default_history_path(self.dest_dir))
+        try:
+            names = list(dict.fromkeys(config['name'] for config in tinyvpn_configs))
+            # Add the current counters so the history is up to date even without the monitor
+            try:
+                store.record_snapshot(NetDevSnapshot.read(), names)
+            except OSError:
+                pass
+            
+            windows = {"1": ("Last hour", 3600), "2": ("Last 24 hours", 86400),
+                       "3": ("Last 7 days", 7 * 86400), "4": ("Last 30 days", 30 * 86400)}
+            for key, (label, _) in windows.items():
+                print(f"{key}. {label}")
+            label, seconds = windows[Prompt.ask("Select a time window", choices=list(windows), default="3")]
+            
+            table = Table(title=f"Top Talkers - {label}", show_header=True, box=ROUNDED)
+            table.add_column("Name", style="cyan")
+            table.add_column("Download", justify="right")
+            table.add_column("Upload", justify="right")
+            table.add_column("Total", justify="right")
+            table.add_column("Packets", justify="right")
+            table.add_column("Drops", justify="right")
+            for row in store.top_talkers(seconds, limit=len(names) or 10):
+                table.add_row(
+                    row['name'],
+                    self.tinyvpn.format_bytes(row['rx_bytes']),
+                    self.tinyvpn.format_bytes(row['tx_bytes']),
+                    self.tinyvpn.format_bytes(row['rx_bytes'] + row['tx_bytes']),
+                    str(row['rx_packets'] + row['tx_packets']),
+                    str(row['drops']),
+                )
+            self.console.print(table)
+            
+            if not table.row_count:
+                self.colorize("yellow", "No traffic recorded yet. Run 'python main.py monitor' to record history continuously.", bold=True)
+                return
+            
+            # Daily breakdown of a single tunnel
+            name = Prompt.ask("Show daily traffic for (leave empty to skip)", choices=names + [""], default="")
+            if name:
+                daily = Table(title=f"Daily Traffic - {name}", show_header=True, box=ROUNDED)
+                daily.add_column("Day", style="cyan")
+                daily.add_column("Download", justify="right")
+                daily.add_column("Upload", justify="right")
+                for row in store.usage(name, 30 * 86400):
+                    day = time.strftime("%Y-%m-%d", time.gmtime(row['bucket']))
+                    daily.add_row(day, self.tinyvpn.format_bytes(row['rx_bytes']), self.tinyvpn.format_bytes(row['tx_bytes']))
+                self.console.print(daily)
+        finally:
+            store.close()
+
     def show_menu(self):
         """Show main menu"""
         self.console.clear()
@@ -1116,13 +1237,389 @@ class GamingTunnel:
     pass
     
     
-def main():
+cli = typer.Typer(help="Gaming Tunnel - low latency tunnels for online gaming")
+
+
+@cli.callback(invoke_without_command=True)
+def main(ctx: typer.Context):
+    """Launch the interactive menu when no command is given"""
+    if ctx.invoked_subcommand is not None:
+        return
     app = GamingTunnel()
+    app.migrate_units()
     # Only try to install if not already installed
     if not app.cores_installed:
         app.install_dependencies()
     app.show_menu()
 
 
+@cli.command()
+def monitor(
+    interval: float = typer.Option(10.0, help="Seconds between samples"),
+    capacity: int = typer.Option(8640, help="Samples kept per tunnel (8640 x 10s = 1 day)"),
+    adaptive_fec: bool = typer.Option(False, help="Adjust each TinyVPN tunnel's FEC to the measured loss"),
+    fec_ladder: str = typer.Option(",".join(DEFAULT_LADDER), help="FEC settings to choose from, least redundant first"),
+    fec_restart: bool = typer.Option(True, help="Restart tunnels without a control FIFO when idle to change FEC"),
+):
+    """Run the background monitoring daemon"""
+    app = GamingTunnel()
+    controller = None
+    if adaptive_fec:
+        try:
+            controller = AdaptiveFec(app.tinyvpn, app.service_status, fec_ladder.split(","), restart_idle=fec_restart)
+        except ValueError as e:
+            app.colorize("red", str(e), bold=True)
+            raise typer.Exit(1)
+    daemon = MonitorDaemon(app.tinyvpn, app.udp2raw, app.frp, app.service_status,
+                           interval=interval, capacity=capacity)
+    # Persist traffic deltas so history survives restarts of the tunnels and the daemon
+    store = HistoryStore(default_history_path(app.dest_dir))
+    daemon.listeners.append(store.record_monitor)
+    # Index reconnects, handshakes and errors from the tunnel logs as they are written
+    events = LogEventIndex(default_events_path(app.dest_dir))
+    daemon.listeners.append(events.record_monitor)
+    if controller is not None:
+        controller.start()
+        daemon.listeners.append(controller.record_monitor)
+    try:
+        daemon.run()
+    finally:
+        if controller is not None:
+            controller.stop()
+        store.close()
+        events.close()
+
+
+@cli.command()
+def export(
+    port: int = typer.Option(9469, help="Port to serve /metrics on"),
+    address: str = typer.Option("0.0.0.0", help="Address to listen on"),
+    interval: float = typer.Option(15.0, help="Seconds between metric collections"),
+    proc_root: str = typer.Option("/proc", help="procfs mount to read counters and process stats from"),
+    systemctl: str = typer.Option("systemctl", help="systemctl binary used to query unit state"),
+):
+    """Serve tunnel metrics for Prometheus"""
+    app = GamingTunnel()
+    app.service_status.systemctl = systemctl
+    MetricsExporter(app.tinyvpn, app.udp2raw, app.frp, app.service_status,
+                    interval=interval, proc_root=proc_root).run(address, port)
+
+
+@cli.command()
+def apply(
+    fleet_file: str = typer.Argument(..., help="TOML file describing the desired tunnels"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only show the plan"),
+    prune: bool = typer.Option(False, help="Remove tunnels that are not in the file"),
+    jobs: int = typer.Option(8, help="Tunnels configured in parallel"),
+    yes: bool = typer.Option(False, "--yes", "-y", help="Migrate services from older versions without asking"),
+):
+    """Create, update or remove tunnels to match a fleet file"""
+    app = GamingTunnel()
+    reconciler = FleetReconciler(app.tinyvpn, app.udp2raw, app.frp, app.service_status, jobs=jobs, console=app.console)
+    try:
+        desired = reconciler.load(fleet_file)
+    except (OSError, ValueError) as e:
+        app.colorize("red", f"Invalid fleet file: {str(e)}", bold=True)
+        raise typer.Exit(1)
+    # Tunnels still on per-tunnel units would clash with the instances apply starts
+    if not dry_run and not app.migrate_units(assume_yes=yes):
+        raise typer.Exit(1)
+    plan = reconciler.plan(desired, prune=prune)
+    reconciler.show_plan(plan)
+    if dry_run:
+        return
+    if not reconciler.apply(plan):
+        raise typer.Exit(1)
+
+
+@cli.command()
+def migrate(
+    yes: bool = typer.Option(False, "--yes", "-y", help="Do not ask before restarting running tunnels"),
+):
+    """Move services created by older versions onto the template units"""
+    app = GamingTunnel()
+    if not app.units.can_install:
+        app.colorize("red", "Migrating services requires root", bold=True)
+        raise typer.Exit(1)
+    if not app.pending_migration():
+        app.colorize("green", "Nothing to migrate", bold=True)
+        return
+    if not app.migrate_units(assume_yes=yes):
+        raise typer.Exit(1)
+
+
+@cli.command()
+def restart(
+    jobs: int = typer.Option(8, help="Tunnels restarted in parallel"),
+    deadline: float = typer.Option(30.0, help="Seconds each service gets to become ready"),
+):
+    """Restart all tunnels and wait until they are ready"""
+    app = GamingTunnel()
+    if not app.restart_configs(concurrency=jobs, deadline=deadline):
+        raise typer.Exit(1)
+
+
+@cli.command()
+def supervise(
+    max_backoff: float = typer.Option(60.0, help="Longest delay in seconds between restarts of a failing tunnel"),
+    log_size: int = typer.Option(10, help="Megabytes per log file before it is rotated"),
+    log_backups: int = typer.Option(3, help="Rotated log files kept per tunnel"),
+):
+    """Run all tunnels as child processes, for hosts without systemd"""
+    app = GamingTunnel()
+    Supervisor(app.tinyvpn, app.udp2raw, app.frp, max_backoff=max_backoff,
+               log_max_bytes=log_size * 1024 * 1024, log_backups=log_backups).run()
+
+
+@cli.command()
+def logs(
+    name: str = typer.Argument(..., help="Configuration name"),
+    backend: str = typer.Option("tinyvpn", help="tinyvpn, udp2raw or frp"),
+    role: Optional[str] = typer.Option(None, help="server or client (default: the one configured)"),
+    lines: int = typer.Option(50, "--lines", "-n", help="Number of lines to show"),
+    follow_log: bool = typer.Option(False, "--follow", "-f", help="Keep printing new lines"),
+    since: Optional[str] = typer.Option(None, help="Only lines from this time on, e.g. '2h' or '2024-05-01 18:00'"),
+    until: Optional[str] = typer.Option(None, help="Only lines up to this time"),
+    grep: Optional[str] = typer.Option(None, help="Only lines matching this regular expression"),
+    ignore_case: bool = typer.Option(False, "--ignore-case", "-i", help="Match --grep case-insensitively"),
+):
+    """Show the last lines of a tunnel's log, optionally filtered and followed"""
+    app = GamingTunnel()
+    modules = {"tinyvpn": app.tinyvpn, "udp2raw": app.udp2raw, "frp": app.frp}
+    if backend not in modules:
+        app.colorize("red", "Backend must be tinyvpn, udp2raw or frp", bold=True)
+        raise typer.Exit(1)
+    module = modules[backend]
+    if role is None:
+        record = app.registry.get(backend, name)
+        if record is None:
+            app.colorize("red", f"No {backend} configuration named '{name}'", bold=True)
+            raise typer.Exit(1)
+        role = record.role
+    try:
+        line_filter = LineFilter(grep, parse_time(since) if since else None, parse_time(until) if until else None,
+                                 ignore_case)
+    except (ValueError, re.error) as e:
+        app.colorize("red", str(e), bold=True)
+        raise typer.Exit(1)
+
+    if backend == "frp":
+        # FRP logs to the journal
+        unit = module.get_service_name(name, role)
+
+        def wanted(entry) -> bool:
+            timestamp = datetime.fromtimestamp(entry.timestamp)
+            return line_filter.in_window(timestamp) and line_filter.matches(entry.message.encode())
+
+        history = [entry for entry in app.frp.journal.recent([unit], app.frp.journal.history) if wanted(entry)]
+        for entry in history[-lines:]:
+            print(entry.format())
+        try:
+            while follow_log:
+                time.sleep(1)
+                for entry in app.frp.journal.follow_new([unit]):
+                    if wanted(entry):
+                        print(entry.format(), flush=True)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    log_file = module.get_log_file(name, role)
+    if os.path.exists(log_file):
+        for line in tail(log_file, lines, line_filter):
+            print(line)
+    elif not follow_log:
+        app.colorize("yellow", f"Log file {log_file} not found.", bold=True)
+        raise typer.Exit(1)
+    if follow_log:
+        try:
+            for line in follow(log_file, line_filter):
+                print(line, flush=True)
+        except KeyboardInterrupt:
+            pass
+
+
+@cli.command()
+def events(
+    name: Optional[str] = typer.Argument(None, help="Configuration name (default: a summary of all tunnels)"),
+    event_type: Optional[str] = typer.Option(None, "--type", help=f"Only this event type: {', '.join(EVENT_TYPES)}"),
+    since: str = typer.Option("24h", help="Time window, e.g. '1h', '7d' or '2024-05-01 18:00'"),
+    limit: int = typer.Option(20, help="Recent events listed"),
+):
+    """Count and list events (reconnects, handshakes, FEC recoveries, errors) from the tunnel logs"""
+    app = GamingTunnel()
+    if event_type is not None and event_type not in EVENT_TYPES:
+        app.colorize("red", f"Event type must be one of: {', '.join(EVENT_TYPES)}", bold=True)
+        raise typer.Exit(1)
+    try:
+        seconds = max(0.0, (datetime.now() - parse_time(since)).total_seconds())
+    except ValueError as e:
+        app.colorize("red", str(e), bold=True)
+        raise typer.Exit(1)
+
+    index = LogEventIndex(default_events_path(app.dest_dir))
+    try:
+        # Catch up with whatever was logged since the monitor (or the last run) indexed
+        index.index_tunnels(app.tinyvpn, app.udp2raw)
+        if name is None:
+            summary = index.summary(seconds)
+            table = Table(title=f"Log events since {since}", box=ROUNDED)
+            table.add_column("Tunnel", style="cyan")
+            for column in EVENT_TYPES:
+                table.add_column(column, justify="right")
+            for tunnel in sorted(summary):
+                table.add_row(tunnel, *(str(summary[tunnel].get(column, 0)) for column in EVENT_TYPES))
+            app.console.print(table)
+            return
+
+        types = [event_type] if event_type else EVENT_TYPES
+        table = Table(title=f"{name}: events since {since}", box=ROUNDED)
+        table.add_column("Event", style="cyan")
+        table.add_column("Count", justify="right")
+        table.add_column("Total value", justify="right")
+        for column in types:
+            counts = index.count(name, column, seconds)
+            table.add_row(column, str(counts["count"]), str(counts["value"]) if counts["value"] else "-")
+        app.console.print(table)
+        for event in index.events(name, event_type, seconds, limit):
+            stamp = datetime.fromtimestamp(event.ts).strftime("%Y-%m-%d %H:%M:%S")
+            peer = f" {event.peer}" if event.peer else ""
+            app.console.print(f"[dim]{stamp}[/dim] [cyan]{event.type}[/cyan] {event.source}{peer}: {escape(event.message)}",
+                              markup=True, highlight=False)
+    finally:
+        index.close()
+
+
+@cli.command()
+def mtu(
+    name: str = typer.Argument(..., help="TinyVPN configuration name"),
+    peer: Optional[str] = typer.Option(None, help="Address to probe (default: the server, or a server's last client)"),
+    refresh: bool = typer.Option(False, help="Probe again instead of using the cached path MTU"),
+    apply_mtu: bool = typer.Option(False, "--apply", help="Switch the tunnel to the suggested MTU"),
+    max_wait: int = typer.Option(300, help="Seconds to wait for an idle moment when a restart is needed"),
+):
+    """Measure the path MTU to a tunnel's peer and suggest (or apply) the largest safe --mtu"""
+    app = GamingTunnel()
+    record = app.registry.get("tinyvpn", name)
+    if record is None:
+        app.colorize("red", f"No TinyVPN configuration named '{name}'", bold=True)
+        raise typer.Exit(1)
+    config = app.tinyvpn.load_config(name)
+    if peer is None:
+        if record.role == "client":
+            peer = config.get('SERVER_ADDR')
+        else:
+            index = LogEventIndex(default_events_path(app.dest_dir))
+            try:
+                index.index_tunnels(app.tinyvpn, app.udp2raw)
+                peer = index.last_peer(name)
+            finally:
+                index.close()
+            if peer is None:
+                app.colorize("yellow", "No client seen in the logs yet; pass --peer", bold=True)
+                raise typer.Exit(1)
+
+    current = int(re.sub(r"\D", "", config.get('MTU', '')) or 1450)
+    suggested, note = app.tinyvpn.suggest_mtu(peer, config.get('FEC') != "--disable-fec", refresh=refresh)
+    app.colorize("cyan", f"{name} ({record.role}): {note}", bold=True)
+    print(f"Largest safe TinyVPN MTU: {suggested} (configured: {current})")
+    # UDP2Raw runs inside the tunnel, so its framing comes out of the game's share
+    wrapper = app.registry.get("udp2raw", name)
+    if wrapper is not None:
+        raw_mode = app.udp2raw.load_config(name).get('RAW_MODE', 'faketcp')
+        print(f"Largest game packet through UDP2Raw ({raw_mode}): {udp2raw_payload(suggested, raw_mode)} bytes")
+    if not apply_mtu or suggested == current:
+        return
+
+    error = app.tinyvpn.control.send(name, record.role, [f"mtu {suggested}"])
+    if error is None:
+        app.tinyvpn.save_settings(name, record.role, mtu=suggested)
+        app.colorize("green", f"MTU changed to {suggested} without a restart", bold=True)
+        return
+    app.colorize("yellow", f"Could not change the MTU live ({error}); restarting", bold=True)
+    app.tinyvpn.save_settings(name, record.role, mtu=suggested)
+    report = IdleRestart(app.tinyvpn, app.service_status, max_wait=max_wait).restart(name, record.role)
+    if report.result.error:
+        app.colorize("red", f"Restart failed: {report.result.error}", bold=True)
+        raise typer.Exit(1)
+    print(report.describe())
+
+
+@cli.command()
+def bench(
+    profile: List[str] = typer.Option(list(PROFILES), "--profile", "-p",
+                                      help=f"Link profile to emulate, repeatable: {', '.join(PROFILES)}"),
+    setting: List[str] = typer.Option(list(PRESETS), "--setting", "-s",
+                                      help=f"TinyVPN settings to compare, repeatable: a preset ({', '.join(PRESETS)}) "
+                                           "and/or 'fec=10:6,mode=1,timeout=0,mtu=1400' (fec=0 disables FEC)"),
+    udp2raw: bool = typer.Option(False, help="Carry the game traffic through UDP2Raw inside the tunnel"),
+    raw_mode: str = typer.Option("faketcp", help="UDP2Raw raw mode: faketcp, udp or icmp"),
+    duration: float = typer.Option(15.0, help="Seconds of game traffic per profile and setting"),
+    rate: float = typer.Option(64.0, help="Game packets per second in each direction"),
+    size: int = typer.Option(120, help="Game packet payload in bytes"),
+    stub: bool = typer.Option(False, help="Use the stand-in cores even when the real ones are installed"),
+):
+    """Compare FEC, mode and MTU settings on an emulated lossy link in network namespaces"""
+    app = GamingTunnel()
+    unknown = [name for name in profile if name not in PROFILES]
+    if unknown:
+        app.colorize("red", f"Unknown profile {', '.join(unknown)}; use {', '.join(PROFILES)}", bold=True)
+        raise typer.Exit(1)
+    try:
+        settings = [parse_setting(spec) for spec in setting]
+    except ValueError as e:
+        app.colorize("red", str(e), bold=True)
+        raise typer.Exit(1)
+    if os.geteuid() != 0:
+        app.colorize("red", "The benchmark creates network namespaces and must run as root", bold=True)
+        raise typer.Exit(1)
+
+    runner = BenchRunner(app.tinyvpn, app.udp2raw if udp2raw else None, raw_mode=raw_mode, stub=stub, rate=rate,
+                         size=size, duration=duration)
+    for module in (app.tinyvpn, app.udp2raw if udp2raw else None):
+        if module is not None and runner.uses_stub(module):
+            app.colorize("yellow", f"Using the stand-in for {os.path.basename(module.binary_path)}; "
+                                   "results check the harness, not the real core", bold=False)
+    app.colorize("cyan", f"Logs in {runner.work_dir}", bold=False)
+
+    title = f"{rate:g} packets/s of {size} bytes for {duration:g}s"
+    if udp2raw:
+        title += f" through UDP2Raw ({raw_mode})"
+    for item in settings:
+        print(f"{item.name}: {item.describe()}")
+    table = Table(title=title, box=ROUNDED)
+    table.add_column("Profile", style="cyan")
+    table.add_column("Setting", style="cyan")
+    for column in ("p50 ms", "p99 ms", "Jitter", "Delivered", "Burst", "Overhead"):
+        table.add_column(column, justify="right")
+    results = []
+    try:
+        for result in runner.run(profile, settings):
+            results.append(result)
+            report = result.report
+            if result.error or not report["received"]:
+                error = result.error or "nothing delivered"
+                app.colorize("red", f"{result.profile} / {result.setting.name}: {error}", bold=False)
+                table.add_row(result.profile, result.setting.name, "-", "-", "-", "0%" if report else "-",
+                              str(report["max_loss_burst"]) if report else "-", "-")
+                continue
+            print(f"{result.profile} / {result.setting.name}: p99 {report['p99']:.1f} ms, "
+                  f"delivered {result.delivery * 100:.1f}%")
+            # p90, reordering and duplicates are in the saved results
+            table.add_row(result.profile, result.setting.name, f"{report['p50']:.1f}", f"{report['p99']:.1f}",
+                          f"{report['jitter']:.1f}" if report["jitter"] is not None else "-",
+                          f"{result.delivery * 100:.1f}%", str(report["max_loss_burst"]),
+                          f"{result.overhead * 100:.0f}%" if result.overhead is not None else "-")
+    except RuntimeError as e:
+        # Usually a missing tc, or a kernel without the sch_netem module
+        app.colorize("red", f"Could not set up the emulated link: {str(e)}", bold=True)
+        raise typer.Exit(1)
+    finally:
+        if results:
+            path = runner.save(results)
+            app.console.print(table)
+            app.colorize("cyan", f"Results saved to {path}", bold=False)
+
+
 if __name__ == "__main__":
-    typer.run(main)
\ No newline at end of file
+    cli()
\ No newline at end of file
@@ -0,0 +1,358 @@
+import json
+import math
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from array import array
+from typing import Dict, Optional
+
+from rich import print as rich_print
+
+from netdev import NetDevSnapshot
+from latency import LatencyTracker
+from journal import JournalReader, JOURNAL_ERR
+
+
+class RingBuffer:
+    """Fixed-capacity array-backed ring buffer of numbers"""
+    __slots__ = ("data", "capacity", "head", "size")
+
+    def __init__(self, typecode: str, capacity: int):
+        self.data = array(typecode, [0]) * capacity
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+
+    def append(self, value):
+        self.data[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def values(self, last: Optional[int] = None) -> list:
+        """Return the newest `last` values (all by default) in chronological order"""
+        count = self.size if last is None else min(last, self.size)
+        start = (self.head - count) % self.capacity
+        if start + count <= self.capacity:
+            return self.data[start:start + count].tolist()
+        return self.data[start:].tolist() + self.data[:(start + count) % self.capacity].tolist()
+
+    def latest(self):
+        return self.data[(self.head - 1) % self.capacity] if self.size else None
+
+
+class TunnelSeries:
+    """Per-interval samples of one TinyVPN tun interface
+
+    Counters are stored as per-interval deltas in 32-bit slots, RTT as float32
+    milliseconds (NaN when no reply) and loss as a percentage byte, roughly 33
+    bytes per sample.
+    """
+    __slots__ = ("name", "time", "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+                 "drops", "rtt", "loss", "last_counters", "total_rx", "total_tx")
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.time = RingBuffer("d", capacity)
+        self.rx_bytes = RingBuffer("I", capacity)
+        self.tx_bytes = RingBuffer("I", capacity)
+        self.rx_packets = RingBuffer("I", capacity)
+        self.tx_packets = RingBuffer("I", capacity)
+        self.drops = RingBuffer("I", capacity)
+        self.rtt = RingBuffer("f", capacity)
+        self.loss = RingBuffer("B", capacity)
+        self.last_counters = None
+        self.total_rx = 0
+        self.total_tx = 0
+
+    def add(self, timestamp: float, counters, rtt: Optional[float], loss: Optional[float]):
+        def delta(field):
+            current = getattr(counters, field) if counters is not None else 0
+            if self.last_counters is None:
+                return 0
+            before = getattr(self.last_counters, field)
+            # Counters restart from zero when the tunnel is recreated
+            return min(current - before if current >= before else current, 0xffffffff)
+
+        self.time.append(timestamp)
+        self.rx_bytes.append(delta("rx_bytes"))
+        self.tx_bytes.append(delta("tx_bytes"))
+        self.rx_packets.append(delta("rx_packets"))
+        self.tx_packets.append(delta("tx_packets"))
+        self.drops.append(delta("rx_drop") + delta("tx_drop") if counters is not None else 0)
+        self.rtt.append(rtt if rtt is not None else math.nan)
+        self.loss.append(round(loss * 100) if loss is not None else 0)
+        if counters is not None:
+            self.last_counters = counters
+            self.total_rx = counters.rx_bytes
+            self.total_tx = counters.tx_bytes
+
+    def series(self, last: Optional[int] = None) -> Dict[str, list]:
+        return {
+            "time": self.time.values(last),
+            "rx_bytes": self.rx_bytes.values(last),
+            "tx_bytes": self.tx_bytes.values(last),
+            "rx_packets": self.rx_packets.values(last),
+            "tx_packets": self.tx_packets.values(last),
+            "drops": self.drops.values(last),
+            "rtt": [None if math.isnan(v) else round(v, 3) for v in self.rtt.values(last)],
+            "loss": [v / 100 for v in self.loss.values(last)],
+        }
+
+    def summary(self, seconds: float, interval: float) -> Dict[str, Optional[float]]:
+        """Averages over the newest `seconds` worth of samples"""
+        data = self.series(max(1, int(seconds / interval)))
+        count = len(data["time"])
+        if count == 0:
+            return {"samples": 0}
+        span = max(interval, data["time"][-1] - data["time"][0] + interval)
+        rtts = [v for v in data["rtt"] if v is not None]
+        latest_rtt = data["rtt"][-1]
+        return {
+            "samples": count,
+            "rx_bps": sum(data["rx_bytes"]) * 8 / span,
+            "tx_bps": sum(data["tx_bytes"]) * 8 / span,
+            "rx_pps": sum(data["rx_packets"]) / span,
+            "tx_pps": sum(data["tx_packets"]) / span,
+            "drops_ps": sum(data["drops"]) / span,
+            "rtt": latest_rtt,
+            "avg_rtt": sum(rtts) / len(rtts) if rtts else None,
+            "loss": sum(data["loss"]) / count,
+            "rx_total": self.total_rx,
+            "tx_total": self.total_tx,
+            "time": data["time"][-1],
+        }
+
+
+class UnitSeries:
+    """Per-interval samples of one UDP2Raw/FRP/TinyVPN systemd unit"""
+    __slots__ = ("name", "time", "active", "restarts", "errors")
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.time = RingBuffer("d", capacity)
+        self.active = RingBuffer("B", capacity)
+        self.restarts = RingBuffer("I", capacity)
+        # Journal entries of priority err or worse since the daemon started (cumulative)
+        self.errors = RingBuffer("I", capacity)
+
+    def add(self, timestamp: float, state, new_errors: int = 0):
+        self.time.append(timestamp)
+        self.active.append(1 if state.is_active else 0)
+        self.restarts.append(state.n_restarts)
+        self.errors.append((self.errors.latest() or 0) + new_errors)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {"active": bool(self.active.latest()), "restarts": self.restarts.latest(),
+                "errors": self.errors.latest(), "time": self.time.latest()}
+
+
+class MonitorDaemon:
+    """Sample all tunnels on an interval and keep the results in bounded ring buffers
+
+    Memory is fixed by `capacity`: with the defaults (10 s interval, 1 day) a tunnel
+    costs about 285 KB, so 200 tunnels stay under 60 MB.
+    """
+
+    def __init__(self, tinyvpn, udp2raw, frp, service_status, interval: float = 10.0,
+                 capacity: int = 8640, socket_path: Optional[str] = None):
+        self.tinyvpn = tinyvpn
+        self.udp2raw = udp2raw
+        self.frp = frp
+        self.service_status = service_status
+        self.interval = interval
+        self.capacity = capacity
+        self.socket_path = socket_path or default_socket_path(tinyvpn.base_dir)
+        self.tunnels: Dict[str, TunnelSeries] = {}
+        self.units: Dict[str, UnitSeries] = {}
+        self.latency: Dict[str, LatencyTracker] = {}
+        # Reads only the journal entries written since the previous sample
+        self.journal = JournalReader(history=100)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # Hooks run after every sample with (daemon, timestamp); used by exporters and stores
+        self.listeners = []
+
+    def discover(self):
+        """Return (tunnel interface names, systemd unit names) of every configuration"""
+        tunnels = []
+        units = []
+        for config in self.tinyvpn.get_available_configs():
+            if config['name'] not in tunnels:
+                tunnels.append(config['name'])
+            units.append(self.tinyvpn.get_service_name(config['name'], config['type']))
+        for config in self.udp2raw.get_available_configs():
+            units.append(self.udp2raw.get_service_name(config['name'], config['type']))
+        for config in self.frp.get_available_configs():
+            units.append(self.frp.get_service_name(config['name'], config['type']))
+        return tunnels, units
+
+    def sample(self):
+        """Take one sample of every tunnel and unit"""
+        tunnels, units = self.discover()
+        timestamp = time.time()
+
+        try:
+            snapshot = NetDevSnapshot.read()
+        except Exception:
+            snapshot = NetDevSnapshot.empty()
+        try:
+            # Keep the probe well inside the sampling interval
+            probes = self.tinyvpn.probe_tunnels(tunnels, count=3, timeout=min(2.0, self.interval / 2))
+        except Exception:
+            probes = {}
+        states = self.service_status.get_many(units) if units else {}
+        journal = self.journal.fetch(units) if units else {}
+
+        with self.lock:
+            for name in tunnels:
+                series = self.tunnels.get(name)
+                if series is None:
+                    series = self.tunnels[name] = TunnelSeries(name, self.capacity)
+                stats = probes.get(name)
+                series.add(
+                    timestamp,
+                    snapshot.get(name),
+                    stats.avg_rtt if stats is not None else None,
+                    stats.loss if stats is not None else None,
+                )
+                if stats is not None:
+                    tracker = self.latency.get(name)
+                    if tracker is None:
+                        tracker = self.latency[name] = LatencyTracker()
+                    tracker.record(stats.outcomes, timestamp)
+            for unit in units:
+                series = self.units.get(unit)
+                errors = sum(1 for entry in journal.get(unit, ()) if entry.priority <= JOURNAL_ERR)
+                if series is None:
+                    series = self.units[unit] = UnitSeries(unit, self.capacity)
+                    # The first read returns history from before the daemon started
+                    errors = 0
+                series.add(timestamp, states[unit], errors)
+
+            # Forget configurations that were deleted
+            for name in set(self.tunnels) - set(tunnels):
+                del self.tunnels[name]
+                self.latency.pop(name, None)
+            for unit in set(self.units) - set(units):
+                del self.units[unit]
+
+        for listener in self.listeners:
+            try:
+                listener(self, timestamp)
+            except Exception as e:
+                rich_print(f"[red]Monitor listener failed: {str(e)}[/red]")
+
+    def handle_request(self, request: dict) -> dict:
+        """Answer a query from a MonitorClient"""
+        command = request.get("cmd")
+        with self.lock:
+            if command == "latest":
+                seconds = request.get("seconds", self.interval)
+                return {
+                    "interval": self.interval,
+                    "tunnels": {name: series.summary(seconds, self.interval) for name, series in self.tunnels.items()},
+                    "units": {name: series.summary() for name, series in self.units.items()},
+                }
+            if command == "series":
+                series = self.tunnels.get(request.get("name"))
+                if series is None:
+                    return {"error": "unknown tunnel"}
+                seconds = request.get("seconds")
+                return series.series(int(seconds / self.interval) if seconds else None)
+            if command == "latency":
+                seconds = request.get("seconds") or 300
+                now = time.time()
+                return {"tunnels": {name: tracker.window(seconds, now) for name, tracker in self.latency.items()}}
+            if command == "ping":
+                return {"ok": True, "interval": self.interval}
+        return {"error": f"unknown command {command!r}"}
+
+    def serve(self):
+        """Serve queries on a unix socket in a background thread"""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline() or b"{}")
+                    response = daemon.handle_request(request)
+                except Exception as e:
+                    response = {"error": str(e)}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def run(self):
+        """Sample forever until interrupted"""
+        server = self.serve()
+        # systemd and container runtimes stop services with SIGTERM
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_event.set())
+        rich_print(f"[cyan bold]Monitoring every {self.interval:g}s, listening on {self.socket_path}[/cyan bold]")
+        try:
+            while not self.stop_event.is_set():
+                started = time.monotonic()
+                self.sample()
+                self.stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def default_socket_path(base_dir: str) -> str:
+    return os.path.join(base_dir, "monitor.sock")
+
+
+class MonitorClient:
+    """Query a running MonitorDaemon over its unix socket"""
+
+    def __init__(self, base_dir: str, timeout: float = 1.0, socket_path: Optional[str] = None):
+        self.socket_path = socket_path or default_socket_path(base_dir)
+        self.timeout = timeout
+
+    def request(self, request: dict) -> Optional[dict]:
+        """Send one query; returns None when the daemon is not running"""
+        if not os.path.exists(self.socket_path):
+            return None
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(request).encode() + b"\n")
+                data = b""
+                while not data.endswith(b"\n"):
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+            return json.loads(data)
+        except (OSError, ValueError):
+            return None
+
+    def is_running(self) -> bool:
+        return self.request({"cmd": "ping"}) is not None
+
+    def latest(self, seconds: Optional[float] = None) -> Optional[dict]:
+        request = {"cmd": "latest"}
+        if seconds:
+            request["seconds"] = seconds
+        return self.request(request)
+
+    def latency(self, seconds: Optional[float] = None) -> Optional[dict]:
+        """Latency percentiles, jitter and loss bursts of every tunnel"""
+        return self.request({"cmd": "latency", "seconds": seconds})
+
+    def series(self, name: str, seconds: Optional[float] = None) -> Optional[dict]:
+        return self.request({"cmd": "series", "name": name, "seconds": seconds})
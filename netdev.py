@@ -0,0 +1,112 @@
+import os
+import time
+from typing import Dict, Optional
+
+
+# Column order of /proc/net/dev: 8 receive counters followed by 8 transmit counters
+COUNTER_FIELDS = (
+    "rx_bytes", "rx_packets", "rx_errs", "rx_drop", "rx_fifo", "rx_frame", "rx_compressed", "rx_multicast",
+    "tx_bytes", "tx_packets", "tx_errs", "tx_drop", "tx_fifo", "tx_colls", "tx_carrier", "tx_compressed",
+)
+
+
+class InterfaceCounters:
+    """All 16 kernel counters of one network interface"""
+    __slots__ = ("name",) + COUNTER_FIELDS
+
+    def __init__(self, name: str, values):
+        self.name = name
+        for field, value in zip(COUNTER_FIELDS, values):
+            setattr(self, field, value)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {field: getattr(self, field) for field in COUNTER_FIELDS}
+
+
+class NetDevSnapshot:
+    """A single read of /proc/net/dev parsed into exact-name interface entries
+
+    Take one snapshot per refresh and hand it to every consumer, so drawing a table
+    of N tunnels costs one file read instead of N scans.
+    """
+
+    def __init__(self, interfaces: Dict[str, InterfaceCounters], taken_at: float):
+        self.interfaces = interfaces
+        self.taken_at = taken_at
+
+    @classmethod
+    def read(cls, proc_root: str = "/proc") -> "NetDevSnapshot":
+        """Read and parse <proc_root>/net/dev"""
+        taken_at = time.monotonic()
+        with open(os.path.join(proc_root, "net", "dev"), "r") as f:
+            return cls(cls.parse(f.read()), taken_at)
+
+    @classmethod
+    def empty(cls) -> "NetDevSnapshot":
+        return cls({}, time.monotonic())
+
+    @staticmethod
+    def parse(text: str) -> Dict[str, InterfaceCounters]:
+        interfaces = {}
+        for line in text.splitlines():
+            # The first two lines are column headers and contain '|' instead of ':'
+            if ":" not in line:
+                continue
+            name, _, counters = line.partition(":")
+            values = counters.split()
+            if len(values) < len(COUNTER_FIELDS):
+                continue
+            try:
+                numbers = [int(v) for v in values[:len(COUNTER_FIELDS)]]
+            except ValueError:
+                continue
+            name = name.strip()
+            interfaces[name] = InterfaceCounters(name, numbers)
+        return interfaces
+
+    def get(self, name: str) -> Optional[InterfaceCounters]:
+        return self.interfaces.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.interfaces
+
+    def rates_since(self, previous: "NetDevSnapshot") -> Dict[str, "InterfaceRates"]:
+        """Per-second rates for every interface present in both snapshots"""
+        elapsed = self.taken_at - previous.taken_at
+        rates = {}
+        if elapsed <= 0:
+            return rates
+        for name, current in self.interfaces.items():
+            before = previous.interfaces.get(name)
+            if before is not None:
+                rates[name] = InterfaceRates(name, before, current, elapsed)
+        return rates
+
+
+class InterfaceRates:
+    """Per-second throughput between two samples of the same interface"""
+    __slots__ = ("name", "rx_bps", "tx_bps", "rx_pps", "tx_pps", "drops_ps", "errors_ps")
+
+    def __init__(self, name: str, before: InterfaceCounters, current: InterfaceCounters, elapsed: float):
+        self.name = name
+
+        def rate(field):
+            # Counters restart from zero when the tunnel is recreated
+            delta = getattr(current, field) - getattr(before, field)
+            return (delta if delta >= 0 else getattr(current, field)) / elapsed
+
+        self.rx_bps = rate("rx_bytes") * 8
+        self.tx_bps = rate("tx_bytes") * 8
+        self.rx_pps = rate("rx_packets")
+        self.tx_pps = rate("tx_packets")
+        self.drops_ps = rate("rx_drop") + rate("tx_drop")
+        self.errors_ps = rate("rx_errs") + rate("tx_errs")
+
+
+def format_bits(bits_per_second: float) -> str:
+    """Convert a bit rate to a human-readable string"""
+    for unit in ("bit/s", "Kbit/s", "Mbit/s", "Gbit/s"):
+        if bits_per_second < 1000:
+            return f"{bits_per_second:.0f} {unit}" if unit == "bit/s" else f"{bits_per_second:.2f} {unit}"
+        bits_per_second /= 1000
+    return f"{bits_per_second:.2f} Tbit/s"
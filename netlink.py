@@ -0,0 +1,166 @@
+import os
+import socket
+import struct
+from typing import Dict, List, Optional
+
+
+# Netlink message types and flags (linux/netlink.h, linux/rtnetlink.h)
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+# Link attributes (linux/if_link.h)
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_TXQLEN = 13
+IFLA_OPERSTATE = 16
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+
+# Address attributes (linux/if_addr.h)
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+# Interface flags (linux/if.h)
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+IFF_LOWER_UP = 0x10000
+
+OPER_STATES = {0: "UNKNOWN", 1: "NOTPRESENT", 2: "DOWN", 3: "LOWERLAYERDOWN", 4: "TESTING", 5: "DORMANT", 6: "UP"}
+
+NLMSGHDR = struct.Struct("=LHHLL")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+RTATTR = struct.Struct("=HH")
+
+
+class LinkInfo:
+    """State of one network interface as reported by rtnetlink"""
+    __slots__ = ("index", "name", "kind", "flags", "operstate", "mtu", "txqueuelen", "addresses")
+
+    def __init__(self, index: int, name: str, flags: int):
+        self.index = index
+        self.name = name
+        self.kind = None
+        self.flags = flags
+        self.operstate = "UNKNOWN"
+        self.mtu = 0
+        self.txqueuelen = 0
+        self.addresses: List[str] = []
+
+    @property
+    def is_up(self) -> bool:
+        """True when the link is operationally up
+
+        tun devices usually report operstate UNKNOWN (shown as 'state UNKNOWN' by iproute2),
+        so for those the administrative and carrier flags decide.
+        """
+        if self.operstate == "UP":
+            return True
+        return self.operstate == "UNKNOWN" and bool(self.flags & IFF_UP) and bool(self.flags & IFF_LOWER_UP)
+
+    @property
+    def ipv4_addresses(self) -> List[str]:
+        return [addr for addr in self.addresses if ":" not in addr]
+
+
+class NetlinkClient:
+    """Minimal rtnetlink client that dumps all links and addresses over one socket"""
+
+    def __init__(self):
+        self.seq = 0
+
+    def _align(self, length: int) -> int:
+        return (length + 3) & ~3
+
+    def _parse_attrs(self, data: bytes, offset: int) -> Dict[int, bytes]:
+        attrs = {}
+        while offset + RTATTR.size <= len(data):
+            length, attr_type = RTATTR.unpack_from(data, offset)
+            if length < RTATTR.size:
+                break
+            attrs[attr_type & 0x3fff] = data[offset + RTATTR.size:offset + length]
+            offset += self._align(length)
+        return attrs
+
+    def _dump(self, sock: socket.socket, msg_type: int, payload: bytes) -> List[tuple]:
+        """Send a dump request and collect (type, body) for every reply message"""
+        self.seq += 1
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+        sock.send(header + payload)
+
+        messages = []
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, reply_type, _, seq, _ = NLMSGHDR.unpack_from(data, offset)
+                if length < NLMSGHDR.size:
+                    return messages
+                body = data[offset + NLMSGHDR.size:offset + length]
+                offset += self._align(length)
+                if seq != self.seq:
+                    continue
+                if reply_type == NLMSG_DONE:
+                    return messages
+                if reply_type == NLMSG_ERROR:
+                    error = struct.unpack_from("=i", body)[0] if len(body) >= 4 else 0
+                    if error:
+                        raise OSError(-error, os.strerror(-error))
+                    return messages
+                messages.append((reply_type, body))
+
+    def dump(self) -> Dict[str, LinkInfo]:
+        """Return every interface keyed by name, with its addresses attached"""
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+            sock.bind((0, 0))
+            link_messages = self._dump(sock, RTM_GETLINK, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+            addr_messages = self._dump(sock, RTM_GETADDR, IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+
+        by_index: Dict[int, LinkInfo] = {}
+        for msg_type, body in link_messages:
+            if msg_type != RTM_NEWLINK or len(body) < IFINFOMSG.size:
+                continue
+            _, _, index, flags, _ = IFINFOMSG.unpack_from(body)
+            attrs = self._parse_attrs(body, IFINFOMSG.size)
+            if IFLA_IFNAME not in attrs:
+                continue
+            link = LinkInfo(index, attrs[IFLA_IFNAME].rstrip(b"\0").decode(errors="replace"), flags)
+            if IFLA_MTU in attrs:
+                link.mtu = struct.unpack("=I", attrs[IFLA_MTU][:4])[0]
+            if IFLA_TXQLEN in attrs:
+                link.txqueuelen = struct.unpack("=I", attrs[IFLA_TXQLEN][:4])[0]
+            if IFLA_OPERSTATE in attrs:
+                link.operstate = OPER_STATES.get(attrs[IFLA_OPERSTATE][0], "UNKNOWN")
+            if IFLA_LINKINFO in attrs:
+                kind = self._parse_attrs(attrs[IFLA_LINKINFO], 0).get(IFLA_INFO_KIND)
+                if kind:
+                    link.kind = kind.rstrip(b"\0").decode(errors="replace")
+            by_index[index] = link
+
+        for msg_type, body in addr_messages:
+            if msg_type != RTM_NEWADDR or len(body) < IFADDRMSG.size:
+                continue
+            family, prefixlen, _, _, index = IFADDRMSG.unpack_from(body)
+            link = by_index.get(index)
+            if link is None:
+                continue
+            attrs = self._parse_attrs(body, IFADDRMSG.size)
+            # IFA_LOCAL is the interface's own address on point-to-point links such as tun
+            raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+            if raw:
+                link.addresses.append(f"{socket.inet_ntop(family, raw)}/{prefixlen}")
+
+        return {link.name: link for link in by_index.values()}
+
+    def get_link(self, name: str) -> Optional[LinkInfo]:
+        return self.dump().get(name)
+
+    def tun_links(self) -> Dict[str, LinkInfo]:
+        """Return only tun/tap devices"""
+        return {name: link for name, link in self.dump().items() if link.kind == "tun"}
@@ -0,0 +1,235 @@
+import errno
+import ipaddress
+import json
+import os
+import select
+import socket
+import time
+from typing import Dict, Optional, Tuple
+
+from icmp_probe import ICMP_ECHO_REQUEST, ICMP_HEADER, PAYLOAD, IcmpProber, icmp_checksum
+
+
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+# Always set DF and ignore the kernel's cached path MTU, so every size is really tried
+IP_PMTUDISC_PROBE = getattr(socket, "IP_PMTUDISC_PROBE", 3)
+IP_MTU = getattr(socket, "IP_MTU", 14)
+
+ICMP_DEST_UNREACH = 3
+ICMP_FRAG_NEEDED = 4
+
+IP_HEADER = {4: 20, 6: 40}
+UDP_HEADER = 8
+# Added by tinyfecVPN to each packet of up to --mtu bytes: its own packet header, and
+# the FEC group header when FEC is on (rounded up, so estimates err on the safe side)
+TINYVPN_OVERHEAD = 24
+FEC_OVERHEAD = 12
+# Added by UDP2Raw to a game datagram, per raw mode: the transport header it forges
+# (faketcp carries TCP timestamps) plus its own header and --auth-mode simple tag
+UDP2RAW_OVERHEAD = {"faketcp": 32 + 24, "udp": 8 + 24, "icmp": 8 + 24}
+# Smallest packet every IPv4 path must carry, and the IPv6 minimum link MTU
+MIN_PMTU = {4: 576, 6: 1280}
+# Internet paths do not carry jumbo frames, so larger local MTUs (loopback, LAN) are capped
+MAX_PMTU = 1500
+# Any public address; only used to look up the default route
+UPLINK_ADDRESS = "1.1.1.1"
+
+
+def ip_version(address: str) -> int:
+    return ipaddress.ip_address(address).version
+
+
+def tinyvpn_mtu(pmtu: int, version: int = 4, fec: bool = True) -> int:
+    """Largest TinyVPN --mtu whose packets fit a path MTU without fragmenting"""
+    return min(pmtu, MAX_PMTU) - IP_HEADER[version] - UDP_HEADER - TINYVPN_OVERHEAD - (FEC_OVERHEAD if fec else 0)
+
+
+def udp2raw_payload(mtu: int, raw_mode: str) -> int:
+    """Largest game datagram a UDP2Raw tunnel can carry inside a TinyVPN tunnel of --mtu bytes"""
+    return mtu - IP_HEADER[4] - UDP2RAW_OVERHEAD.get(raw_mode, max(UDP2RAW_OVERHEAD.values()))
+
+
+def route_mtu(address: str) -> Optional[int]:
+    """MTU of the interface (or cached path MTU) the kernel would route `address` through"""
+    try:
+        family = socket.AF_INET6 if ip_version(address) == 6 else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            # Connecting a UDP socket only selects the route; nothing is sent
+            sock.connect((address, 9))
+            level = socket.IPPROTO_IPV6 if family == socket.AF_INET6 else socket.IPPROTO_IP
+            option = getattr(socket, "IPV6_MTU", 24) if family == socket.AF_INET6 else IP_MTU
+            return sock.getsockopt(level, option)
+    except (OSError, ValueError):
+        return None
+
+
+class PmtuProber:
+    """Find the path MTU to an IPv4 peer with don't-fragment echo requests
+
+    Sizes are binary-searched between the IPv4 minimum and the MTU of the route to
+    the peer; a size counts as passing when any of `attempts` echo requests of that
+    size is answered, so a lost packet is not mistaken for a too-large one. With a raw
+    socket (as root) the next-hop MTU in a router's "fragmentation needed" error is
+    tried first, which usually settles it in three probes. Needs the peer to answer
+    pings, as the TinyVPN ping checks already do.
+    """
+
+    def __init__(self, timeout: float = 1.0, attempts: int = 2, raw: Optional[bool] = None):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.icmp = IcmpProber(timeout=timeout, raw=raw)
+        self.probes = 0
+        # Next-hop MTU reported by the last "fragmentation needed" error, if any
+        self.hint: Optional[int] = None
+
+    def request(self, seq: int, token: int, size: int) -> bytes:
+        """Echo request making an IPv4 packet of `size` bytes"""
+        payload = PAYLOAD.pack(token, time.monotonic_ns())
+        payload += b"\0" * max(0, size - IP_HEADER[4] - ICMP_HEADER.size - len(payload))
+        header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, self.icmp.ident, seq)
+        checksum = icmp_checksum(header + payload)
+        return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, self.icmp.ident, seq) + payload
+
+    def too_big(self, data: bytes, seq: int) -> bool:
+        """Whether a raw packet is a "fragmentation needed" error for our request `seq`"""
+        icmp = data[(data[0] & 0x0f) * 4:]
+        if len(icmp) < 8 + IP_HEADER[4] + ICMP_HEADER.size:
+            return False
+        if icmp[0] != ICMP_DEST_UNREACH or icmp[1] != ICMP_FRAG_NEEDED:
+            return False
+        # The error quotes our IP header and the start of the echo request
+        quoted = icmp[8 + (icmp[8] & 0x0f) * 4:]
+        if len(quoted) < ICMP_HEADER.size:
+            return False
+        _, _, _, ident, quoted_seq = ICMP_HEADER.unpack_from(quoted)
+        if ident != self.icmp.ident or quoted_seq != seq:
+            return False
+        next_hop = int.from_bytes(icmp[6:8], "big")
+        self.hint = next_hop if next_hop >= MIN_PMTU[4] else None
+        return True
+
+    def fits(self, sock: socket.socket, is_raw: bool, address: str, size: int) -> bool:
+        token = int.from_bytes(os.urandom(4), "big")
+        for attempt in range(self.attempts):
+            seq = (self.probes + 1) & 0xffff
+            self.probes += 1
+            try:
+                sock.sendto(self.request(seq, token, size), (address, 0))
+            except OSError as e:
+                if e.errno == errno.EMSGSIZE:
+                    # Larger than the local interface allows
+                    return False
+                raise
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    break
+                try:
+                    data = sock.recv(65535)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                parsed = self.icmp._parse_reply(data, is_raw, token)
+                if parsed is not None and parsed[0] == seq:
+                    return True
+                if is_raw and self.too_big(data, seq):
+                    # A router said so; no need to wait out the timeout
+                    return False
+        return False
+
+    def discover(self, address: str, device: Optional[str] = None, high: Optional[int] = None) -> Optional[int]:
+        """Largest IPv4 packet that reaches `address` unfragmented, or None when it does not answer"""
+        high = min(high or route_mtu(address) or 1500, 65535)
+        low = MIN_PMTU[4]
+        sock, is_raw = self.icmp._open_socket(device)
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+            # Most paths carry the full interface MTU, so try it before searching
+            self.hint = None
+            if self.fits(sock, is_raw, address, high):
+                return high
+            # Routers that report their MTU usually give the answer straight away
+            if self.hint is not None and self.hint < high:
+                if self.fits(sock, is_raw, address, self.hint):
+                    return self.hint
+                high = self.hint
+            if not self.fits(sock, is_raw, address, low):
+                return None
+            # low always fits and high never does
+            while high - low > 1:
+                middle = (low + high) // 2
+                if self.fits(sock, is_raw, address, middle):
+                    low = middle
+                else:
+                    high = middle
+            return low
+        finally:
+            sock.close()
+
+
+class PmtuCache:
+    """Path MTUs per peer address in a JSON file, trusted for `ttl` seconds"""
+
+    def __init__(self, path: str, ttl: float = 86400.0):
+        self.path = path
+        self.ttl = ttl
+
+    def load(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def get(self, address: str) -> Optional[int]:
+        entry = self.load().get(address)
+        if not isinstance(entry, dict) or time.time() - entry.get("time", 0) > self.ttl:
+            return None
+        return int(entry["pmtu"])
+
+    def put(self, address: str, pmtu: int):
+        data = self.load()
+        data[address] = {"pmtu": pmtu, "time": time.time()}
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def default_cache_path(base_dir: str) -> str:
+    return os.path.join(base_dir, "pmtu.json")
+
+
+def find_pmtu(address: str, cache: PmtuCache, prober: Optional[PmtuProber] = None,
+              refresh: bool = False) -> Tuple[Optional[int], str]:
+    """Path MTU to a peer and where it came from: 'cache', 'probe' or 'route'
+
+    IPv6 peers, and peers that do not answer pings, fall back to the MTU of the local
+    route, which is an upper bound rather than a measurement.
+    """
+    try:
+        version = ip_version(address)
+    except ValueError:
+        try:
+            address = socket.gethostbyname(address)
+            version = 4
+        except OSError:
+            return None, "unresolved"
+    if not refresh:
+        cached = cache.get(address)
+        if cached is not None:
+            return cached, "cache"
+    if version == 4:
+        try:
+            pmtu = (prober or PmtuProber()).discover(address)
+        except OSError:
+            pmtu = None
+        if pmtu is not None:
+            cache.put(address, pmtu)
+            return pmtu, "probe"
+    return route_mtu(address), "route"
@@ -0,0 +1,337 @@
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+from netdev import NetDevSnapshot
+from netlink import LinkInfo
+from service_status import UnitState
+
+
+class RestartResult:
+    """Outcome of restarting one unit
+
+    `stage` is the last readiness condition reached: "restart" until systemd reports
+    the unit active, then "active", "tun" once a TinyVPN device is up, and "ready"
+    once every condition held.
+    """
+    __slots__ = ("unit", "backend", "role", "name", "stage", "elapsed", "error")
+
+    def __init__(self, unit: str, backend: str, role: str, name: str):
+        self.unit = unit
+        self.backend = backend
+        self.role = role
+        self.name = name
+        self.stage = "restart"
+        self.elapsed: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.stage == "ready"
+
+
+class StatePoller:
+    """Share unit state and link queries between all units being waited on
+
+    Waiting units register themselves; whichever thread finds the snapshot older than
+    `interval` refreshes it with one `systemctl show` for every waiting unit and one
+    rtnetlink dump, so polling cost does not grow with the concurrency limit.
+    """
+
+    def __init__(self, service_status, netlink, interval: float = 0.25):
+        self.service_status = service_status
+        self.netlink = netlink
+        self.interval = interval
+        self.waiting: Set[str] = set()
+        self.states: Dict[str, UnitState] = {}
+        self.links: Dict[str, LinkInfo] = {}
+        self.polled_at = 0.0
+        self.lock = threading.Lock()
+
+    def watch(self, unit: str):
+        with self.lock:
+            self.waiting.add(unit)
+            # Never report a state queried before the restart was issued
+            self.states.pop(unit, None)
+
+    def unwatch(self, unit: str):
+        with self.lock:
+            self.waiting.discard(unit)
+
+    def poll(self):
+        with self.lock:
+            if time.monotonic() - self.polled_at < self.interval:
+                return
+            units = sorted(self.waiting)
+            if units:
+                self.states.update(self.service_status.get_many(units))
+            try:
+                self.links = self.netlink.dump()
+            except OSError:
+                self.links = {}
+            self.polled_at = time.monotonic()
+
+    def state(self, unit: str) -> Optional[UnitState]:
+        self.poll()
+        with self.lock:
+            return self.states.get(unit)
+
+    def link(self, name: str) -> Optional[LinkInfo]:
+        self.poll()
+        with self.lock:
+            return self.links.get(name)
+
+
+class ReadinessWaiter:
+    """Wait until a restarted unit is ready or its deadline passes
+
+    A unit is ready when systemd reports it active; TinyVPN additionally needs its
+    tun device up and a first echo reply from the tunnel peer.
+    """
+
+    def __init__(self, tinyvpn, service_status, deadline: float = 30.0, poll_interval: float = 0.25):
+        self.tinyvpn = tinyvpn
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.poller = StatePoller(service_status, tinyvpn.netlink, poll_interval)
+
+    def wait(self, result: RestartResult, started: float) -> RestartResult:
+        """Poll until the unit meets every readiness condition or its deadline passes"""
+        deadline = started + self.deadline
+        peer = None
+        if result.backend == "tinyvpn":
+            config = self.tinyvpn.load_config(result.name)
+            peer = self.tinyvpn.get_peer_ip(config) if config else None
+
+        self.poller.watch(result.unit)
+        try:
+            while time.monotonic() < deadline:
+                state = self.poller.state(result.unit)
+                if state is None or not state.is_active:
+                    result.stage = "restart"
+                    if state is not None and state.load_state == "not-found":
+                        result.error = "unit not installed"
+                        return result
+                    time.sleep(self.poll_interval)
+                    continue
+                result.stage = "active"
+
+                if result.backend == "tinyvpn":
+                    link = self.poller.link(result.name)
+                    if link is None or not link.is_up:
+                        time.sleep(self.poll_interval)
+                        continue
+                    result.stage = "tun"
+                    if peer is None:
+                        result.error = "no subnet configured"
+                        return result
+                    remaining = deadline - time.monotonic()
+                    stats = self.tinyvpn.ping_peer(peer, count=1, timeout=max(0.1, min(1.0, remaining)),
+                                                   device=result.name)
+                    if not stats.reachable:
+                        time.sleep(self.poll_interval)
+                        continue
+
+                result.stage = "ready"
+                result.elapsed = time.monotonic() - started
+                return result
+        finally:
+            self.poller.unwatch(result.unit)
+        return result
+
+
+class RestartOrchestrator:
+    """Restart tunnel units in parallel and wait until each one is really ready
+
+    Units are grouped per configuration name. Within a group the TinyVPN unit is
+    restarted first, since UDP2Raw connects through the tunnel it creates, and the
+    UDP2Raw unit of the same name is only restarted once TinyVPN is ready (or its
+    deadline has passed). Groups run concurrently, at most `concurrency` at a time,
+    and each unit gets `deadline` seconds from its restart to become ready.
+    """
+
+    def __init__(self, tinyvpn, udp2raw, frp, service_status, concurrency: int = 8, deadline: float = 30.0,
+                 poll_interval: float = 0.25, console: Optional[Console] = None):
+        self.tinyvpn = tinyvpn
+        self.udp2raw = udp2raw
+        self.frp = frp
+        self.modules = {"tinyvpn": tinyvpn, "udp2raw": udp2raw, "frp": frp}
+        self.service_status = service_status
+        self.concurrency = max(1, concurrency)
+        self.deadline = deadline
+        self.waiter = ReadinessWaiter(tinyvpn, service_status, deadline, poll_interval)
+        self.console = console or Console()
+
+    def collect(self) -> List[List[Tuple[str, str, str]]]:
+        """Group every configuration into ordered (backend, role, name) restart chains"""
+        groups: Dict[Tuple[str, str], List[Tuple[str, str, str]]] = {}
+        for backend in ("tinyvpn", "udp2raw"):
+            for config in self.modules[backend].get_available_configs():
+                groups.setdefault(("vpn", config['name']), []).append((backend, config['type'], config['name']))
+        for config in self.frp.get_available_configs():
+            groups[("frp", f"{config['type']}-{config['name']}")] = [("frp", config['type'], config['name'])]
+        return [groups[key] for key in sorted(groups)]
+
+    def systemctl(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run([self.service_status.systemctl, *args], capture_output=True, text=True)
+
+    def restart_chain(self, chain: List[Tuple[str, str, str]]) -> List[RestartResult]:
+        """Restart the units of one group in order, each after the previous one is done"""
+        results = []
+        for backend, role, name in chain:
+            result = RestartResult(self.modules[backend].get_service_name(name, role), backend, role, name)
+            results.append(result)
+            started = time.monotonic()
+            outcome = self.systemctl("restart", result.unit)
+            if outcome.returncode != 0:
+                result.error = outcome.stderr.strip().splitlines()[-1] if outcome.stderr.strip() else "restart failed"
+                continue
+            self.waiter.wait(result, started)
+        return results
+
+    def restart(self, chains: Optional[List[List[Tuple[str, str, str]]]] = None,
+                progress=None, task=None) -> List[RestartResult]:
+        """Restart every chain on a bounded pool; results come back in chain order"""
+        chains = self.collect() if chains is None else chains
+        results: List[RestartResult] = []
+        if not chains:
+            return results
+        total = sum(len(chain) for chain in chains)
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chains))) as executor:
+            futures = [executor.submit(self.restart_chain, chain) for chain in chains]
+            for future in futures:
+                results.extend(future.result())
+                if progress is not None:
+                    ready = sum(1 for result in results if result.ready)
+                    progress.update(task, description=f"Restarting services... {ready}/{total} ready")
+        return results
+
+    def show_results(self, results: List[RestartResult]):
+        waiting_for = {"restart": "not active", "active": "tun device down", "tun": "no probe reply"}
+        table = Table(title="Restart", show_header=True)
+        table.add_column("Service", style="cyan")
+        table.add_column("Result")
+        table.add_column("Time to ready", justify="right")
+        for result in results:
+            if result.ready:
+                status = "[green]ready[/green]"
+            elif result.error:
+                status = f"[red]{result.error}[/red]"
+            else:
+                status = f"[yellow]{waiting_for[result.stage]} after {self.deadline:g}s[/yellow]"
+            elapsed = f"{result.elapsed:.2f}s" if result.elapsed is not None else "-"
+            table.add_row(result.unit, status, elapsed)
+        self.console.print(table)
+
+
+class Interruption:
+    """How a scheduled restart went: how long it waited for a quiet moment and how long the tunnel was down"""
+    __slots__ = ("unit", "had_traffic", "idle", "waited", "downtime", "result")
+
+    def __init__(self, unit: str):
+        self.unit = unit
+        # Whether packets were flowing through the tunnel when the restart was requested
+        self.had_traffic = False
+        # Whether the restart happened in an idle gap rather than after max_wait ran out
+        self.idle = False
+        self.waited = 0.0
+        self.downtime: Optional[float] = None
+        self.result: Optional[RestartResult] = None
+
+    def describe(self) -> str:
+        if self.result is None:
+            return f"No idle moment within {self.waited:.0f}s, not restarted"
+        if self.idle and not self.had_traffic:
+            text = "The tunnel was idle, restarted right away"
+        elif self.idle:
+            text = f"Restarted in an idle moment after waiting {self.waited:.1f}s"
+        elif self.had_traffic:
+            text = f"No idle moment within {self.waited:.0f}s, restarted during traffic"
+        else:
+            text = "Restarted without waiting for an idle moment"
+        if self.downtime is not None:
+            return f"{text}; the tunnel was down for {self.downtime:.2f}s"
+        return f"{text}; the tunnel is not back yet"
+
+
+class IdleRestart:
+    """Restart a TinyVPN instance in a gap between traffic instead of mid-match
+
+    TinyVPN has no handover: a client only knows its server's single port, and a
+    second instance could not own the same tun subnet, so a new instance cannot be
+    brought up next to the old one and take over the session. Instead the restart is
+    held back until the tun device has carried at most `idle_packets` packets for
+    `quiet_for` seconds (read from /proc/net/dev), then the downtime is measured
+    from the restart until the peer answers an echo request again.
+    """
+
+    def __init__(self, tinyvpn, service_status, idle_packets: int = 2, quiet_for: float = 2.0,
+                 max_wait: float = 300.0, deadline: float = 30.0, interval: float = 0.1, proc_root: str = "/proc"):
+        self.tinyvpn = tinyvpn
+        self.service_status = service_status
+        self.idle_packets = idle_packets
+        self.quiet_for = quiet_for
+        self.max_wait = max_wait
+        self.interval = interval
+        self.proc_root = proc_root
+        self.waiter = ReadinessWaiter(tinyvpn, service_status, deadline, interval)
+
+    def packets(self, device: str) -> Optional[int]:
+        counters = NetDevSnapshot.read(self.proc_root).get(device)
+        if counters is None:
+            return None
+        return counters.rx_packets + counters.tx_packets
+
+    def wait_for_idle(self, device: str, report: Interruption):
+        """Sample the device until a quiet window is seen or max_wait runs out"""
+        started = time.monotonic()
+        samples = []
+        while True:
+            now = time.monotonic()
+            count = self.packets(device)
+            if count is None:
+                # The device is gone, so there is no session left to protect
+                report.idle = True
+                break
+            samples.append((now, count))
+            # Keep the newest sample that is at least quiet_for old as the window start
+            while len(samples) > 1 and now - samples[1][0] >= self.quiet_for:
+                samples.pop(0)
+            if now - samples[0][0] >= self.quiet_for:
+                if count - samples[0][1] <= self.idle_packets:
+                    report.idle = True
+                    break
+                report.had_traffic = True
+            if now - started >= self.max_wait:
+                break
+            time.sleep(self.interval)
+        report.waited = time.monotonic() - started
+
+    def restart(self, config_name: str, config_type: str) -> Interruption:
+        report = Interruption(self.tinyvpn.get_service_name(config_name, config_type))
+        self.wait_for_idle(config_name, report)
+        self.restart_now(config_name, config_type, report)
+        return report
+
+    def restart_now(self, config_name: str, config_type: str, report: Interruption) -> bool:
+        """Restart without waiting and measure the downtime; False when systemd refused the restart
+
+        Callers that must not interrupt traffic run wait_for_idle first and only call
+        this when `report.idle` came out true.
+        """
+        result = RestartResult(report.unit, "tinyvpn", config_type, config_name)
+        report.result = result
+        started = time.monotonic()
+        outcome = subprocess.run([self.service_status.systemctl, "restart", report.unit], capture_output=True,
+                                 text=True)
+        if outcome.returncode != 0:
+            result.error = outcome.stderr.strip() or "restart failed"
+            return False
+        self.waiter.wait(result, started)
+        report.downtime = result.elapsed
+        return True
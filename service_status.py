@@ -0,0 +1,129 @@
+import subprocess
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class UnitState:
+    """systemd state of a single unit as reported by `systemctl show`"""
+    __slots__ = ("name", "load_state", "active_state", "sub_state", "n_restarts", "main_pid")
+
+    def __init__(self, name: str, load_state: str = "unknown", active_state: str = "unknown",
+                 sub_state: str = "unknown", n_restarts: int = 0, main_pid: int = 0):
+        self.name = name
+        self.load_state = load_state
+        self.active_state = active_state
+        self.sub_state = sub_state
+        self.n_restarts = n_restarts
+        self.main_pid = main_pid
+
+    @property
+    def is_active(self) -> bool:
+        return self.active_state == "active"
+
+    @property
+    def is_known(self) -> bool:
+        return self.active_state != "unknown"
+
+    def describe(self) -> str:
+        """Short human-readable summary, e.g. 'active (running), pid 123, 2 restarts'"""
+        if not self.is_known:
+            return "unknown"
+        if self.load_state == "not-found":
+            return "not installed"
+        text = f"{self.active_state} ({self.sub_state})"
+        if self.main_pid:
+            text += f", pid {self.main_pid}"
+        if self.n_restarts:
+            text += f", {self.n_restarts} restarts"
+        return text
+
+
+class ServiceStatus:
+    """Collect systemd state for many tunnel units with a single `systemctl show` call"""
+
+    PROPERTIES = ["Id", "LoadState", "ActiveState", "SubState", "NRestarts", "MainPID"]
+    UNIT_PATTERNS = ["tinyvpn@*", "udp2raw@*", "frps@*", "frpc@*", "tinyvpn-*", "udp2raw-*", "frps-*", "frpc-*"]
+    # Keep each command line well below ARG_MAX even with thousands of units
+    MAX_UNITS_PER_CALL = 512
+
+    def __init__(self, max_age: float = 2.0, systemctl: str = "systemctl"):
+        self.max_age = max_age
+        # Path of the systemctl binary; a stub can be used for local testing
+        self.systemctl = systemctl
+        # SupervisorClient answering instead of systemd while `supervise` is running
+        self.supervisor = None
+        self.states: Dict[str, UnitState] = {}
+        self.refreshed_at = 0.0
+
+    def refresh(self, units: Optional[Iterable[str]] = None) -> Dict[str, UnitState]:
+        """Query the state of the given units (or all tunnel units) and update the cache"""
+        names = list(units) if units is not None else list(self.UNIT_PATTERNS)
+        states: Dict[str, UnitState] = {}
+
+        supervised = self.supervisor.states(names if units is not None else None) if self.supervisor else None
+        if supervised is not None:
+            states.update(supervised)
+            names = []
+
+        for start in range(0, len(names), self.MAX_UNITS_PER_CALL):
+            chunk = names[start:start + self.MAX_UNITS_PER_CALL]
+            try:
+                result = subprocess.run(
+                    [self.systemctl, "show", f"--property={','.join(self.PROPERTIES)}", "--", *chunk],
+                    capture_output=True,
+                    text=True
+                )
+            except Exception:
+                continue
+            states.update(self.parse_show_output(result.stdout))
+
+        # Units systemd knows nothing about still get an entry so lookups are cheap
+        if units is not None:
+            for name in names:
+                states.setdefault(name, UnitState(name))
+
+        self.states = states if units is None else {**self.states, **states}
+        self.refreshed_at = time.monotonic()
+        return states
+
+    def parse_show_output(self, output: str) -> Dict[str, UnitState]:
+        """Parse the blank-line separated property blocks printed by `systemctl show`"""
+        states = {}
+        for block in output.split("\n\n"):
+            props = {}
+            for line in block.splitlines():
+                if "=" in line:
+                    key, value = line.split("=", 1)
+                    props[key] = value
+            name = props.get("Id")
+            if not name:
+                continue
+            states[name] = UnitState(
+                name,
+                load_state=props.get("LoadState", "unknown"),
+                active_state=props.get("ActiveState", "unknown"),
+                sub_state=props.get("SubState", "unknown"),
+                n_restarts=self._to_int(props.get("NRestarts")),
+                main_pid=self._to_int(props.get("MainPID")),
+            )
+        return states
+
+    def get(self, unit: str, refresh: bool = False) -> UnitState:
+        """Return the cached state of a unit, querying systemd only if the cache is stale"""
+        stale = time.monotonic() - self.refreshed_at > self.max_age
+        if refresh or stale or unit not in self.states:
+            self.refresh(list({*self.states.keys(), unit}))
+        return self.states.get(unit, UnitState(unit))
+
+    def get_many(self, units: List[str], refresh: bool = True) -> Dict[str, UnitState]:
+        """Return states for several units, refreshing them together in one query"""
+        if refresh:
+            self.refresh(units)
+        return {unit: self.states.get(unit, UnitState(unit)) for unit in units}
+
+    @staticmethod
+    def _to_int(value: Optional[str]) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, List, Optional
+
+from rich import print as rich_print
+
+from monitor import MonitorClient
+from service_status import UnitState
+
+
+class RotatingLog:
+    """Append-only log file rotated to <path>.1 ... <path>.<backups> beyond max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = None
+        self.size = 0
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "ab")
+        self.size = self.file.tell()
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def write(self, data: bytes):
+        if self.file is None:
+            self.open()
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class LogWriter:
+    """Write child output to disk from one background thread
+
+    The event loop only hands chunks to a queue, so a slow disk or a rotation never
+    delays reading the children's pipes (a full pipe would stall the tunnel itself).
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def write(self, log: RotatingLog, data: bytes):
+        self.queue.put((log, data))
+
+    def close(self, log: RotatingLog):
+        # Closed in order after the log's pending writes
+        self.queue.put((log, None))
+
+    def run(self):
+        while True:
+            log, data = self.queue.get()
+            if log is None:
+                break
+            if data is None:
+                log.close()
+                continue
+            try:
+                log.write(data)
+                # Flush once the burst is written instead of after every chunk
+                if self.queue.empty():
+                    log.file.flush()
+            except OSError as e:
+                rich_print(f"[red]Cannot write {log.path}: {str(e)}[/red]")
+
+    def stop(self):
+        self.queue.put((None, None))
+        self.thread.join()
+
+
+class SupervisedProcess:
+    """One tunnel binary run as a child process, restarted with exponential backoff
+
+    The state mirrors what systemd would report for the unit of the same name, so
+    the menus can show it through ServiceStatus unchanged.
+    """
+
+    def __init__(self, unit: str, backend: str, name: str, command: List[str], stdout: RotatingLog,
+                 stderr: RotatingLog):
+        self.unit = unit
+        self.backend = backend
+        self.name = name
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.task: Optional[asyncio.Task] = None
+        self.active_state = "inactive"
+        self.sub_state = "dead"
+        self.n_restarts = 0
+        self.started_at = 0.0
+        self.stopping = False
+        # Set to cut a backoff delay short when the process is stopped
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def state(self) -> UnitState:
+        return UnitState(self.unit, "loaded", self.active_state, self.sub_state, self.n_restarts,
+                         self.process.pid if self.process is not None and self.process.returncode is None else 0)
+
+
+class Supervisor:
+    """Run every configured tunnel as a child of one asyncio event loop
+
+    For hosts without systemd, such as containers. Each instance runs the same
+    command line its template unit would, writes to rotating log files, and is
+    restarted after exiting, waiting `backoff` seconds doubled per quick failure up
+    to `max_backoff`; a run that lasted `stable_after` seconds resets the backoff.
+    An instance is ready once it has stayed up for `ready_after` seconds and, for
+    TinyVPN, its tun device is up.
+
+    Unit states are served on ~/.gamingtunnel/supervisor.sock, where ServiceStatus
+    picks them up instead of asking systemd. SIGHUP rescans the configurations,
+    starting new tunnels, stopping removed ones and restarting changed ones.
+    """
+
+    def __init__(self, tinyvpn, udp2raw, frp, backoff: float = 1.0, max_backoff: float = 60.0,
+                 stable_after: float = 30.0, ready_after: float = 1.0, ready_timeout: float = 30.0,
+                 log_max_bytes: int = 10 * 1024 * 1024, log_backups: int = 3, socket_path: Optional[str] = None):
+        self.tinyvpn = tinyvpn
+        self.udp2raw = udp2raw
+        self.frp = frp
+        self.modules = {"tinyvpn": tinyvpn, "udp2raw": udp2raw, "frp": frp}
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.ready_after = ready_after
+        self.ready_timeout = ready_timeout
+        self.log_max_bytes = log_max_bytes
+        self.log_backups = log_backups
+        self.socket_path = socket_path or default_socket_path(tinyvpn.base_dir)
+        self.processes: Dict[str, SupervisedProcess] = {}
+        self.writer = LogWriter()
+        self.stop_event: Optional[asyncio.Event] = None
+
+    def log_paths(self, backend: str, name: str, role: str):
+        """(stdout, stderr) files; TinyVPN and UDP2Raw use the ones their template units append to"""
+        if backend == "frp":
+            log_file = f"/var/log/frp{'s' if role == 'server' else 'c'}_{name}.log"
+        else:
+            log_file = self.modules[backend].get_log_file(name, role)
+        return log_file, f"{log_file[:-len('.log')]}.error.log"
+
+    def discover(self) -> Dict[str, SupervisedProcess]:
+        """Build a process for every configuration that has a command line"""
+        found = {}
+        for backend, module in self.modules.items():
+            for config in module.get_available_configs():
+                command = module.get_command(config['name'], config['type'])
+                if not command:
+                    continue
+                unit = module.get_service_name(config['name'], config['type'])
+                stdout, stderr = self.log_paths(backend, config['name'], config['type'])
+                found[unit] = SupervisedProcess(
+                    unit, backend, config['name'], command,
+                    RotatingLog(stdout, self.log_max_bytes, self.log_backups),
+                    RotatingLog(stderr, self.log_max_bytes, self.log_backups),
+                )
+        return found
+
+    async def pump(self, stream: asyncio.StreamReader, log: RotatingLog):
+        while True:
+            data = await stream.read(65536)
+            if not data:
+                break
+            self.writer.write(log, data)
+
+    async def wait_ready(self, proc: SupervisedProcess):
+        """Mark the instance active once it stayed up and, for TinyVPN, its tun device is up"""
+        started = time.monotonic()
+        await asyncio.sleep(self.ready_after)
+        while proc.process.returncode is None:
+            if proc.backend != "tinyvpn":
+                break
+            link = self.tinyvpn.get_interface(proc.name)
+            if link is not None and link.is_up:
+                break
+            if time.monotonic() - started > self.ready_timeout:
+                rich_print(f"[yellow]{proc.unit}: tun device {proc.name} not up after {self.ready_timeout:g}s[/yellow]")
+                return
+            await asyncio.sleep(0.25)
+        if proc.process.returncode is None:
+            proc.active_state, proc.sub_state = "active", "running"
+            rich_print(f"[green]{proc.unit} ready in {time.monotonic() - started:.2f}s[/green]")
+
+    async def run_process(self, proc: SupervisedProcess):
+        delay = self.backoff
+        while not proc.stopping:
+            proc.active_state, proc.sub_state = "activating", "start"
+            proc.started_at = time.monotonic()
+            try:
+                proc.process = await asyncio.create_subprocess_exec(
+                    *proc.command, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                    cwd=self.tinyvpn.base_dir, start_new_session=True,
+                )
+            except OSError as e:
+                rich_print(f"[red]{proc.unit}: cannot start {proc.command[0]}: {str(e)}[/red]")
+                returncode = None
+            else:
+                ready = asyncio.ensure_future(self.wait_ready(proc))
+                await asyncio.gather(self.pump(proc.process.stdout, proc.stdout),
+                                     self.pump(proc.process.stderr, proc.stderr))
+                returncode = await proc.process.wait()
+                ready.cancel()
+            if proc.stopping:
+                break
+
+            if time.monotonic() - proc.started_at >= self.stable_after:
+                delay = self.backoff
+            proc.active_state, proc.sub_state = "activating", "auto-restart"
+            proc.n_restarts += 1
+            rich_print(f"[yellow]{proc.unit} exited with status {returncode}, restarting in {delay:g}s[/yellow]")
+            try:
+                await asyncio.wait_for(proc.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_backoff)
+        proc.active_state, proc.sub_state = "inactive", "dead"
+
+    def start(self, proc: SupervisedProcess):
+        self.processes[proc.unit] = proc
+        proc.wakeup = asyncio.Event()
+        proc.task = asyncio.ensure_future(self.run_process(proc))
+
+    async def stop(self, proc: SupervisedProcess, timeout: float = 5.0):
+        """SIGTERM the process group, then SIGKILL it if it is still running after `timeout`"""
+        proc.stopping = True
+        proc.wakeup.set()
+        proc.active_state, proc.sub_state = "deactivating", "stop-sigterm"
+        process = proc.process
+        if process is not None and process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if proc.task is not None:
+            await proc.task
+        self.writer.close(proc.stdout)
+        self.writer.close(proc.stderr)
+
+    async def reconcile(self):
+        """Start new configurations, stop removed ones and restart those whose command changed"""
+        found = self.discover()
+        stale = [proc for unit, proc in self.processes.items()
+                 if unit not in found or found[unit].command != proc.command]
+        await asyncio.gather(*(self.stop(proc) for proc in stale))
+        for proc in stale:
+            del self.processes[proc.unit]
+        for unit, proc in found.items():
+            if unit not in self.processes:
+                self.start(proc)
+
+    def states(self, units: Optional[List[str]] = None) -> Dict[str, dict]:
+        """Unit states by name; units this supervisor does not run are reported as not found"""
+        names = units if units is not None else list(self.processes)
+        states = {}
+        for unit in names:
+            proc = self.processes.get(unit)
+            state = proc.state() if proc is not None else UnitState(unit, "not-found", "inactive", "dead")
+            states[unit] = {field: getattr(state, field) for field in UnitState.__slots__}
+        return states
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline() or b"{}")
+            command = request.get("cmd")
+            if command == "states":
+                response = {"units": self.states(request.get("units"))}
+            elif command == "ping":
+                response = {"ok": True, "pid": os.getpid()}
+            else:
+                response = {"error": f"unknown command {command!r}"}
+        except Exception as e:
+            response = {"error": str(e)}
+        writer.write(json.dumps(response).encode() + b"\n")
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, self.stop_event.set)
+        loop.add_signal_handler(signal.SIGINT, self.stop_event.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reconcile()))
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        await self.reconcile()
+        rich_print(f"[cyan bold]Supervising {len(self.processes)} tunnels, status on {self.socket_path}[/cyan bold]")
+        try:
+            await self.stop_event.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            await asyncio.gather(*(self.stop(proc) for proc in self.processes.values()))
+
+    def run(self):
+        self.writer.start()
+        try:
+            asyncio.run(self.main())
+        finally:
+            self.writer.stop()
+
+
+def default_socket_path(base_dir: str) -> str:
+    return os.path.join(base_dir, "supervisor.sock")
+
+
+class SupervisorClient(MonitorClient):
+    """Query a running Supervisor; plugs into ServiceStatus.supervisor"""
+
+    def __init__(self, base_dir: str, timeout: float = 1.0):
+        super().__init__(base_dir, timeout, default_socket_path(base_dir))
+
+    def states(self, units: Optional[List[str]] = None) -> Optional[Dict[str, UnitState]]:
+        """Unit states from the supervisor, or None when it is not running"""
+        response = self.request({"cmd": "states", "units": units})
+        if response is None or "units" not in response:
+            return None
+        return {name: UnitState(**fields) for name, fields in response["units"].items()}
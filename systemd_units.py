@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+import shlex
+import subprocess
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+SYSTEMD_DIR = "/etc/systemd/system"
+
+
+def render_unit(sections: Iterable[Tuple[str, Dict[str, object]]]) -> str:
+    """Render unit file text from (section, {key: value}) pairs
+
+    Sections and keys are emitted in the order given and values are stripped, so
+    the same settings always produce byte-identical text (and the same hash).
+    """
+    blocks = []
+    for section, settings in sections:
+        lines = [f"[{section}]"]
+        lines.extend(f"{key}={str(value).strip()}" for key, value in settings.items() if value is not None)
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks) + "\n"
+
+
+def render_env(values: Dict[str, object]) -> str:
+    """Render an EnvironmentFile= with every value double-quoted"""
+    lines = []
+    for key, value in values.items():
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        lines.append(f'{key}="{escaped}"')
+    return "\n".join(lines) + "\n"
+
+
+def parse_env(text: str) -> Dict[str, str]:
+    """Read an EnvironmentFile= written by render_env"""
+    values = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition("=")
+        if not sep or key.startswith("#"):
+            continue
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        values[key.strip()] = value
+    return values
+
+
+def parse_exec_start(text: str) -> Optional[List[str]]:
+    """Arguments of a unit file's ExecStart=, without the binary, or None if it has none"""
+    for line in text.splitlines():
+        if line.startswith("ExecStart="):
+            try:
+                return shlex.split(line[len("ExecStart="):])[1:]
+            except ValueError:
+                return None
+    return None
+
+
+def split_password(args: List[str]) -> Tuple[List[str], Optional[str]]:
+    """Separate `-k <password>` from a command line, as templates pass it on its own"""
+    if "-k" not in args:
+        return args, None
+    index = args.index("-k")
+    if index + 1 >= len(args):
+        return args, None
+    return args[:index] + args[index + 2:], args[index + 1]
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> Optional[str]:
+    """SHA-256 of a file's content, or None when it does not exist"""
+    try:
+        with open(path, "rb") as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+
+def write_if_changed(path: str, text: str, mode: int = 0o644) -> bool:
+    """Atomically replace a file unless it already has this content; True if written"""
+    data = text.encode()
+    if file_hash(path) == content_hash(data):
+        return False
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+class UnitInstaller:
+    """Install unit files only when their content changed and batch daemon-reloads
+
+    Units are kept in ~/.gamingtunnel/services and, when writable, in
+    /etc/systemd/system. Installing or removing a unit only marks a reload as
+    pending; `reload` then runs a single `systemctl daemon-reload` for all of them,
+    and nothing at all when every unit was already up to date. Every daemon-reload
+    re-reads all units on the host, so one per operation is the budget.
+    """
+
+    def __init__(self, base_dir: str, systemd_dir: str = SYSTEMD_DIR, systemctl: str = "systemctl"):
+        self.service_dir = os.path.join(base_dir, "services")
+        self.systemd_dir = systemd_dir
+        self.systemctl = systemctl
+        self.reload_pending = False
+        self.lock = threading.Lock()
+
+    @property
+    def can_install(self) -> bool:
+        return os.access(self.systemd_dir, os.W_OK)
+
+    def is_installed(self, unit: str) -> bool:
+        return os.path.exists(os.path.join(self.systemd_dir, unit))
+
+    def install(self, unit: str, text: str) -> bool:
+        """Install a unit's text; True if systemd's copy changed and a reload is pending"""
+        os.makedirs(self.service_dir, exist_ok=True)
+        write_if_changed(os.path.join(self.service_dir, unit), text)
+        if not self.can_install:
+            return False
+        changed = write_if_changed(os.path.join(self.systemd_dir, unit), text)
+        if changed:
+            with self.lock:
+                self.reload_pending = True
+        return changed
+
+    def install_file(self, path: str) -> bool:
+        """Install a rendered unit file under its own name"""
+        with open(path, "r") as f:
+            return self.install(os.path.basename(path), f.read())
+
+    def remove(self, unit: str) -> bool:
+        """Remove a unit from systemd and the services directory; True if systemd's copy existed"""
+        user_copy = os.path.join(self.service_dir, unit)
+        if os.path.exists(user_copy):
+            os.remove(user_copy)
+        system_copy = os.path.join(self.systemd_dir, unit)
+        if not os.path.exists(system_copy):
+            return False
+        os.remove(system_copy)
+        with self.lock:
+            self.reload_pending = True
+        return True
+
+    def reload(self) -> bool:
+        """Run one daemon-reload if any unit changed since the last one; False if it failed"""
+        with self.lock:
+            if not self.reload_pending:
+                return True
+            self.reload_pending = False
+        result = subprocess.run([self.systemctl, "daemon-reload"], capture_output=True, text=True)
+        if result.returncode != 0:
+            with self.lock:
+                self.reload_pending = True
+            return False
+        return True
+
+    def restart_units(self, units: List[str]) -> List[str]:
+        """Restart `units`; returns those that failed to restart"""
+        failed = []
+        for unit in units:
+            result = subprocess.run([self.systemctl, "restart", unit], capture_output=True, text=True)
+            if result.returncode != 0:
+                failed.append(unit)
+        return failed
+
+    def replace_units(self, replacements: List[Tuple[str, str]], start: Set[str]) -> List[str]:
+        """Swap legacy per-tunnel units for template instances with a single reload
+
+        `replacements` are (legacy unit, instance) pairs whose instance files are
+        already written; instances of legacy units listed in `start` are started.
+        Returns the instances that failed to start.
+        """
+        if not replacements:
+            return []
+        legacy = [old for old, _ in replacements]
+        subprocess.run([self.systemctl, "stop", *legacy], capture_output=True, text=True)
+        subprocess.run([self.systemctl, "disable", "--no-reload", *legacy], capture_output=True, text=True)
+        for unit in legacy:
+            self.remove(unit)
+        self.reload()
+        subprocess.run([self.systemctl, "enable", "--no-reload", *[new for _, new in replacements]],
+                       capture_output=True, text=True)
+        failed = []
+        for old, new in replacements:
+            if old in start:
+                result = subprocess.run([self.systemctl, "start", new], capture_output=True, text=True)
+                if result.returncode != 0:
+                    failed.append(new)
+        return failed
@@ -0,0 +1,124 @@
+import os
+import stat
+import tempfile
+import unittest
+
+from exporter import MetricsExporter
+from netlink import LinkInfo
+from service_status import ServiceStatus
+
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:     100       1    0    0    0     0          0         0      100       1    0    0    0     0       0          0
+ game1:    5000      50    1    2    0     0          0         0     7000      70    3    4    0     0       0          0
+"""
+
+# Answers `systemctl show --property=... -- <units>` for the units it is asked about
+SYSTEMCTL = """#!/bin/sh
+for unit in "$@"; do
+    case "$unit" in
+        tinyvpn@game1-server.service)
+            printf 'Id=%s\\nLoadState=loaded\\nActiveState=active\\nSubState=running\\nNRestarts=3\\nMainPID=4242\\n\\n' "$unit";;
+        *@*)
+            printf 'Id=%s\\nLoadState=not-found\\nActiveState=inactive\\nSubState=dead\\nNRestarts=0\\nMainPID=0\\n\\n' "$unit";;
+    esac
+done
+"""
+
+
+class FakeBackend:
+    """The parts of TinyVPN, UDP2Raw and FRP the exporter uses"""
+
+    def __init__(self, base_dir: str, unit_prefix: str, configs=()):
+        self.base_dir = base_dir
+        self.unit_prefix = unit_prefix
+        self.configs = [{"name": name, "type": role} for name, role in configs]
+
+    def get_available_configs(self):
+        return self.configs
+
+    def get_service_name(self, config_name: str, config_type: str) -> str:
+        return f"{self.unit_prefix}@{config_name}-{config_type}.service"
+
+    def load_config(self, config_name: str):
+        return {"FEC": "-f20:10"}
+
+    def probe_tunnels(self, names, count: int = 3, timeout: float = 2.0):
+        return {}
+
+
+class MetricsExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        self.proc_root = os.path.join(root, "proc")
+        os.makedirs(os.path.join(self.proc_root, "net"))
+        os.makedirs(os.path.join(self.proc_root, "4242"))
+        with open(os.path.join(self.proc_root, "net", "dev"), "w") as f:
+            f.write(NET_DEV)
+        clock_ticks = os.sysconf("SC_CLK_TCK")
+        with open(os.path.join(self.proc_root, "4242", "stat"), "w") as f:
+            # utime and stime of two and one seconds, after a command name with a space in it
+            f.write(f"4242 (tiny vpn) S 1 4242 4242 0 -1 4194560 0 0 0 0 {2 * clock_ticks} {clock_ticks} 0 0\n")
+        with open(os.path.join(self.proc_root, "4242", "statm"), "w") as f:
+            f.write("1000 250 100 10 0 200 0\n")
+        systemctl = os.path.join(root, "systemctl")
+        with open(systemctl, "w") as f:
+            f.write(SYSTEMCTL)
+        os.chmod(systemctl, os.stat(systemctl).st_mode | stat.S_IXUSR)
+
+        self.tinyvpn = FakeBackend(root, "tinyvpn", [("game1", "server"), ("game2", "client")])
+        self.udp2raw = FakeBackend(root, "udp2raw")
+        self.frp = FakeBackend(root, "frps")
+        self.service_status = ServiceStatus(systemctl=systemctl)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def collect(self, **kwargs) -> str:
+        return MetricsExporter(self.tinyvpn, self.udp2raw, self.frp, self.service_status,
+                               proc_root=self.proc_root, **kwargs).collect()
+
+    def test_reads_counters_units_and_processes_from_fake_tree(self):
+        text = self.collect()
+        game1 = 'name="game1",role="server",backend="tinyvpn"'
+        game2 = 'name="game2",role="client",backend="tinyvpn"'
+        for line in [
+            f"gamingtunnel_interface_present{{{game1}}} 1",
+            f"gamingtunnel_interface_present{{{game2}}} 0",
+            f"gamingtunnel_interface_receive_bytes_total{{{game1}}} 5000",
+            f"gamingtunnel_interface_transmit_packets_total{{{game1}}} 70",
+            f"gamingtunnel_interface_transmit_drop_total{{{game1}}} 4",
+            f"gamingtunnel_fec_redundant_packets{{{game1}}} 20",
+            f"gamingtunnel_fec_data_packets{{{game1}}} 10",
+            f"gamingtunnel_probe_success{{{game1}}} 0",
+            f"gamingtunnel_service_active{{{game1}}} 1",
+            f"gamingtunnel_service_active{{{game2}}} 0",
+            f"gamingtunnel_service_restarts_total{{{game1}}} 3",
+            f"gamingtunnel_process_cpu_seconds_total{{{game1}}} 3.0",
+            f"gamingtunnel_process_resident_memory_bytes{{{game1}}} {250 * os.sysconf('SC_PAGE_SIZE')}",
+        ]:
+            self.assertIn(line + "\n", text)
+        self.assertNotIn(f"gamingtunnel_interface_receive_bytes_total{{{game2}}}", text)
+        self.assertNotIn(f"gamingtunnel_process_cpu_seconds_total{{{game2}}}", text)
+        self.assertIn("# TYPE gamingtunnel_service_restarts_total counter\n", text)
+
+    def test_link_state_skipped_for_fake_proc_root(self):
+        text = self.collect()
+        self.assertNotIn("gamingtunnel_interface_up", text)
+        self.assertNotIn("gamingtunnel_interface_mtu_bytes", text)
+
+    def test_link_state_from_injected_reader(self):
+        link = LinkInfo(7, "game1", 0)
+        link.operstate = "UP"
+        link.mtu = 1250
+        text = self.collect(link_reader=lambda: {"game1": link})
+        self.assertIn('gamingtunnel_interface_up{name="game1",role="server",backend="tinyvpn"} 1\n', text)
+        self.assertIn('gamingtunnel_interface_up{name="game2",role="client",backend="tinyvpn"} 0\n', text)
+        self.assertIn('gamingtunnel_interface_mtu_bytes{name="game1",role="server",backend="tinyvpn"} 1250\n', text)
+        self.assertNotIn('gamingtunnel_interface_mtu_bytes{name="game2"', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from log_events import LogEventIndex
+
+
+LINES = 20000
+
+
+def index_log(db_path: str, log_path: str, start, results):
+    index = LogEventIndex(db_path)
+    start.wait()
+    try:
+        results.put(index.index_file(log_path, "game1", "tinyvpn", batch=500))
+    finally:
+        index.close()
+
+
+class FailingIndex(LogEventIndex):
+    """Raises in the second batch, as a process killed between batches would stop"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.batches = 0
+
+    def store(self, events):
+        self.batches += 1
+        if self.batches == 2:
+            raise RuntimeError("killed")
+        super().store(events)
+
+
+class LogEventIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "events.db")
+        self.log_path = os.path.join(self.tmp.name, "tunnelgame1.log")
+        with open(self.log_path, "w") as f:
+            for number in range(LINES):
+                f.write(f"[2026-10-17 10:{number // 1000 % 60:02d}:00][INFO]new connection from "
+                        f"10.0.0.{number % 250}:{1024 + number}\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assert_counted_once(self, index: LogEventIndex):
+        events = index.db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        counts = index.db.execute("SELECT SUM(count) FROM event_counts").fetchone()[0]
+        self.assertEqual(events, LINES)
+        self.assertEqual(counts, LINES)
+
+    def test_concurrent_indexers_store_each_line_once(self):
+        LogEventIndex(self.db_path).close()
+        context = multiprocessing.get_context("fork")
+        start = context.Event()
+        results = context.Queue()
+        workers = [context.Process(target=index_log, args=(self.db_path, self.log_path, start, results))
+                   for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join(60)
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(results.get(timeout=5) + results.get(timeout=5), LINES)
+
+        index = LogEventIndex(self.db_path)
+        try:
+            self.assertEqual(index.index_file(self.log_path, "game1", "tinyvpn"), 0)
+            self.assert_counted_once(index)
+        finally:
+            index.close()
+
+    def test_pass_interrupted_between_batches_resumes(self):
+        failing = FailingIndex(self.db_path)
+        try:
+            with self.assertRaises(RuntimeError):
+                failing.index_file(self.log_path, "game1", "tinyvpn", batch=500)
+        finally:
+            failing.close()
+
+        index = LogEventIndex(self.db_path)
+        try:
+            self.assertEqual(index.index_file(self.log_path, "game1", "tinyvpn", batch=500), LINES - 500)
+            self.assert_counted_once(index)
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
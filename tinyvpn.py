@@ -1,5 +1,6 @@
 import os
 import subprocess
+import time
 import socket
 import re
 import shutil
@@ -11,16 +12,43 @@ from rich.console import Console
 from rich.prompt import Prompt, IntPrompt, Confirm
 from rich import print as rich_print
 
+from service_status import ServiceStatus
+from config_registry import ConfigRecord, ConfigRegistry
+from systemd_units import (UnitInstaller, render_env, render_unit, write_if_changed, parse_exec_start, split_password,
+                           parse_env)
+from netdev import NetDevSnapshot, format_bits
+from netlink import NetlinkClient, LinkInfo
+from icmp_probe import IcmpProber, PingStats
+from monitor import MonitorClient
+from latency import LatencyTracker, format_latency_report
+from restart import IdleRestart
+from fifo_control import FifoControl, live_commands
+from pmtu import PmtuCache, UPLINK_ADDRESS, default_cache_path, find_pmtu, ip_version, route_mtu, tinyvpn_mtu
+from logtail import tail
+
 
 class TinyVPN:
-    def __init__(self):
+    def __init__(self, service_status: Optional[ServiceStatus] = None, registry: Optional[ConfigRegistry] = None,
+                 units: Optional[UnitInstaller] = None):
         """Initialize the TinyVPN class"""
         self.console = Console()
+        self.service_status = service_status or ServiceStatus()
+        self.netlink = NetlinkClient()
         # Use user's home directory for more accessibility
         self.home_dir = os.path.expanduser("~")
         self.base_dir = os.path.join(self.home_dir, ".gamingtunnel")
         self.configs_dir = os.path.join(self.base_dir, "configs")
         self.binary_path = os.path.join(self.base_dir, "tinyvpn")
+        # Per-instance arguments of the tinyvpn@.service template
+        self.env_dir = os.path.join(self.base_dir, "env")
+        # Control FIFOs of the running tunnels, created by tinyvpn itself
+        self.fifo_dir = os.path.join(self.base_dir, "fifo")
+        self.registry = registry or ConfigRegistry(self.base_dir)
+        self.config_loader = self.registry.loader
+        self.units = units or UnitInstaller(self.base_dir)
+        self.control = FifoControl(self)
+        # Path MTUs measured per peer address
+        self.pmtu_cache = PmtuCache(default_cache_path(self.base_dir))
         
         # Ensure directories exist
         if not os.path.isdir(self.configs_dir):
@@ -33,6 +61,30 @@ class TinyVPN:
             style = f"{color} bold"
         rich_print(f"[{style}]{text}[/{style}]")
     
+    TEMPLATE_UNIT = "tinyvpn@.service"
+    
+    def get_service_name(self, config_name: str, config_type: str) -> str:
+        """Get the systemd unit name for a TinyVPN configuration"""
+        service_suffix = "server" if config_type == "server" else "client"
+        return f"tinyvpn@{config_name}-{service_suffix}.service"
+    
+    def get_legacy_service_name(self, config_name: str, config_type: str) -> str:
+        """Per-tunnel unit name used before the switch to tinyvpn@.service"""
+        service_suffix = "server" if config_type == "server" else "client"
+        return f"tinyvpn-{config_name}-{service_suffix}.service"
+    
+    def get_env_file(self, config_name: str, config_type: str) -> str:
+        service_suffix = "server" if config_type == "server" else "client"
+        return os.path.join(self.env_dir, f"tinyvpn-{config_name}-{service_suffix}.env")
+    
+    def get_log_file(self, config_name: str, config_type: str) -> str:
+        service_suffix = "server" if config_type == "server" else "client"
+        return f"/var/log/tunnel{config_name}-{service_suffix}.log"
+    
+    def get_fifo_path(self, config_name: str, config_type: str) -> str:
+        service_suffix = "server" if config_type == "server" else "client"
+        return os.path.join(self.fifo_dir, f"tinyvpn-{config_name}-{service_suffix}.fifo")
+    
     def generate_random_password(self, length=12):
         """Generate a random password for VPN authentication"""
         chars = string.ascii_letters + string.digits + "!@#$%^&*"
@@ -45,63 +97,24 @@ class TinyVPN:
     
     def get_available_configs(self) -> List[dict]:
         """Get a list of available configurations with their types"""
-        if not os.path.exists(self.configs_dir):
-            return []
-        
-        configs = []
-        for item in os.listdir(self.configs_dir):
-            item_path = os.path.join(self.configs_dir, item)
-            if os.path.isdir(item_path):
-                # Check for server configuration
-                server_config_path = os.path.join(item_path, f"server_config_{item}.conf")
-                client_config_path = os.path.join(item_path, f"client_config_{item}.conf")
-                
-                # If both server and client configs exist with the same name
-                if os.path.exists(server_config_path):
-                    configs.append({"name": item, "type": "server"})
-                
-                if os.path.exists(client_config_path):
-                    configs.append({"name": item, "type": "client"})
-        
-        return configs
+        return self.registry.get_available_configs("tinyvpn")
     
     def load_config(self, config_name: str) -> Dict[str, str]:
-        """Load a configuration from a file"""
+        """Load a configuration from a file
+        
+        Parsed files are cached by the shared ConfigLoader and only re-read after they
+        change, so the returned mapping is read-only; use dict(config) to modify it.
+        """
         config_path = os.path.join(self.configs_dir, config_name)
         server_config_path = os.path.join(config_path, f"server_config_{config_name}.conf")
         client_config_path = os.path.join(config_path, f"client_config_{config_name}.conf")
         
-        config = {}
+        # Try server config first, then client config; CONFIG_TYPE is set even if not in file
+        config = self.config_loader.load(server_config_path, defaults={'CONFIG_TYPE': 'server'})
+        if config is None:
+            config = self.config_loader.load(client_config_path, defaults={'CONFIG_TYPE': 'client'})
         
-        # Try server config first
-        if os.path.exists(server_config_path):
-            with open(server_config_path, 'r') as f:
-                for line in f:
-                    if '=' in line:
-                        key, value = line.strip().split('=', 1)
-                        config[key] = value
-            
-            # Ensure CONFIG_TYPE is set even if not in file
-            if 'CONFIG_TYPE' not in config:
-                config['CONFIG_TYPE'] = 'server'
-            
-            return config
-            
-        # Then try client config
-        elif os.path.exists(client_config_path):
-            with open(client_config_path, 'r') as f:
-                for line in f:
-                    if '=' in line:
-                        key, value = line.strip().split('=', 1)
-                        config[key] = value
-            
-            # Ensure CONFIG_TYPE is set even if not in file
-            if 'CONFIG_TYPE' not in config:
-                config['CONFIG_TYPE'] = 'client'
-                
-            return config
-            
-        return {}
+        return config if config is not None else {}
     
     def create_server_config(self, config_name: str) -> bool:
         """Create a new TinyVPN server configuration"""
@@ -164,8 +177,10 @@ class TinyVPN:
             mode = "--timeout 4"
             self.colorize("yellow", "No mode specified, using default timeout 4", bold=False)
         
-        # Get MTU
-        mtu = IntPrompt.ask("Enter MTU value", default=1450)
+        # Get MTU, suggesting the largest that fits this host's uplink
+        suggested, note = self.suggest_mtu(None, fec != "--disable-fec")
+        self.colorize("cyan", f"Suggested MTU {suggested} ({note})", bold=False)
+        mtu = IntPrompt.ask("Enter MTU value", default=suggested)
         
         # Generate or ask for password
         use_random_password = Confirm.ask("Generate a random password?", default=True)
@@ -175,6 +190,142 @@ class TinyVPN:
         else:
             password = Prompt.ask("Enter password for VPN authentication")
         
+        service_name = self.write_server_config(config_name, port, fec, subnet, mode, mtu, password)
+        
+        self.colorize("green", f"TinyVPN server configuration '{config_name}' created successfully!", bold=True)
+        
+        # Automatically install and start the service
+        self.install_service(config_name, service_name)
+        
+        return True
+    
+    def render_unit(self) -> str:
+        """Text of the tinyvpn@.service template shared by every tunnel
+        
+        Instances are named <config>-<server|client> and read their arguments from
+        ~/.gamingtunnel/env/tinyvpn-<instance>.env, so changing a tunnel rewrites
+        that file and restarts one instance without reloading systemd.
+        """
+        return render_unit([
+            ("Unit", {"Description": "GamingVPN TinyVPN tunnel %i", "After": "network.target",
+                      "Wants": "network.target"}),
+            ("Service", {"Type": "simple", "WorkingDirectory": self.base_dir,
+                         "EnvironmentFile": os.path.join(self.env_dir, "tinyvpn-%i.env"),
+                         "ExecStart": f"{self.binary_path} $ARGS -k ${{PASSWORD}}",
+                         "Restart": "always", "RestartSec": 1, "LimitNOFILE": "infinity",
+                         "StandardOutput": "append:/var/log/tunnel%i.log",
+                         "StandardError": "append:/var/log/tunnel%i.error.log",
+                         "LogRateLimitIntervalSec": 0, "LogRateLimitBurst": 0}),
+            ("Install", {"WantedBy": "multi-user.target"}),
+        ])
+    
+    def install_template(self) -> bool:
+        """Install the template unit; True if it changed and a daemon-reload is pending"""
+        return self.units.install(self.TEMPLATE_UNIT, self.render_unit())
+    
+    def write_instance(self, config_name: str, config_type: str, args: str, password: str) -> str:
+        """Write the environment file of a template instance; returns the instance's unit name"""
+        os.makedirs(self.env_dir, exist_ok=True)
+        os.makedirs(self.fifo_dir, exist_ok=True)
+        write_if_changed(self.get_env_file(config_name, config_type), render_env({"ARGS": args, "PASSWORD": password}),
+                         mode=0o600)
+        return self.get_service_name(config_name, config_type)
+    
+    def get_command(self, config_name: str, config_type: str) -> Optional[List[str]]:
+        """Command line of an instance as the template runs it, or None without an environment file"""
+        try:
+            with open(self.get_env_file(config_name, config_type), "r") as f:
+                env = parse_env(f.read())
+        except OSError:
+            return None
+        # systemd splits an unbraced $ARGS on whitespace
+        return [self.binary_path, *env.get("ARGS", "").split(), "-k", env.get("PASSWORD", "")]
+    
+    def is_unit_installed(self, config_name: str, config_type: str) -> bool:
+        return (self.units.is_installed(self.TEMPLATE_UNIT)
+                and os.path.exists(self.get_env_file(config_name, config_type)))
+    
+    def prepare_migration(self) -> List[Tuple[str, str]]:
+        """Write instance files for configurations still using a per-tunnel unit
+        
+        Returns (legacy unit, instance) pairs for UnitInstaller.replace_units. The
+        arguments are taken from the legacy unit's ExecStart, so the tunnel keeps
+        running exactly as before.
+        """
+        replacements = []
+        for record in self.registry.records("tinyvpn"):
+            legacy = self.get_legacy_service_name(record.name, record.role)
+            try:
+                with open(os.path.join(self.units.systemd_dir, legacy), "r") as f:
+                    args = parse_exec_start(f.read())
+            except OSError:
+                continue
+            args, password = split_password(args or [])
+            password = password or (self.load_config(record.name) or {}).get("PASSWORD")
+            if not args or not password or any(any(c.isspace() for c in arg) for arg in args):
+                self.colorize("yellow", f"Could not migrate {legacy}; save the configuration again to migrate it", bold=False)
+                continue
+            args = self.with_fifo(record.name, record.role, args)
+            replacements.append((legacy, self.write_instance(record.name, record.role, " ".join(args), password)))
+        if replacements:
+            self.install_template()
+        return replacements
+    
+    def with_fifo(self, config_name: str, config_type: str, args: List[str]) -> List[str]:
+        """`args` with the instance's --fifo appended unless they already name one"""
+        if "--fifo" in args:
+            return args
+        return [*args, "--fifo", self.get_fifo_path(config_name, config_type)]
+    
+    def instances_without_fifo(self) -> List[Tuple[ConfigRecord, Dict[str, str]]]:
+        """Records and environments of instances written before tunnels had a control FIFO"""
+        missing = []
+        for record in self.registry.records("tinyvpn"):
+            try:
+                with open(self.get_env_file(record.name, record.role), "r") as f:
+                    env = parse_env(f.read())
+            except OSError:
+                continue
+            args = env.get("ARGS", "").split()
+            if args and "--fifo" not in args:
+                missing.append((record, env))
+        return missing
+    
+    def add_missing_fifo(self) -> List[str]:
+        """Add --fifo to instance files written before tunnels had a control FIFO
+        
+        Returns the instances whose files changed; they take the FIFO at their next restart.
+        """
+        changed = []
+        for record, env in self.instances_without_fifo():
+            args = self.with_fifo(record.name, record.role, env["ARGS"].split())
+            changed.append(self.write_instance(record.name, record.role, " ".join(args), env.get("PASSWORD", "")))
+        return changed
+    
+    def server_args(self, config_name: str, port: int, fec: str, subnet: str, mode: str, mtu: int,
+                    fifo: Optional[str] = None) -> str:
+        """tinyvpn arguments of a server, without the password"""
+        fifo = fifo or self.get_fifo_path(config_name, "server")
+        return (f"-s -l[::]:{port} {fec} --sub-net {subnet} --mtu {mtu} {mode} --tun-dev {config_name} "
+                f"--disable-obscure --fifo {fifo}")
+    
+    def client_args(self, config_name: str, server_addr: str, server_port: int, fec_param: str, subnet: str,
+                    mode_param: str, mtu: int, fifo: Optional[str] = None) -> str:
+        """tinyvpn arguments of a client, without the password"""
+        fifo = fifo or self.get_fifo_path(config_name, "client")
+        return (f"-c -r{server_addr}:{server_port} {fec_param} --sub-net {subnet} {mode_param} --mtu {mtu} "
+                f"--tun-dev {config_name} --keep-reconnect --disable-obscure --fifo {fifo}")
+    
+    def write_server_config(self, config_name: str, port: int, fec: str, subnet: str, mode: str, mtu: int,
+                            password: str, server_ip: Optional[str] = None) -> str:
+        """Write the config, instance and client info files of a server without prompting
+        
+        `fec` and `mode` are TinyVPN options such as '-f10:6' and '--mode 1 --timeout 0'.
+        Returns the instance's unit name; installing the template is up to the caller.
+        """
+        config_path = os.path.join(self.configs_dir, config_name)
+        os.makedirs(config_path, exist_ok=True)
+        
         # Prepare the configuration
         server_cmd = (
             f"-s \"-l[::]:{port}\" {fec} --sub-net {subnet} --mtu {mtu} "
@@ -192,38 +343,15 @@ class TinyVPN:
             f.write(f"PASSWORD={password}\n")
             f.write(f"COMMAND={server_cmd}\n")
             f.write(f"CONFIG_TYPE=server\n")
+        self.registry.update(config_name)
         
-        # Create systemd service file
-        service_file = os.path.join(config_path, f"tinyvpn-{config_name}-server.service")
-        with open(service_file, "w") as f:
-            f.write(f"""[Unit]
-Description=GamingVPN Server {config_name}
-After=network.target
-Wants=network.target
-
-[Service]
-Type=simple
-WorkingDirectory={self.base_dir}
-ExecStart={self.binary_path} {server_cmd}
-Restart=always
-RestartSec=1
-LimitNOFILE=infinity
-
-# Logging configuration
-StandardOutput=append:/var/log/tunnel{config_name}.log
-StandardError=append:/var/log/tunnel{config_name}.error.log
-
-# Optional: log rotation to prevent huge log files
-LogRateLimitIntervalSec=0
-LogRateLimitBurst=0
-
-[Install]
-WantedBy=multi-user.target
-""")
+        # Arguments of the tinyvpn@ instance
+        service_name = self.write_instance(
+            config_name, "server", self.server_args(config_name, port, fec, subnet, mode, mtu), password)
         
         # Create client config info for reference
         client_info_file = os.path.join(config_path, "client_info.txt")
-        server_ip = self.get_server_ip()
+        server_ip = server_ip or self.get_server_ip()
         with open(client_info_file, "w") as f:
             f.write(f"# Client configuration information for {config_name}\n")
             f.write(f"Server IP: {server_ip}\n")
@@ -234,46 +362,80 @@ WantedBy=multi-user.target
             f.write(f"FEC: {fec}\n")
             f.write(f"MTU: {mtu}\n")
             f.write(f"Password: {password}\n")
-            
-        self.colorize("green", f"TinyVPN server configuration '{config_name}' created successfully!", bold=True)
-        
-        # Automatically install and start the service
-        self.install_service(config_name, service_file)
         
+        return service_name
+    
+    def suggest_mtu(self, address: Optional[str], fec: bool = True, refresh: bool = False) -> Tuple[int, str]:
+        """TinyVPN --mtu that fits the path to a peer, and how the path MTU was found
+        
+        Without a peer (a new server does not know its clients) the MTU of the
+        default route is used, which bounds every path but may be too high.
+        """
+        if address:
+            self.colorize("yellow", f"Measuring the path MTU to {address}...", bold=False)
+            pmtu, source = find_pmtu(address, self.pmtu_cache, refresh=refresh)
+        else:
+            address, (pmtu, source) = None, (route_mtu(UPLINK_ADDRESS), "uplink")
+        if pmtu is None:
+            return 1450, "path MTU unknown, using the default"
+        try:
+            version = ip_version(address) if address else 4
+        except ValueError:
+            version = 4
+        notes = {
+            "probe": f"path MTU to {address} is {pmtu}",
+            "cache": f"path MTU to {address} was measured at {pmtu}",
+            "route": f"{address} did not answer probes; the route to it has MTU {pmtu}",
+            "uplink": f"the default route has MTU {pmtu}; the path to clients may be smaller",
+        }
+        return tinyvpn_mtu(pmtu, version, fec), notes[source]
+    
+    def save_settings(self, config_name: str, config_type: str, fec: Optional[str] = None,
+                      mtu: Optional[int] = None) -> bool:
+        """Rewrite a configuration with another FEC option or MTU, keeping its other settings"""
+        config = self.load_config(config_name)
+        if not config or config.get('CONFIG_TYPE') != config_type or not config.get('PASSWORD'):
+            return False
+        fec = fec or config.get('FEC', '-f10:6')
+        if config_type == "server":
+            if mtu is None:
+                mtu_str = config.get('MTU', '--mtu 1450')
+                mtu = int(mtu_str.split(' ')[1]) if ' ' in mtu_str else 1450
+            # Reuse the public IP recorded for clients instead of looking it up again
+            server_ip = None
+            try:
+                with open(os.path.join(self.configs_dir, config_name, "client_info.txt"), "r") as f:
+                    for line in f:
+                        if line.startswith("Server IP:"):
+                            server_ip = line.split(":", 1)[1].strip()
+            except OSError:
+                pass
+            self.write_server_config(config_name, int(config.get('PORT', '20002')), fec,
+                                     config.get('SUBNET', '10.22.23.0'), config.get('MODE', '--mode 1 --timeout 0'),
+                                     mtu, config['PASSWORD'], server_ip)
+        else:
+            self.write_client_config(config_name, config['SERVER_ADDR'], int(config['SERVER_PORT']), fec,
+                                     config['SUBNET'], config['MODE'], mtu or int(config['MTU']),
+                                     int(config.get('TIMEOUT', '4')), config['PASSWORD'])
         return True
     
-    def install_service(self, config_name: str, service_file: str) -> bool:
-        """Install and start a systemd service"""
+    def install_service(self, config_name: str, service_name: str) -> bool:
+        """Install the template unit and enable and start an instance of it"""
         try:
-            # Create a services directory in the user's home directory
-            service_dir = os.path.join(self.base_dir, "services")
-            os.makedirs(service_dir, exist_ok=True)
-            
             # Determine if it's a server or client service
-            service_name = os.path.basename(service_file)
-            is_server = "server" in service_name
-            
-            # Copy the service file to the user's services directory
-            user_service_file = os.path.join(service_dir, service_name)
-            with open(service_file, 'r') as src:
-                with open(user_service_file, 'w') as dst:
-                    dst.write(src.read())
+            is_server = service_name.endswith("-server.service")
             
-            self.colorize("green", f"Created service file: {user_service_file}", bold=True)
+            # Copy the template to ~/.gamingtunnel/services and, as root, to systemd;
+            # systemd is only reloaded when the template itself changed
+            self.install_template()
+            user_service_file = os.path.join(self.units.service_dir, self.TEMPLATE_UNIT)
+            self.colorize("green", f"Service template: {user_service_file}", bold=True)
             
             # Try to install the service if we have permission
             try:
-                systemd_dir = "/etc/systemd/system"
-                if os.access(systemd_dir, os.W_OK):
-                    system_service_file = os.path.join(systemd_dir, service_name)
-                    
-                    # Copy the service file to systemd directory
-                    with open(service_file, 'r') as src:
-                        with open(system_service_file, 'w') as dst:
-                            dst.write(src.read())
-                    
-                    # Reload systemd daemon
-                    subprocess.run(["systemctl", "daemon-reload"], check=True)
+                if self.units.can_install:
+                    if not self.units.reload():
+                        raise RuntimeError("systemctl daemon-reload failed")
                     
                     # Enable and start the service
                     subprocess.run(["systemctl", "enable", service_name], check=True)
@@ -424,90 +586,55 @@ WantedBy=multi-user.target
             self.colorize("yellow", "Modification cancelled.", bold=True)
             return False
         
-        # Prepare the configuration
-        server_cmd = (
-            f"-s \"-l[::]:{new_port}\" {new_fec} --sub-net {new_subnet} --mtu {new_mtu} "
-            f"{new_mode} --tun-dev {config_name} --disable-obscure"
-        )
-        
-        # Save configuration
-        config_file = os.path.join(config_path, f"server_config_{config_name}.conf")
-        with open(config_file, "w") as f:
-            f.write(f"PORT={new_port}\n")
-            f.write(f"FEC={new_fec}\n")
-            f.write(f"SUBNET={new_subnet}\n")
-            f.write(f"MODE={new_mode}\n")
-            f.write(f"MTU=--mtu {new_mtu}\n")
-            f.write(f"COMMAND={server_cmd}\n")
-            f.write(f"CONFIG_TYPE=server\n")
-        
-        # Create systemd service file
-        service_file = os.path.join(config_path, f"tinyvpn-{config_name}-server.service")
-        with open(service_file, "w") as f:
-            f.write(f"""[Unit]
-Description=GamingVPN Server {config_name}
-After=network.target
-Wants=network.target
-
-[Service]
-Type=simple
-WorkingDirectory={self.base_dir}
-ExecStart={self.binary_path} {server_cmd}
-Restart=always
-RestartSec=1
-LimitNOFILE=infinity
+        # Rewrite the configuration, keeping its password
+        password = existing_config.get('PASSWORD') or self.generate_random_password()
 
-# Logging configuration
-StandardOutput=append:/var/log/tunnel{config_name}.log
-StandardError=append:/var/log/tunnel{config_name}.error.log
+        # FEC, MTU and mode changes are pushed to the running tunnel, so players stay
+        # connected; the files are only rewritten once the tunnel has taken them
+        if new_port == port and new_subnet == subnet:
+            commands = live_commands({"FEC": fec, "MTU": str(mtu), "MODE": mode},
+                                     {"FEC": new_fec, "MTU": str(new_mtu), "MODE": new_mode})
+            if commands and self.control.is_available(config_name, "server"):
+                self.colorize("yellow", "Applying changes to the running tunnel...", bold=True)
+                error = self.control.send(config_name, "server", commands)
+                if error is None:
+                    self.write_server_config(config_name, new_port, new_fec, new_subnet, new_mode, new_mtu, password)
+                    self.colorize("green", f"TinyVPN server '{config_name}' updated without a restart!", bold=True)
+                    return True
+                self.colorize("yellow", f"Could not apply the changes live ({error}); restarting instead", bold=True)
 
-# Optional: log rotation to prevent huge log files
-LogRateLimitIntervalSec=0
-LogRateLimitBurst=0
-
-[Install]
-WantedBy=multi-user.target
-""")
-        
-        # Update client config info
-        client_info_file = os.path.join(config_path, "client_info.txt")
-        server_ip = self.get_server_ip()
-        with open(client_info_file, "w") as f:
-            f.write(f"# Client configuration information for {config_name}\n")
-            f.write(f"Server IP: {server_ip}\n")
-            f.write(f"Server Port: {new_port}\n")
-            f.write(f"Subnet: {new_subnet}\n")
-            f.write(f"Server VPN IP: {new_subnet.rsplit('.', 1)[0]}.1\n")
-            f.write(f"Client VPN IP: {new_subnet.rsplit('.', 1)[0]}.2\n")
-            f.write(f"FEC: {new_fec}\n")
-            f.write(f"MTU: {new_mtu}\n")
+        service_name = self.write_server_config(config_name, new_port, new_fec, new_subnet, new_mode, new_mtu, password)
             
         self.colorize("green", f"TinyVPN server configuration '{config_name}' modified successfully!", bold=True)
         
         # Update the service
         self.colorize("yellow", "Updating service...", bold=True)
         try:
-            # Copy service file
-            result = subprocess.run(
-                ["sudo", "cp", service_file, "/etc/systemd/system/"],
-                capture_output=True,
-                text=True
-            )
+            if not self.units.can_install:
+                self.colorize("yellow", "No permission to update the system service. You may need to do it manually:", bold=True)
+                self.colorize("cyan", f"sudo systemctl restart {service_name}", bold=False)
+                return True
             
-            if result.returncode == 0:
-                # Reload systemd and restart service
-                subprocess.run(["sudo", "systemctl", "daemon-reload"], capture_output=True)
-                subprocess.run(["sudo", "systemctl", "restart", f"tinyvpn-{config_name}-server.service"], capture_output=True)
-                self.colorize("green", "Service updated and restarted successfully!", bold=True)
+            # Only the instance's environment file changed; the template (and so
+            # systemd) is only reloaded when it was missing or outdated
+            self.install_template()
+            if not self.units.reload():
+                self.colorize("yellow", "Failed to reload systemd daemon", bold=True)
+            # A restart drops every player on the tunnel, so by default wait for a gap in traffic
+            max_wait = 0.0
+            if Confirm.ask("Wait for a moment without traffic before restarting?", default=True):
+                max_wait = float(IntPrompt.ask("Maximum seconds to wait", default=300))
+                self.colorize("yellow", "Waiting for the tunnel to go idle...", bold=True)
+            report = IdleRestart(self, self.service_status, max_wait=max_wait).restart(config_name, "server")
+            if report.result.error:
+                self.colorize("yellow", f"Failed to restart {service_name}: {report.result.error}", bold=True)
             else:
-                self.colorize("yellow", "Failed to update service automatically. You may need to do it manually:", bold=True)
-                self.colorize("cyan", f"sudo cp {service_file} /etc/systemd/system/", bold=False)
-                self.colorize("cyan", f"sudo systemctl daemon-reload && sudo systemctl restart tinyvpn-{config_name}-server.service", bold=False)
+                self.colorize("green", "Service updated and restarted successfully!", bold=True)
+                print(report.describe())
         except Exception as e:
             self.colorize("red", f"Error updating service: {str(e)}", bold=True)
             self.colorize("yellow", "You may need to manually update the service:", bold=True)
-            self.colorize("cyan", f"sudo cp {service_file} /etc/systemd/system/", bold=False)
-            self.colorize("cyan", f"sudo systemctl daemon-reload && sudo systemctl restart tinyvpn-{config_name}-server.service", bold=False)
+            self.colorize("cyan", f"sudo systemctl restart {service_name}", bold=False)
         
         return True
     
@@ -540,27 +667,33 @@ WantedBy=multi-user.target
             self.colorize("yellow", "No TinyVPN configurations found.", bold=True)
             return
         
+        # Query all units at once so the selection list can show their state
+        states = self.service_status.get_many(
+            [self.get_service_name(config['name'], config['type']) for config in configs]
+        )
+        
         self.colorize("cyan", "Available configurations:", bold=True)
         for i, config in enumerate(configs, 1):
-            print(f"{i}. {config['name']} ({config['type']})")
+            state = states[self.get_service_name(config['name'], config['type'])]
+            print(f"{i}. {config['name']} ({config['type']}) - {state.describe()}")
         
         config_idx = IntPrompt.ask("Select a configuration to check", default=1)
         if 1 <= config_idx <= len(configs):
             selected_config = configs[config_idx - 1]
             config_name = selected_config['name']
             config_type = selected_config['type']
-            service_suffix = "server" if config_type == "server" else "client"
+            service_name = self.get_service_name(config_name, config_type)
             
             try:
                 result = subprocess.run(
-                    ["systemctl", "status", f"tinyvpn-{config_name}-{service_suffix}.service"],
+                    ["systemctl", "status", service_name],
                     capture_output=True,
                     text=True
                 )
                 print(result.stdout)
                 
-                if result.returncode != 0:
-                    self.colorize("yellow", f"Service tinyvpn-{config_name}-{service_suffix} might not be installed or is not running.", bold=True)
+                if not states[service_name].is_active:
+                    self.colorize("yellow", f"Service {service_name} might not be installed or is not running.", bold=True)
             except Exception as e:
                 self.colorize("red", f"Error checking service status: {str(e)}", bold=True)
         else:
@@ -582,16 +715,11 @@ WantedBy=multi-user.target
         if 1 <= config_idx <= len(configs):
             selected_config = configs[config_idx - 1]
             config_name = selected_config['name']
-            log_file = f"/var/log/tunnel{config_name}.log"
+            log_file = self.get_log_file(config_name, selected_config['type'])
             
             try:
                 if os.path.exists(log_file):
-                    result = subprocess.run(
-                        ["tail", "-n", "50", log_file],
-                        capture_output=True,
-                        text=True
-                    )
-                    print(result.stdout)
+                    print("\n".join(tail(log_file, 50)))
                 else:
                     self.colorize("yellow", f"Log file {log_file} not found.", bold=True)
             except Exception as e:
@@ -616,19 +744,19 @@ WantedBy=multi-user.target
             selected_config = configs[config_idx - 1]
             config_name = selected_config['name']
             config_type = selected_config['type']
-            service_suffix = "server" if config_type == "server" else "client"
+            service_name = self.get_service_name(config_name, config_type)
             
             try:
                 result = subprocess.run(
-                    ["systemctl", "restart", f"tinyvpn-{config_name}-{service_suffix}.service"],
+                    ["systemctl", "restart", service_name],
                     capture_output=True,
                     text=True
                 )
                 
                 if result.returncode == 0:
-                    self.colorize("green", f"Service tinyvpn-{config_name}-{service_suffix} restarted successfully.", bold=True)
+                    self.colorize("green", f"Service {service_name} restarted successfully.", bold=True)
                 else:
-                    self.colorize("red", f"Failed to restart service tinyvpn-{config_name}-{service_suffix}.", bold=True)
+                    self.colorize("red", f"Failed to restart service {service_name}.", bold=True)
                     print(result.stderr)
             except Exception as e:
                 self.colorize("red", f"Error restarting service: {str(e)}", bold=True)
@@ -666,27 +794,29 @@ WantedBy=multi-user.target
                 return
             
             try:
-                service_suffix = "server" if config_type == "server" else "client"
-                service_name = f"tinyvpn-{config_name}-{service_suffix}"
+                service_name = self.get_service_name(config_name, config_type)
+                legacy_name = self.get_legacy_service_name(config_name, config_type)
                 
                 # Stop and disable service if it exists
                 subprocess.run(
-                    ["systemctl", "stop", f"{service_name}.service"],
+                    ["systemctl", "stop", service_name, legacy_name],
                     capture_output=True,
                     text=True
                 )
                 
                 subprocess.run(
-                    ["systemctl", "disable", f"{service_name}.service"],
+                    ["systemctl", "disable", service_name, legacy_name],
                     capture_output=True,
                     text=True
                 )
                 
-                # Remove service file if it exists
-                service_path = f"/etc/systemd/system/{service_name}.service"
-                if os.path.exists(service_path):
-                    os.remove(service_path)
-                    subprocess.run(["systemctl", "daemon-reload"], capture_output=True)
+                # Remove the instance's arguments; the shared template stays installed,
+                # so systemd is only reloaded if an unmigrated unit file was removed
+                for path in (self.get_env_file(config_name, config_type), self.get_fifo_path(config_name, config_type)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.units.remove(legacy_name)
+                self.units.reload()
                 
                 # Remove configuration files
                 config_path = os.path.join(self.configs_dir, config_name)
@@ -710,6 +840,7 @@ WantedBy=multi-user.target
                         import shutil
                         shutil.rmtree(config_path)
                         self.colorize("green", f"TinyVPN configuration '{config_name}' removed completely.", bold=True)
+                    self.registry.update(config_name)
                 
                 self.colorize("green", f"TinyVPN {config_type} configuration '{config_name}' removed successfully.", bold=True)
             except Exception as e:
@@ -777,8 +908,10 @@ WantedBy=multi-user.target
             timeout = 4  # Default timeout
             self.colorize("yellow", "No mode specified, using default timeout 4", bold=False)
         
-        # Get MTU
-        mtu = IntPrompt.ask("Enter MTU value", default=1450)
+        # Get MTU, suggesting the largest that fits the path to the server
+        suggested, note = self.suggest_mtu(server_addr, fec != "0")
+        self.colorize("cyan", f"Suggested MTU {suggested} ({note})", bold=False)
+        mtu = IntPrompt.ask("Enter MTU value", default=suggested)
         
         # Generate or ask for password
         use_random_password = Confirm.ask("Generate a random password?", default=True)
@@ -821,6 +954,35 @@ WantedBy=multi-user.target
             password = self.generate_random_password()
             self.colorize("green", f"Generated password: {password}", bold=True)
         
+        config_file, service_name = self.write_client_config(config_name, server_addr, server_port, fec_param, subnet,
+                                                             mode_param, mtu, timeout_value, password)
+        
+        self.colorize("green", f"Client configuration created successfully at {os.path.abspath(config_file)}", bold=True)
+        self.colorize("green", f"Service arguments written to {self.get_env_file(config_name, 'client')}", bold=True)
+        
+        # Install the service
+        installed = self.install_service(config_name, service_name)
+        
+        if installed:
+            self.colorize("green", "Client service installed and started successfully!", bold=True)
+            self.colorize("cyan", f"TinyVPN client '{config_name}' is now connected to {server_addr}:{server_port}", bold=True)
+        else:
+            self.colorize("yellow", "To manually start the service:", bold=True)
+            self.colorize("cyan", f"sudo cp {os.path.join(self.units.service_dir, self.TEMPLATE_UNIT)} /etc/systemd/system/", bold=False)
+            self.colorize("cyan", "sudo systemctl daemon-reload", bold=False)
+            self.colorize("cyan", f"sudo systemctl enable --now {service_name}", bold=False)
+        
+        return config_file
+    
+    def write_client_config(self, config_name: str, server_addr: str, server_port: int, fec_param: str, subnet: str,
+                            mode_param: str, mtu: int, timeout_value: int, password: str) -> Tuple[str, str]:
+        """Write the config and instance files of a client without prompting
+        
+        Returns (config file, instance unit name); installing the template is up to the caller.
+        """
+        config_dir = os.path.join(self.configs_dir, config_name)
+        os.makedirs(config_dir, exist_ok=True)
+        
         # Create client config file
         config_file = os.path.join(config_dir, f"client_config_{config_name}.conf")
         with open(config_file, 'w') as f:
@@ -834,47 +996,26 @@ WantedBy=multi-user.target
             f.write(f"PASSWORD={password}\n")
             f.write(f"CONFIG_NAME={config_name}\n")
             f.write(f"CONFIG_TYPE=client\n")
+        self.registry.update(config_name)
         
-        # Create systemd service file
-        service_file = os.path.join(config_dir, f"tinyvpn-{config_name}-client.service")
-        with open(service_file, 'w') as f:
-            f.write("[Unit]\n")
-            f.write("Description=TinyVPN Client Service\n")
-            f.write("After=network.target\n\n")
-            
-            f.write("[Service]\n")
-            f.write("Type=simple\n")
-            f.write(f"WorkingDirectory={self.base_dir}\n")
-            f.write(f"ExecStart={self.binary_path} -c -r{server_addr}:{server_port} {fec_param} --sub-net {subnet} {mode_param} --mtu {mtu} --tun-dev {config_name} -k \"{password}\" --keep-reconnect --disable-obscure\n")
-            f.write("Restart=always\n")
-            f.write("RestartSec=3\n\n")
-            
-            # Add logging configuration like in server
-            f.write("# Logging configuration\n")
-            f.write(f"StandardOutput=append:/var/log/tunnel{config_name}.log\n")
-            f.write(f"StandardError=append:/var/log/tunnel{config_name}.error.log\n\n")
-            
-            f.write("[Install]\n")
-            f.write("WantedBy=multi-user.target\n")
-        
-        self.colorize("green", f"Client configuration created successfully at {os.path.abspath(config_file)}", bold=True)
-        self.colorize("green", f"Service file created at {os.path.abspath(service_file)}", bold=True)
+        # Arguments of the tinyvpn@ instance
+        service_name = self.write_instance(
+            config_name, "client",
+            self.client_args(config_name, server_addr, server_port, fec_param, subnet, mode_param, mtu), password)
         
-        # Install the service
-        installed = self.install_service(config_name, service_file)
-        
-        if installed:
-            self.colorize("green", "Client service installed and started successfully!", bold=True)
-            self.colorize("cyan", f"TinyVPN client '{config_name}' is now connected to {server_addr}:{server_port}", bold=True)
-        else:
-            self.colorize("yellow", "To manually start the service:", bold=True)
-            self.colorize("cyan", f"sudo cp {os.path.abspath(service_file)} /etc/systemd/system/", bold=False)
-            self.colorize("cyan", "sudo systemctl daemon-reload", bold=False)
-            self.colorize("cyan", f"sudo systemctl enable --now tinyvpn-{config_name}-client.service", bold=False)
-        
-        return config_file
+        return config_file, service_name
     
-    def check_connection(self, config_name: str) -> bool:
+    def get_interface(self, config_name: str, links: Optional[Dict[str, LinkInfo]] = None) -> Optional[LinkInfo]:
+        """Look up the tun interface of a configuration via rtnetlink
+        
+        Pass the result of a shared NetlinkClient.dump() to avoid one dump per tunnel.
+        """
+        if links is None:
+            links = self.netlink.dump()
+        return links.get(config_name)
+    
+    def check_connection(self, config_name: str, timeout: float = 2, snapshot: Optional[NetDevSnapshot] = None,
+                         links: Optional[Dict[str, LinkInfo]] = None) -> bool:
         """Check if VPN connection is established by pinging the server/client IP"""
         config = self.load_config(config_name)
         if not config:
@@ -882,23 +1023,18 @@ WantedBy=multi-user.target
         
         # First check if the VPN interface is up
         try:
-            # Check if the interface exists using ip link
-            ifconfig_result = subprocess.run(
-                ["ip", "link", "show", config_name],
-                capture_output=True,
-                text=True
-            )
-            if ifconfig_result.returncode != 0:
+            link = self.get_interface(config_name, links)
+            if link is None:
                 # Interface doesn't exist
                 return False
             
             # Check if interface is UP
-            if "state UP" not in ifconfig_result.stdout:
+            if not link.is_up:
                 return False
                 
             # If we're here, the interface exists and is UP
             # Let's consider it connected if we can see traffic on it
-            network_stats = self.get_network_stats(config_name)
+            network_stats = self.get_network_stats(config_name, snapshot)
             if network_stats["download"] > 0 or network_stats["upload"] > 0:
                 # There's traffic on the interface, so it's likely connected
                 return True
@@ -907,61 +1043,97 @@ WantedBy=multi-user.target
             print(f"Error checking interface: {str(e)}")
             return False
         
-        # Get subnet from config
-        subnet = config.get('SUBNET', '')
-        if not subnet:
+        # Determine IP to ping based on config type
+        ip_to_ping = self.get_peer_ip(config)
+        if not ip_to_ping:
             return False
         
-        # Determine IP to ping based on config type
+        try:
+            # Ping without binding to the interface, which can cause issues
+            return self.ping_peer(ip_to_ping, count=1, timeout=timeout).reachable
+        except Exception as e:
+            # Print exception for debugging
+            print(f"Error pinging endpoint: {str(e)}")
+            return False
+    
+    def get_peer_ip(self, config: Dict[str, str]) -> Optional[str]:
+        """Get the tunnel IP of the other end of a configuration"""
+        subnet = config.get('SUBNET', '')
+        if not subnet:
+            return None
         if config.get('CONFIG_TYPE') == 'server':
-            # Server: Ping the client IP (x.x.x.2)
-            ip_to_ping = f"{subnet.rsplit('.', 1)[0]}.2"
-        else:
-            # Client: Ping the server IP (x.x.x.1)
-            ip_to_ping = f"{subnet.rsplit('.', 1)[0]}.1"
+            # Server: the client is x.x.x.2
+            return f"{subnet.rsplit('.', 1)[0]}.2"
+        # Client: the server is x.x.x.1
+        return f"{subnet.rsplit('.', 1)[0]}.1"
+    
+    def ping_peer(self, address: str, count: int = 1, timeout: float = 2, device: Optional[str] = None) -> PingStats:
+        """Measure RTT, loss and jitter to a tunnel peer
         
+        Uses the in-process ICMP prober and only falls back to the ping binary when
+        ICMP sockets are not permitted for this user.
+        """
+        try:
+            return IcmpProber(count=count, timeout=timeout).ping(address, device)
+        except PermissionError:
+            pass
+        
+        stats = PingStats(address, address)
+        command = ["ping", "-c", str(count), "-W", str(max(1, int(timeout)))]
+        if device:
+            command += ["-I", device]
         try:
-            # Run ping without specifying interface (-I flag) which can cause issues
             result = subprocess.run(
-                ["ping", "-c", "1", "-W", "2", ip_to_ping],
+                command + [address],
                 capture_output=True,
-                text=True
+                text=True,
+                timeout=count + timeout + 1
             )
-            return result.returncode == 0
-        except Exception as e:
-            # Print exception for debugging
-            print(f"Error pinging endpoint: {str(e)}")
-            return False
+            sent_match = re.search(r"(\d+) packets transmitted, (\d+) received", result.stdout)
+            stats.sent = int(sent_match.group(1)) if sent_match else count
+            stats.rtts = [float(rtt) for rtt in re.findall(r"time=([0-9.]+) ms", result.stdout)]
+            stats.received = len(stats.rtts)
+            # ping does not report which requests were lost, so count them as one trailing burst
+            stats.outcomes = stats.rtts + [None] * (stats.sent - stats.received)
+        except subprocess.TimeoutExpired:
+            stats.sent = count
+            stats.outcomes = [None] * count
+        return stats
+    
+    def probe_tunnels(self, config_names: List[str], count: int = 1, timeout: float = 2,
+                      rate: Optional[float] = None) -> Dict[str, PingStats]:
+        """Probe the peers of many tunnels in one pass, bound to each tunnel's device"""
+        targets = []
+        for config_name in config_names:
+            config = self.load_config(config_name)
+            ip_to_ping = self.get_peer_ip(config) if config else None
+            if ip_to_ping:
+                targets.append((config_name, ip_to_ping, config_name))
+        return IcmpProber(count=count, timeout=timeout, rate=rate).probe(targets)
     
-    def get_network_stats(self, config_name: str) -> dict:
-        """Get network traffic statistics (download/upload) for a tunnel interface"""
+    def get_network_stats(self, config_name: str, snapshot: Optional[NetDevSnapshot] = None) -> dict:
+        """Get network traffic statistics (download/upload) for a tunnel interface
+        
+        Pass a shared NetDevSnapshot to avoid re-reading /proc/net/dev for every tunnel.
+        """
         stats = {"download": 0, "upload": 0, "download_human": "0 B", "upload_human": "0 B"}
         
         try:
-            # Read from /proc/net/dev which contains network interface statistics
-            with open("/proc/net/dev", "r") as f:
-                for line in f:
-                    if config_name in line:
-                        # Format: Interface: Rx bytes packets errs drop fifo frame compressed multicast Tx bytes ...
-                        parts = line.split(":")
-                        if len(parts) != 2:
-                            continue
-                        
-                        values = parts[1].strip().split()
-                        if len(values) < 9:
-                            continue
-                        
-                        # Get received (download) and transmitted (upload) bytes
-                        rx_bytes = int(values[0])  # Download
-                        tx_bytes = int(values[8])  # Upload
-                        
-                        stats["download"] = rx_bytes
-                        stats["upload"] = tx_bytes
-                        
-                        # Convert to human-readable format
-                        stats["download_human"] = self.format_bytes(rx_bytes)
-                        stats["upload_human"] = self.format_bytes(tx_bytes)
-                        break
+            if snapshot is None:
+                snapshot = NetDevSnapshot.read()
+            
+            # Look the interface up by its exact name so 'g1' never matches 'g10'
+            counters = snapshot.get(config_name)
+            if counters is not None:
+                stats.update(counters.as_dict())
+                
+                # Received bytes are the download, transmitted bytes the upload
+                stats["download"] = counters.rx_bytes
+                stats["upload"] = counters.tx_bytes
+                
+                # Convert to human-readable format
+                stats["download_human"] = self.format_bytes(counters.rx_bytes)
+                stats["upload_human"] = self.format_bytes(counters.tx_bytes)
         except Exception as e:
             self.colorize("red", f"Error getting network stats: {str(e)}", bold=False)
         
@@ -982,7 +1154,8 @@ WantedBy=multi-user.target
         else:
             return f"{size} {power_labels[n]}"
     
-    def show_network_usage(self, config_name: str):
+    def show_network_usage(self, config_name: str, snapshot: Optional[NetDevSnapshot] = None,
+                           links: Optional[Dict[str, LinkInfo]] = None):
         """Show detailed network usage information for a specific configuration"""
         config = self.load_config(config_name)
         if not config:
@@ -991,20 +1164,16 @@ WantedBy=multi-user.target
         
         # Check if the VPN interface is up
         interface_status = "DOWN"
+        link = None
         try:
-            # Check if the interface exists using ip link
-            ifconfig_result = subprocess.run(
-                ["ip", "link", "show", config_name],
-                capture_output=True,
-                text=True
-            )
-            if ifconfig_result.returncode == 0 and "state UP" in ifconfig_result.stdout:
+            link = self.get_interface(config_name, links)
+            if link is not None and link.is_up:
                 interface_status = "UP"
         except Exception:
             pass
         
         # Get network statistics
-        stats = self.get_network_stats(config_name)
+        stats = self.get_network_stats(config_name, snapshot)
         
         # Print usage information
         self.colorize("cyan", f"Network Usage for '{config_name}':", bold=True)
@@ -1012,58 +1181,60 @@ WantedBy=multi-user.target
         print(f"Download: {stats['download_human']} ({stats['download']} bytes)")
         print(f"Upload: {stats['upload_human']} ({stats['upload']} bytes)")
         print(f"Total: {self.format_bytes(stats['download'] + stats['upload'])}")
+        if "rx_packets" in stats:
+            print(f"Packets: {stats['rx_packets']} received, {stats['tx_packets']} sent")
+            print(f"Errors: {stats['rx_errs']} rx, {stats['tx_errs']} tx")
+            print(f"Dropped: {stats['rx_drop']} rx, {stats['tx_drop']} tx")
         
         # Show current interface info if it's up
         if interface_status == "UP":
             try:
-                # Get IP address information
-                ip_result = subprocess.run(
-                    ["ip", "addr", "show", config_name],
-                    capture_output=True,
-                    text=True
-                )
+                print("\nInterface Details:")
                 
-                if ip_result.returncode == 0:
-                    print("\nInterface Details:")
-                    
-                    # Extract and print IP address
-                    import re
-                    ip_match = re.search(r"inet\s+([0-9.]+)", ip_result.stdout)
-                    if ip_match:
-                        print(f"IP Address: {ip_match.group(1)}")
+                # Print address and link parameters reported by rtnetlink
+                if link.ipv4_addresses:
+                    print(f"IP Address: {link.ipv4_addresses[0].split('/')[0]}")
+                print(f"MTU: {link.mtu}")
+                print(f"Queue Length: {link.txqueuelen}")
+                
+                # Prefer the monitoring daemon's recent history over probing on demand
+                history = MonitorClient(self.base_dir).latest(seconds=300)
+                recent = history["tunnels"].get(config_name) if history else None
                 
                 # Try to get some stats like packet loss, latency, etc.
-                subnet = config.get('SUBNET', '')
-                if subnet:
-                    # Determine other end's IP based on config type
-                    if config.get('CONFIG_TYPE') == 'server':
-                        # Server: Ping the client IP (x.x.x.2)
-                        ip_to_ping = f"{subnet.rsplit('.', 1)[0]}.2"
+                ip_to_ping = self.get_peer_ip(config)
+                if recent and recent.get("samples"):
+                    print(f"\nLast 5 minutes ({recent['samples']} samples from the monitor):")
+                    print(f"Average Download Rate: {format_bits(recent['rx_bps'])}")
+                    print(f"Average Upload Rate: {format_bits(recent['tx_bps'])}")
+                    print(f"Drops: {recent['drops_ps']:.2f}/s")
+                    latency = MonitorClient(self.base_dir).latency(seconds=300)
+                    report = latency["tunnels"].get(config_name) if latency and "tunnels" in latency else None
+                    if report:
+                        for line in format_latency_report(report):
+                            print(line)
                     else:
-                        # Client: Ping the server IP (x.x.x.1)
-                        ip_to_ping = f"{subnet.rsplit('.', 1)[0]}.1"
-                    
+                        if recent.get("avg_rtt") is not None:
+                            print(f"Latency: {recent['avg_rtt']:.2f} ms (last {recent['rtt'] if recent['rtt'] is not None else 'timeout'})")
+                        print(f"Packet Loss: {recent['loss'] * 100:.0f}%")
+                elif ip_to_ping:
                     print(f"\nConnectivity to {ip_to_ping}:")
                     
-                    # Run ping with 3 packets to check latency
-                    ping_result = subprocess.run(
-                        ["ping", "-c", "3", "-I", config_name, ip_to_ping],
-                        capture_output=True,
-                        text=True
-                    )
+                    # Send 10 echo requests through the tunnel device to measure latency and jitter
+                    ping_stats = self.ping_peer(ip_to_ping, count=10, device=config_name)
                     
-                    if ping_result.returncode == 0:
-                        # Extract average latency
-                        latency_match = re.search(r"min/avg/max.*?= [0-9.]+/([0-9.]+)/[0-9.]+", ping_result.stdout)
-                        if latency_match:
-                            avg_latency = float(latency_match.group(1))
-                            print(f"Latency: {avg_latency:.2f} ms")
+                    if ping_stats.reachable:
+                        tracker = LatencyTracker()
+                        tracker.record(ping_stats.outcomes, time.time())
+                        for line in format_latency_report(tracker.window(tracker.slot_seconds, time.time())):
+                            print(line)
                     else:
                         print("Connection failed: No response to ping")
             except Exception as e:
                 self.colorize("red", f"Error getting interface details: {str(e)}", bold=False) 
     
-    def debug_connection_status(self, config_name: str) -> dict:
+    def debug_connection_status(self, config_name: str, snapshot: Optional[NetDevSnapshot] = None,
+                                links: Optional[Dict[str, LinkInfo]] = None) -> dict:
         """Get detailed debug information about connection status for diagnostics"""
         debug_info = {
             "interface_exists": False,
@@ -1085,17 +1256,16 @@ WantedBy=multi-user.target
         
         # Check if interface exists and is UP
         try:
-            ifconfig_result = subprocess.run(
-                ["ip", "link", "show", config_name],
-                capture_output=True,
-                text=True
-            )
-            debug_info["interface_exists"] = ifconfig_result.returncode == 0
+            link = self.get_interface(config_name, links)
+            debug_info["interface_exists"] = link is not None
             if debug_info["interface_exists"]:
-                debug_info["interface_up"] = "state UP" in ifconfig_result.stdout
+                debug_info["interface_up"] = link.is_up
+                debug_info["operstate"] = link.operstate
+                debug_info["mtu"] = link.mtu
+                debug_info["addresses"] = link.addresses
                 
                 # Check if there's traffic
-                network_stats = self.get_network_stats(config_name)
+                network_stats = self.get_network_stats(config_name, snapshot)
                 debug_info["has_traffic"] = network_stats["download"] > 0 or network_stats["upload"] > 0
                 debug_info["rx_bytes"] = network_stats["download"]
                 debug_info["tx_bytes"] = network_stats["upload"]
@@ -1103,23 +1273,16 @@ WantedBy=multi-user.target
             debug_info["error"] = f"Interface check error: {str(e)}"
         
         # Get subnet information
-        subnet = config.get('SUBNET', '')
-        debug_info["subnet_found"] = bool(subnet)
-        if subnet:
-            if config.get('CONFIG_TYPE') == 'server':
-                debug_info["ip_to_ping"] = f"{subnet.rsplit('.', 1)[0]}.2"
-            else:
-                debug_info["ip_to_ping"] = f"{subnet.rsplit('.', 1)[0]}.1"
+        ip_to_ping = self.get_peer_ip(config)
+        debug_info["subnet_found"] = ip_to_ping is not None
+        if ip_to_ping:
+            debug_info["ip_to_ping"] = ip_to_ping
                 
             # Try pinging without interface specification
             try:
-                result = subprocess.run(
-                    ["ping", "-c", "1", "-W", "2", debug_info["ip_to_ping"]],
-                    capture_output=True,
-                    text=True
-                )
-                debug_info["ping_successful"] = result.returncode == 0
-                debug_info["ping_output"] = result.stdout
+                ping_stats = self.ping_peer(ip_to_ping, count=3)
+                debug_info["ping_successful"] = ping_stats.reachable
+                debug_info["ping_output"] = ping_stats.summary()
             except Exception as e:
                 debug_info["error"] = f"Ping error: {str(e)}"
         
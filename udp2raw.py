@@ -8,16 +8,32 @@ from rich.console import Console
 from rich.prompt import Prompt, IntPrompt, Confirm
 from rich import print as rich_print
 
+from service_status import ServiceStatus
+from config_registry import ConfigRegistry
+from systemd_units import (UnitInstaller, render_env, render_unit, write_if_changed, parse_exec_start, split_password,
+                           parse_env)
+from logtail import tail
+from journal import JournalReader
+
 
 class UDP2Raw:
-    def __init__(self):
+    def __init__(self, service_status: Optional[ServiceStatus] = None, registry: Optional[ConfigRegistry] = None,
+                 units: Optional[UnitInstaller] = None):
         """Initialize the UDP2Raw class"""
         self.console = Console()
+        self.service_status = service_status or ServiceStatus()
+        # Remembers what was already read, so viewing logs again only fetches new entries
+        self.journal = JournalReader()
         # Use user's home directory for more accessibility
         self.home_dir = os.path.expanduser("~")
         self.base_dir = os.path.join(self.home_dir, ".gamingtunnel")
         self.configs_dir = os.path.join(self.base_dir, "configs")
         self.binary_path = os.path.join(self.base_dir, "udp2raw")
+        # Per-instance arguments of the udp2raw@.service template
+        self.env_dir = os.path.join(self.base_dir, "env")
+        self.registry = registry or ConfigRegistry(self.base_dir)
+        self.config_loader = self.registry.loader
+        self.units = units or UnitInstaller(self.base_dir)
         self.default_tunnel_port = 20002  # Default TinyVPN tunnel port
         
         # Ensure directories exist
@@ -31,65 +47,46 @@ class UDP2Raw:
             style = f"{color} bold"
         rich_print(f"[{style}]{text}[/{style}]")
 
+    TEMPLATE_UNIT = "udp2raw@.service"
+    
+    def get_service_name(self, config_name: str, config_type: str) -> str:
+        """Get the systemd unit name for a UDP2Raw configuration"""
+        service_suffix = "server" if config_type == "server" else "client"
+        return f"udp2raw@{config_name}-{service_suffix}.service"
+    
+    def get_legacy_service_name(self, config_name: str, config_type: str) -> str:
+        """Per-tunnel unit name used before the switch to udp2raw@.service"""
+        service_suffix = "server" if config_type == "server" else "client"
+        return f"udp2raw-{config_name}-{service_suffix}.service"
+    
+    def get_env_file(self, config_name: str, config_type: str) -> str:
+        service_suffix = "server" if config_type == "server" else "client"
+        return os.path.join(self.env_dir, f"udp2raw-{config_name}-{service_suffix}.env")
+    
+    def get_log_file(self, config_name: str, config_type: str) -> str:
+        service_suffix = "server" if config_type == "server" else "client"
+        return f"/var/log/udp2raw_{config_name}-{service_suffix}.log"
+
     def get_available_configs(self) -> List[dict]:
         """Get a list of available UDP2Raw configurations with their types"""
-        if not os.path.exists(self.configs_dir):
-            return []
-        
-        configs = []
-        for item in os.listdir(self.configs_dir):
-            item_path = os.path.join(self.configs_dir, item)
-            if os.path.isdir(item_path):
-                # Check for server configuration
-                server_config_path = os.path.join(item_path, f"udp2raw_server_config_{item}.conf")
-                client_config_path = os.path.join(item_path, f"udp2raw_client_config_{item}.conf")
-                
-                # If both server and client configs exist with the same name
-                if os.path.exists(server_config_path):
-                    configs.append({"name": item, "type": "server"})
-                
-                if os.path.exists(client_config_path):
-                    configs.append({"name": item, "type": "client"})
-        
-        return configs
+        return self.registry.get_available_configs("udp2raw")
     
     def load_config(self, config_name: str) -> Dict[str, str]:
-        """Load a UDP2Raw configuration from a file"""
+        """Load a UDP2Raw configuration from a file
+        
+        Parsed files are cached by the shared ConfigLoader and only re-read after they
+        change, so the returned mapping is read-only; use dict(config) to modify it.
+        """
         config_path = os.path.join(self.configs_dir, config_name)
         server_config_path = os.path.join(config_path, f"udp2raw_server_config_{config_name}.conf")
         client_config_path = os.path.join(config_path, f"udp2raw_client_config_{config_name}.conf")
         
-        config = {}
+        # Try server config first, then client config; CONFIG_TYPE is set even if not in file
+        config = self.config_loader.load(server_config_path, defaults={'CONFIG_TYPE': 'server'})
+        if config is None:
+            config = self.config_loader.load(client_config_path, defaults={'CONFIG_TYPE': 'client'})
         
-        # Try server config first
-        if os.path.exists(server_config_path):
-            with open(server_config_path, 'r') as f:
-                for line in f:
-                    if '=' in line:
-                        key, value = line.strip().split('=', 1)
-                        config[key] = value
-            
-            # Ensure CONFIG_TYPE is set even if not in file
-            if 'CONFIG_TYPE' not in config:
-                config['CONFIG_TYPE'] = 'server'
-            
-            return config
-            
-        # Then try client config
-        elif os.path.exists(client_config_path):
-            with open(client_config_path, 'r') as f:
-                for line in f:
-                    if '=' in line:
-                        key, value = line.strip().split('=', 1)
-                        config[key] = value
-            
-            # Ensure CONFIG_TYPE is set even if not in file
-            if 'CONFIG_TYPE' not in config:
-                config['CONFIG_TYPE'] = 'client'
-                
-            return config
-            
-        return {}
+        return config if config is not None else {}
     
     def auto_detect_tinyvpn_port(self, config_name: str) -> Tuple[int, bool]:
         """Try to detect TinyVPN port from an existing TinyVPN config with the same name
@@ -99,25 +96,12 @@ class UDP2Raw:
         tinyvpn_server_config = os.path.join(config_path, f"server_config_{config_name}.conf")
         tinyvpn_client_config = os.path.join(config_path, f"client_config_{config_name}.conf")
         
-        # Check for server config first
-        if os.path.exists(tinyvpn_server_config):
-            with open(tinyvpn_server_config, 'r') as f:
-                for line in f:
-                    if line.startswith("PORT="):
-                        try:
-                            return (int(line.strip().split('=')[1]), True)
-                        except:
-                            pass
-        
-        # Then check client config
-        if os.path.exists(tinyvpn_client_config):
-            with open(tinyvpn_client_config, 'r') as f:
-                for line in f:
-                    if line.startswith("SERVER_PORT="):
-                        try:
-                            return (int(line.strip().split('=')[1]), True)
-                        except:
-                            pass
+        # Check for server config first, then client config
+        for path, key in ((tinyvpn_server_config, "PORT"), (tinyvpn_client_config, "SERVER_PORT")):
+            config = self.config_loader.load(path)
+            port = config.get_int(key) if config is not None else None
+            if port is not None:
+                return (port, True)
         
         # Default port if not found, with flag indicating no config was found
         return (self.default_tunnel_port, False)
@@ -167,56 +151,12 @@ class UDP2Raw:
             default="faketcp"
         )
         
-        # Create config directory if it doesn't exist
-        config_dir = os.path.join(self.configs_dir, config_name)
-        if not os.path.exists(config_dir):
-            os.makedirs(config_dir, exist_ok=True)
-        
-        # Create server command
-        server_cmd = f"-s -l0.0.0.0:{tunnel_port} -r127.0.0.1:{external_port} -a -k \"{password}\" --cipher-mode xor --auth-mode simple --raw-mode {raw_mode}"
-        
-        # Save configuration
-        config_file = os.path.join(config_dir, f"udp2raw_server_config_{config_name}.conf")
-        with open(config_file, "w") as f:
-            f.write(f"TUNNEL_PORT={tunnel_port}\n")
-            f.write(f"EXTERNAL_PORT={external_port}\n")
-            f.write(f"PASSWORD={password}\n")
-            f.write(f"RAW_MODE={raw_mode}\n")
-            f.write(f"COMMAND={server_cmd}\n")
-            f.write(f"CONFIG_TYPE=server\n")
-        
-        # Create systemd service file
-        service_file = os.path.join(config_dir, f"udp2raw-{config_name}-server.service")
-        with open(service_file, "w") as f:
-            f.write(f"""[Unit]
-Description=UDP2Raw Server {config_name}
-After=network.target
-Wants=network.target
-
-[Service]
-Type=simple
-WorkingDirectory={self.base_dir}
-ExecStart={self.binary_path} {server_cmd}
-Restart=always
-RestartSec=1
-LimitNOFILE=infinity
-
-# Logging configuration
-StandardOutput=append:/var/log/udp2raw_{config_name}.log
-StandardError=append:/var/log/udp2raw_{config_name}.error.log
-
-# Optional: log rotation to prevent huge log files
-LogRateLimitIntervalSec=0
-LogRateLimitBurst=0
-
-[Install]
-WantedBy=multi-user.target
-""")
+        service_name = self.write_server_config(config_name, tunnel_port, external_port, password, raw_mode)
         
         self.colorize("green", f"UDP2Raw server configuration '{config_name}' created successfully!", bold=True)
         
         # Automatically install and start the service
-        self.install_service(config_name, service_file)
+        self.install_service(config_name, service_name)
     
     def configure_client(self):
         """Configure a UDP2Raw client (for Iran servers)"""
@@ -269,6 +209,117 @@ WantedBy=multi-user.target
             default="faketcp"
         )
         
+        service_name = self.write_client_config(config_name, server_addr, tunnel_port, external_port, password, raw_mode)
+        
+        self.colorize("green", f"UDP2Raw client configuration '{config_name}' created successfully!", bold=True)
+        
+        # Automatically install and start the service
+        self.install_service(config_name, service_name)
+    
+    def render_unit(self) -> str:
+        """Text of the udp2raw@.service template shared by every tunnel
+        
+        Instances are named <config>-<server|client> and read their arguments from
+        ~/.gamingtunnel/env/udp2raw-<instance>.env.
+        """
+        return render_unit([
+            ("Unit", {"Description": "UDP2Raw tunnel %i", "After": "network.target", "Wants": "network.target"}),
+            ("Service", {"Type": "simple", "WorkingDirectory": self.base_dir,
+                         "EnvironmentFile": os.path.join(self.env_dir, "udp2raw-%i.env"),
+                         "ExecStart": f"{self.binary_path} $ARGS -k ${{PASSWORD}}",
+                         "Restart": "always", "RestartSec": 1, "LimitNOFILE": "infinity",
+                         "StandardOutput": "append:/var/log/udp2raw_%i.log",
+                         "StandardError": "append:/var/log/udp2raw_%i.error.log",
+                         "LogRateLimitIntervalSec": 0, "LogRateLimitBurst": 0}),
+            ("Install", {"WantedBy": "multi-user.target"}),
+        ])
+    
+    def install_template(self) -> bool:
+        """Install the template unit; True if it changed and a daemon-reload is pending"""
+        return self.units.install(self.TEMPLATE_UNIT, self.render_unit())
+    
+    def write_instance(self, config_name: str, config_type: str, args: str, password: str) -> str:
+        """Write the environment file of a template instance; returns the instance's unit name"""
+        os.makedirs(self.env_dir, exist_ok=True)
+        write_if_changed(self.get_env_file(config_name, config_type), render_env({"ARGS": args, "PASSWORD": password}),
+                         mode=0o600)
+        return self.get_service_name(config_name, config_type)
+    
+    def get_command(self, config_name: str, config_type: str) -> Optional[List[str]]:
+        """Command line of an instance as the template runs it, or None without an environment file"""
+        try:
+            with open(self.get_env_file(config_name, config_type), "r") as f:
+                env = parse_env(f.read())
+        except OSError:
+            return None
+        # systemd splits an unbraced $ARGS on whitespace
+        return [self.binary_path, *env.get("ARGS", "").split(), "-k", env.get("PASSWORD", "")]
+    
+    def is_unit_installed(self, config_name: str, config_type: str) -> bool:
+        return (self.units.is_installed(self.TEMPLATE_UNIT)
+                and os.path.exists(self.get_env_file(config_name, config_type)))
+    
+    def prepare_migration(self) -> List[Tuple[str, str]]:
+        """Write instance files for configurations still using a per-tunnel unit
+        
+        Returns (legacy unit, instance) pairs for UnitInstaller.replace_units.
+        """
+        replacements = []
+        for record in self.registry.records("udp2raw"):
+            legacy = self.get_legacy_service_name(record.name, record.role)
+            try:
+                with open(os.path.join(self.units.systemd_dir, legacy), "r") as f:
+                    args = parse_exec_start(f.read())
+            except OSError:
+                continue
+            args, password = split_password(args or [])
+            if not args or password is None or any(any(c.isspace() for c in arg) for arg in args):
+                self.colorize("yellow", f"Could not migrate {legacy}; save the configuration again to migrate it", bold=False)
+                continue
+            replacements.append((legacy, self.write_instance(record.name, record.role, " ".join(args), password)))
+        if replacements:
+            self.install_template()
+        return replacements
+    
+    def server_args(self, tunnel_port: int, external_port: int, raw_mode: str) -> str:
+        """udp2raw arguments of a server, without the password"""
+        return (f"-s -l0.0.0.0:{tunnel_port} -r127.0.0.1:{external_port} -a --cipher-mode xor --auth-mode simple "
+                f"--raw-mode {raw_mode}")
+    
+    def client_args(self, server_addr: str, tunnel_port: int, external_port: int, raw_mode: str) -> str:
+        """udp2raw arguments of a client, without the password"""
+        return (f"-c -l0.0.0.0:{external_port} -r{server_addr}:{tunnel_port} -a --cipher-mode xor --auth-mode simple "
+                f"--raw-mode {raw_mode}")
+    
+    def write_server_config(self, config_name: str, tunnel_port: int, external_port: int, password: str,
+                            raw_mode: str) -> str:
+        """Write the config and instance files of a server without prompting; returns the instance's unit name"""
+        # Create config directory if it doesn't exist
+        config_dir = os.path.join(self.configs_dir, config_name)
+        if not os.path.exists(config_dir):
+            os.makedirs(config_dir, exist_ok=True)
+        
+        # Create server command
+        server_cmd = f"-s -l0.0.0.0:{tunnel_port} -r127.0.0.1:{external_port} -a -k \"{password}\" --cipher-mode xor --auth-mode simple --raw-mode {raw_mode}"
+        
+        # Save configuration
+        config_file = os.path.join(config_dir, f"udp2raw_server_config_{config_name}.conf")
+        with open(config_file, "w") as f:
+            f.write(f"TUNNEL_PORT={tunnel_port}\n")
+            f.write(f"EXTERNAL_PORT={external_port}\n")
+            f.write(f"PASSWORD={password}\n")
+            f.write(f"RAW_MODE={raw_mode}\n")
+            f.write(f"COMMAND={server_cmd}\n")
+            f.write(f"CONFIG_TYPE=server\n")
+        self.registry.update(config_name)
+        
+        # Arguments of the udp2raw@ instance
+        return self.write_instance(config_name, "server", self.server_args(tunnel_port, external_port, raw_mode),
+                                   password)
+    
+    def write_client_config(self, config_name: str, server_addr: str, tunnel_port: int, external_port: int,
+                            password: str, raw_mode: str) -> str:
+        """Write the config and instance files of a client without prompting; returns the instance's unit name"""
         # Create config directory if it doesn't exist
         config_dir = os.path.join(self.configs_dir, config_name)
         if not os.path.exists(config_dir):
@@ -287,71 +338,26 @@ WantedBy=multi-user.target
             f.write(f"RAW_MODE={raw_mode}\n")
             f.write(f"COMMAND={client_cmd}\n")
             f.write(f"CONFIG_TYPE=client\n")
+        self.registry.update(config_name)
         
-        # Create systemd service file
-        service_file = os.path.join(config_dir, f"udp2raw-{config_name}-client.service")
-        with open(service_file, "w") as f:
-            f.write(f"""[Unit]
-Description=UDP2Raw Client {config_name}
-After=network.target
-Wants=network.target
-
-[Service]
-Type=simple
-WorkingDirectory={self.base_dir}
-ExecStart={self.binary_path} {client_cmd}
-Restart=always
-RestartSec=1
-LimitNOFILE=infinity
-
-# Logging configuration
-StandardOutput=append:/var/log/udp2raw_{config_name}.log
-StandardError=append:/var/log/udp2raw_{config_name}.error.log
-
-# Optional: log rotation to prevent huge log files
-LogRateLimitIntervalSec=0
-LogRateLimitBurst=0
-
-[Install]
-WantedBy=multi-user.target
-""")
-        
-        self.colorize("green", f"UDP2Raw client configuration '{config_name}' created successfully!", bold=True)
-        
-        # Automatically install and start the service
-        self.install_service(config_name, service_file)
+        # Arguments of the udp2raw@ instance
+        return self.write_instance(config_name, "client",
+                                   self.client_args(server_addr, tunnel_port, external_port, raw_mode), password)
     
-    def install_service(self, config_name: str, service_file: str) -> bool:
-        """Install and start a systemd service"""
+    def install_service(self, config_name: str, service_name: str) -> bool:
+        """Install the template unit and enable and start an instance of it"""
         try:
-            # Create a services directory in the user's home directory
-            service_dir = os.path.join(self.base_dir, "services")
-            os.makedirs(service_dir, exist_ok=True)
-            
-            # Determine if it's a server or client service
-            service_name = os.path.basename(service_file)
-            
-            # Copy the service file to the user's services directory
-            user_service_file = os.path.join(service_dir, service_name)
-            with open(service_file, 'r') as src:
-                with open(user_service_file, 'w') as dst:
-                    dst.write(src.read())
-            
-            self.colorize("green", f"Created service file: {user_service_file}", bold=True)
+            # Copy the template to ~/.gamingtunnel/services and, as root, to systemd;
+            # systemd is only reloaded when the template itself changed
+            self.install_template()
+            user_service_file = os.path.join(self.units.service_dir, self.TEMPLATE_UNIT)
+            self.colorize("green", f"Service template: {user_service_file}", bold=True)
             
             # Try to install the service if we have permission
             try:
-                systemd_dir = "/etc/systemd/system"
-                if os.access(systemd_dir, os.W_OK):
-                    system_service_file = os.path.join(systemd_dir, service_name)
-                    
-                    # Copy the service file to systemd directory
-                    with open(service_file, 'r') as src:
-                        with open(system_service_file, 'w') as dst:
-                            dst.write(src.read())
-                    
-                    # Reload systemd daemon
-                    subprocess.run(["systemctl", "daemon-reload"], check=True)
+                if self.units.can_install:
+                    if not self.units.reload():
+                        raise RuntimeError("systemctl daemon-reload failed")
                     
                     # Enable and start the service
                     subprocess.run(["systemctl", "enable", service_name], check=True)
@@ -386,27 +392,34 @@ WantedBy=multi-user.target
             self.colorize("yellow", "No UDP2Raw configurations found", bold=True)
             return
         
+        # Query all units at once so the selection list can show their state
+        states = self.service_status.get_many(
+            [self.get_service_name(config['name'], config['type']) for config in configs]
+        )
+        
         self.colorize("cyan", "Select a configuration to check:", bold=True)
         for i, config in enumerate(configs, 1):
-            print(f"{i}. {config['name']} ({config['type']})")
+            state = states[self.get_service_name(config['name'], config['type'])]
+            print(f"{i}. {config['name']} ({config['type']}) - {state.describe()}")
         
         config_idx = IntPrompt.ask("Select a configuration", default=1)
         if 1 <= config_idx <= len(configs):
             config = configs[config_idx - 1]
             config_name = config['name']
+            service_name = self.get_service_name(config_name, config['type'])
             
             try:
                 # Get service status
                 result = subprocess.run(
-                    ["systemctl", "status", f"udp2raw-{config_name}-{config['type']}.service"],
+                    ["systemctl", "status", service_name],
                     capture_output=True,
                     text=True
                 )
                 
                 print(result.stdout)
                 
-                if result.returncode != 0:
-                    self.colorize("yellow", f"Service udp2raw-{config_name}-{config['type']} is not running or not properly installed.", bold=True)
+                if not states[service_name].is_active:
+                    self.colorize("yellow", f"Service {service_name} is not running or not properly installed.", bold=True)
             except Exception as e:
                 self.colorize("red", f"Error checking service status: {str(e)}", bold=True)
         else:
@@ -429,24 +442,19 @@ WantedBy=multi-user.target
             config = configs[config_idx - 1]
             config_name = config['name']
             
-            try:
-                # View logs using journalctl
-                result = subprocess.run(
-                    ["journalctl", "-u", f"udp2raw-{config_name}-{config['type']}.service", "--no-pager", "-n", "100"],
-                    capture_output=True,
-                    text=True
-                )
-                
-                print(result.stdout)
-            except Exception as e:
-                self.colorize("red", f"Error viewing logs: {str(e)}", bold=True)
-                
-                # Alternative method using log files
-                self.colorize("yellow", "Trying to read log files directly...", bold=True)
+            # Merge in the TinyVPN tunnel of the same name, which this one runs through
+            units = [self.get_service_name(config_name, config['type'])]
+            if self.registry.get("tinyvpn", config_name, config['type']) is not None:
+                units.append(f"tinyvpn@{config_name}-{config['type']}.service")
+            entries = self.journal.recent(units, 100)
+            for entry in entries:
+                print(entry.format(show_unit=len(units) > 1))
+            
+            if not entries:
+                # The template appends the tunnel's own output to a file rather than the journal
                 try:
-                    with open(f"/var/log/udp2raw_{config_name}.log", "r") as f:
-                        print(f.read())
-                except:
+                    print("\n".join(tail(self.get_log_file(config_name, config['type']), 100)))
+                except OSError:
                     self.colorize("red", "Failed to read log files.", bold=True)
         else:
             self.colorize("red", "Invalid selection", bold=True)
@@ -466,18 +474,18 @@ WantedBy=multi-user.target
         config_idx = IntPrompt.ask("Select a configuration", default=1)
         if 1 <= config_idx <= len(configs):
             config = configs[config_idx - 1]
-            config_name = config['name']
+            service_name = self.get_service_name(config['name'], config['type'])
             
             try:
                 # Restart service
                 result = subprocess.run(
-                    ["sudo", "systemctl", "restart", f"udp2raw-{config_name}-{config['type']}.service"],
+                    ["sudo", "systemctl", "restart", service_name],
                     capture_output=True,
                     text=True
                 )
                 
                 if result.returncode == 0:
-                    self.colorize("green", f"Service udp2raw-{config_name}-{config['type']} restarted successfully!", bold=True)
+                    self.colorize("green", f"Service {service_name} restarted successfully!", bold=True)
                 else:
                     self.colorize("red", f"Failed to restart service: {result.stderr}", bold=True)
             except Exception as e:
@@ -516,24 +524,29 @@ WantedBy=multi-user.target
                 return
             
             try:
+                service_name = self.get_service_name(config_name, config_type)
+                legacy_name = self.get_legacy_service_name(config_name, config_type)
+                
                 # Stop and disable service if it exists
                 subprocess.run(
-                    ["systemctl", "stop", f"udp2raw-{config_name}-{config_type}.service"],
+                    ["systemctl", "stop", service_name, legacy_name],
                     capture_output=True,
                     text=True
                 )
                 
                 subprocess.run(
-                    ["systemctl", "disable", f"udp2raw-{config_name}-{config_type}.service"],
+                    ["systemctl", "disable", service_name, legacy_name],
                     capture_output=True,
                     text=True
                 )
                 
-                # Remove service file if it exists
-                service_path = f"/etc/systemd/system/udp2raw-{config_name}-{config_type}.service"
-                if os.path.exists(service_path):
-                    os.remove(service_path)
-                    subprocess.run(["systemctl", "daemon-reload"], capture_output=True)
+                # Remove the instance's arguments; the shared template stays installed,
+                # so systemd is only reloaded if an unmigrated unit file was removed
+                env_file = self.get_env_file(config_name, config_type)
+                if os.path.exists(env_file):
+                    os.remove(env_file)
+                self.units.remove(legacy_name)
+                self.units.reload()
                 
                 # Remove configuration files
                 config_path = os.path.join(self.configs_dir, config_name)
@@ -560,6 +573,7 @@ WantedBy=multi-user.target
                         if not (os.path.exists(tinyvpn_server_config) or os.path.exists(tinyvpn_client_config)):
                             shutil.rmtree(config_path)
                             self.colorize("green", f"Configuration directory for '{config_name}' removed completely.", bold=True)
+                    self.registry.update(config_name)
                 
                 self.colorize("green", f"UDP2Raw {config_type} configuration '{config_name}' removed successfully.", bold=True)
             except Exception as e: